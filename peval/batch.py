@@ -0,0 +1,341 @@
+#!/usr/bin/python
+# batch.py -- concurrent batches of runs          -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Run a matrix of runs concurrently, each on cores of its own.
+
+    Every run is a 'peval run' of its own, pinned to a slot: a set of
+    cores taken from a single NUMA node where the machine has several, so
+    that concurrent runs do not compete for cores or memory bandwidth.
+    Memory is bound to the node as well when numactl is installed.
+
+    Progress goes to a journal, one JSON object per line:
+
+      started   :: a run was handed a slot
+      saved     :: 'peval run' saved a Run, with its run_id
+      finished  :: the run exited, with its return code and seconds taken
+      batch     :: the batch is done, with its throughput
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import collections
+import glob
+import json
+import os
+import os.path as osp
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import psutil
+
+from . import utility
+
+
+#####################################
+##         JOURNAL
+#####################################
+
+JOURNAL_LOCK = threading.Lock()
+
+def record(journal, event, **fields):
+    """
+      appends one event to journal.  lines are short and written with one
+      append each, so concurrent peval processes do not interleave them.
+    """
+    fields.update(event=event, time=time.time())
+    line = json.dumps(fields, sort_keys=True) + '\n'
+    with JOURNAL_LOCK:
+        with open(journal, 'a') as f:
+            f.write(line)
+
+
+def read_journal(journal):
+    if not osp.exists(journal):
+        return []
+    with open(journal) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def key(event):
+    return tuple(event[name] for name in ENTRY_FIELDS)
+
+
+def succeeded(journal):
+    """
+      returns the entries that already finished successfully in journal
+    """
+    return set(key(e) for e in read_journal(journal)
+               if e['event'] == 'finished' and e['rc'] == 0)
+
+
+#####################################
+##         MATRIX
+#####################################
+
+ENTRY_FIELDS = ['engine', 'solution', 'config', 'dataset']
+
+def read_matrix(lines):
+    """
+      takes in lines of 'engine solution config dataset', alone or as the
+      'peval run ...' lines driver-peval.py prints; blank lines and
+      comments are skipped
+      returns [(engine, solution, config, dataset)]
+    """
+    entries = []
+    for number, line in enumerate(lines, 1):
+        words = line.split('#', 1)[0].split()
+        if words[:2] == ['peval', 'run']:
+            words = words[2:]
+        if not words:
+            continue
+        if len(words) != len(ENTRY_FIELDS):
+            raise utility.FormattedError(
+              "line {}: expected engine solution config dataset, got '{}'",
+              number, line.strip())
+        entries.append(tuple(words))
+    return entries
+
+
+#####################################
+##         PLACEMENT
+#####################################
+
+Slot = collections.namedtuple('Slot', 'index node cpus')
+
+def parse_cpulist(text):
+    """
+      takes in a kernel cpu list such as '0-3,8,10-11'
+      returns [0, 1, 2, 3, 8, 10, 11]
+    """
+    cpus = []
+    for part in text.strip().split(','):
+        if '-' in part:
+            low, high = part.split('-')
+            cpus.extend(range(int(low), int(high) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def numa_nodes():
+    """
+      returns {node: [cpu]} of the cpus we may run on; a single node None
+      where the kernel does not tell
+    """
+    allowed = set(psutil.Process().cpu_affinity())
+    nodes = {}
+    for path in glob.glob('/sys/devices/system/node/node*/cpulist'):
+        node = int(osp.basename(osp.dirname(path))[len('node'):])
+        with open(path) as f:
+            cpus = [c for c in parse_cpulist(f.read()) if c in allowed]
+        if cpus:
+            nodes[node] = cpus
+    return nodes or {None: sorted(allowed)}
+
+
+def plan_slots(jobs, cores=None):
+    """
+      splits our cpus into jobs slots of cores cpus each, by default as
+      many as divide evenly.  a slot stays within one NUMA node if it can.
+    """
+    nodes = numa_nodes()
+    total = sum(len(cpus) for cpus in nodes.values())
+    cores = cores or max(1, total // jobs)
+
+    slots, rest = [], []
+    for node in sorted(nodes):
+        cpus = nodes[node]
+        while len(cpus) >= cores and len(slots) < jobs:
+            slots.append(Slot(len(slots), node, cpus[:cores]))
+            cpus = cpus[cores:]
+        rest.extend(cpus)
+    while len(rest) >= cores and len(slots) < jobs:
+        # straddles nodes, so memory is not bound
+        slots.append(Slot(len(slots), None, rest[:cores]))
+        rest = rest[cores:]
+
+    if len(slots) < jobs:
+        raise utility.FormattedError(
+          "Cannot give {} runs {} cores each out of {}", jobs, cores, total)
+    return slots
+
+
+def pinned(cpus):
+    """
+      a preexec_fn pinning the child, and so all it starts, to cpus
+    """
+    return lambda: psutil.Process().cpu_affinity(cpus)
+
+
+def numactl(slot, multiple_nodes):
+    """
+      the command prefix binding memory to the slot's node, if it matters
+      and numactl is installed
+    """
+    if slot.node is None or not multiple_nodes:
+        return []
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        if os.access(osp.join(directory, 'numactl'), os.X_OK):
+            return ['numactl', '--membind={}'.format(slot.node)]
+    return []
+
+
+#####################################
+##         EXECUTION
+#####################################
+
+def execute(index, entry, slot, arguments, multiple_nodes):
+    """
+      runs entry on slot as a 'peval run' of its own
+      returns (return code, seconds taken)
+    """
+    fields = dict(zip(ENTRY_FIELDS, entry))
+    command = numactl(slot, multiple_nodes) + \
+      [sys.executable, '-m', 'peval', 'run'] + list(entry) + \
+      ['--journal', arguments.journal]
+    if arguments.cgroup:
+        command.append('--cgroup')
+
+    log = osp.join(arguments.logs, '{:04d}.log'.format(index))
+    record(arguments.journal, 'started', index=index, node=slot.node,
+           cpus=slot.cpus, log=log, **fields)
+
+    start = time.time()
+    with open(log, 'w') as out:
+        rc = subprocess.call(command, stdout=out, stderr=subprocess.STDOUT,
+                             preexec_fn=pinned(slot.cpus))
+    seconds = time.time() - start
+
+    record(arguments.journal, 'finished', index=index, rc=rc,
+           seconds=seconds, **fields)
+    return rc, seconds
+
+
+def run_batch(jobs, arguments):
+    """
+      takes in [(index in the matrix, entry)]
+      runs them, arguments.jobs at a time
+      returns the number that failed
+    """
+    slots = plan_slots(arguments.jobs, arguments.cores)
+    multiple_nodes = len(numa_nodes()) > 1
+    free = queue.Queue()
+    for slot in slots:
+        free.put(slot)
+
+    def work(job):
+        index, entry = job
+        slot = free.get()
+        try:
+            return index, entry, slot, \
+                   execute(index, entry, slot, arguments, multiple_nodes)
+        finally:
+            free.put(slot)
+
+    start, done, failed = time.time(), 0, 0
+    pool = ThreadPool(len(slots))
+    try:
+        for index, entry, slot, (rc, seconds) in \
+            pool.imap_unordered(work, jobs):
+            done += 1
+            failed += rc != 0
+            sys.stderr.write("[{}/{}] {} {} in {:.1f} s on cpus {}\n".format(
+              done, len(jobs), "ok" if rc == 0 else "FAILED ({})".format(rc),
+              ' '.join(e[:8] for e in entry), seconds,
+              ','.join(str(c) for c in slot.cpus)))
+    finally:
+        pool.close()
+        pool.join()
+
+    elapsed = time.time() - start
+    per_hour = done / elapsed * 3600 if elapsed else 0.0
+    record(arguments.journal, 'batch', runs=done, failed=failed,
+           seconds=elapsed, runs_per_hour=per_hour, jobs=len(slots))
+    print("{} runs, {} failed, in {:.1f} s: {:.1f} runs/hour".format(
+      done, failed, elapsed, per_hour))
+    return failed
+
+
+def run_batch_cli(arguments):
+    if arguments.matrix == '-':
+        entries = read_matrix(sys.stdin)
+    else:
+        with open(utility.test_path(arguments.matrix)) as f:
+            entries = read_matrix(f)
+
+    if arguments.journal is None:
+        arguments.journal = time.strftime('batch-%Y%m%d-%H%M%S.jsonl')
+    arguments.journal = osp.abspath(arguments.journal)
+    arguments.logs = osp.splitext(arguments.journal)[0] + '.logs'
+    if not osp.isdir(arguments.logs):
+        os.makedirs(arguments.logs)
+
+    # numbered before skipping any, so a resumed batch keeps its log names
+    jobs = list(enumerate(entries))
+    if arguments.resume:
+        finished = succeeded(arguments.journal)
+        jobs = [(i, e) for i, e in jobs if e not in finished]
+        utility.write("{} runs already done".format(len(entries) - len(jobs)))
+
+    if run_batch(jobs, arguments):
+        return 1
+
+
+def generate_parser(parser):
+    parser.add_argument('matrix', type=str,
+      help="file of 'engine solution config dataset' lines, or - for "
+           "stdin; the 'peval run' lines of driver-peval.py will do")
+
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+      help="runs at a time")
+
+    parser.add_argument('--cores', type=int, default=None,
+      help="cores pinned to each run, by default all split evenly")
+
+    parser.add_argument('--journal', type=str, default=None,
+      help="JSON lines file recording progress, "
+           "batch-<date>-<time>.jsonl by default; logs go next to it")
+
+    parser.add_argument('--resume', action='store_true', default=False,
+      help="skip runs the journal records as successful")
+
+    parser.add_argument('--cgroup', action='store_true', default=False,
+      help="pass --cgroup to every run")
+
+    parser.set_defaults(func=run_batch_cli)
+    return parser
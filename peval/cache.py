@@ -0,0 +1,324 @@
+#!/usr/bin/python
+# cache.py -- persistent cache of unpacked artifacts  -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Persistent cache of unpacked artifacts.
+
+    Artifacts in the store never change once they are named by their
+    digest, so a tree extracted once can serve every later sandbox that
+    asks for the same identifier.  Sandboxes are assembled out of the
+    cache with reflinks, hardlinks, symlinks or plain copies instead of
+    decompressing the archive again.
+
+    This module imports no other part of peval so that utility may import
+    it.
+
+    Environment:
+      PEVAL_CACHE_SIZE  upper bound on the cache, e.g. '20G' (default 8G)
+      PEVAL_CACHE_MODE  auto, reflink, link, symlink, copy or off; auto
+                        reflinks or copies, link and symlink share the
+                        cached files and are only safe for artifacts
+                        that never write to their own files
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import contextlib
+import errno
+import fcntl
+import os
+import os.path as osp
+import shutil
+import stat
+import tempfile
+
+import xdg.BaseDirectory
+
+
+MODES = ['auto', 'reflink', 'link', 'symlink', 'copy', 'off']
+
+# from linux/fs.h, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+
+def parse_size(text):
+    """
+      takes in a size such as '512M' or '20G' or '1048576'
+      returns the number of bytes
+    """
+    text = str(text).strip().upper().rstrip('B')
+    scale = 1
+    for suffix, factor in [('K', 1 << 10), ('M', 1 << 20),
+                           ('G', 1 << 30), ('T', 1 << 40)]:
+        if text.endswith(suffix):
+            text, scale = text[:-1], factor
+            break
+    return int(float(text) * scale)
+
+
+def cache_root():
+    return osp.join(xdg.BaseDirectory.save_cache_path('peval'), 'unpacked')
+
+
+def cache_limit():
+    return parse_size(os.environ.get('PEVAL_CACHE_SIZE', '8G'))
+
+
+def cache_mode():
+    mode = os.environ.get('PEVAL_CACHE_MODE', 'auto').lower()
+    if mode not in MODES:
+        raise ValueError("PEVAL_CACHE_MODE must be one of " + ", ".join(MODES))
+    return mode
+
+
+@contextlib.contextmanager
+def locked(root, exclusive=False, blocking=True):
+    """
+      shared lock while materializing, exclusive lock while evicting, so
+      that a tree is never removed while a sandbox is linking out of it.
+      yields False if a non-blocking lock could not be taken.
+    """
+    with open(osp.join(root, '.lock'), 'a') as lockfile:
+        flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(lockfile, flags)
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+def tree_size(path):
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            total += os.lstat(osp.join(dirpath, name)).st_size
+    return total
+
+
+def freeze_tree(path):
+    """
+      removes write permission from every regular file of a cached tree;
+      hardlinked sandboxes share these inodes with the cache.
+    """
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            full = osp.join(dirpath, name)
+            st = os.lstat(full)
+            if stat.S_ISREG(st.st_mode):
+                os.chmod(full, stat.S_IMODE(st.st_mode) & ~WRITE_BITS)
+
+
+def entry_paths(root, unique_id):
+    return osp.join(root, unique_id), osp.join(root, unique_id + '.size')
+
+
+def touch(meta):
+    try:
+        os.utime(meta, None)
+    except OSError:
+        pass
+
+
+def populate(root, unique_id, archive, extract):
+    """
+      extracts archive into the cache under unique_id and returns the tree.
+      extraction happens in a scratch directory that is renamed into place,
+      so concurrent peval processes never see a half extracted tree.
+    """
+    tree, meta = entry_paths(root, unique_id)
+    if osp.isdir(tree) and osp.exists(meta):
+        touch(meta)
+        return tree
+
+    scratch = tempfile.mkdtemp(prefix='.tmp-' + unique_id + '.', dir=root)
+    try:
+        extract(archive, osp.join(scratch, 'tree'))
+        freeze_tree(osp.join(scratch, 'tree'))
+        try:
+            os.rename(osp.join(scratch, 'tree'), tree)
+        except OSError as e:
+            # another process won the race; its tree is just as good
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+        with open(meta, 'w') as f:
+            f.write(str(tree_size(tree)))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return tree
+
+
+def reflink(src, dst):
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def place_file(src, dst, mode, state):
+    """
+      puts one cached file at dst according to mode.  state remembers which
+      methods the filesystem refused so that we only pay for that once.
+    """
+    if osp.lexists(dst):
+        os.unlink(dst)
+
+    if mode == 'symlink':
+        os.symlink(src, dst)
+        return
+
+    if mode in ('auto', 'reflink') and not state.get('no-reflink'):
+        try:
+            reflink(src, dst)
+            shutil.copymode(src, dst)
+            os.chmod(dst, os.stat(dst).st_mode | stat.S_IWUSR)
+            return
+        except (IOError, OSError):
+            state['no-reflink'] = True
+            if osp.lexists(dst):
+                os.unlink(dst)
+
+    # auto never hardlinks: a sandbox writing a file in place would change
+    # the cached inode, and with it every later sandbox of that identifier
+    if mode == 'link' and not state.get('no-link'):
+        try:
+            os.link(src, dst)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            state['no-link'] = True
+
+    shutil.copy2(src, dst)
+    os.chmod(dst, os.stat(dst).st_mode | stat.S_IWUSR)
+
+
+def assemble(tree, dest, mode):
+    """
+      recreates the cached tree at dest, merging into dest if it exists
+    """
+    if not osp.exists(dest):
+        os.makedirs(dest)
+
+    state = {}
+    for dirpath, dirnames, filenames in os.walk(tree):
+        rel = osp.relpath(dirpath, tree)
+        target = dest if rel == '.' else osp.join(dest, rel)
+
+        for name in dirnames:
+            src = osp.join(dirpath, name)
+            dst = osp.join(target, name)
+            if osp.islink(src):
+                if osp.lexists(dst):
+                    os.unlink(dst)
+                os.symlink(os.readlink(src), dst)
+            elif not osp.isdir(dst):
+                os.mkdir(dst)
+
+        for name in filenames:
+            src = osp.join(dirpath, name)
+            dst = osp.join(target, name)
+            if osp.islink(src):
+                if osp.lexists(dst):
+                    os.unlink(dst)
+                os.symlink(os.readlink(src), dst)
+            else:
+                place_file(src, dst, mode, state)
+
+    return dest
+
+
+def evict(root, limit, keep=()):
+    """
+      removes least recently used trees until the cache fits within limit.
+      gives up quietly if some other process is currently materializing.
+    """
+    with locked(root, exclusive=True, blocking=False) as have_lock:
+        if not have_lock:
+            return 0
+
+        entries = []
+        for name in os.listdir(root):
+            if not name.endswith('.size'):
+                continue
+            meta = osp.join(root, name)
+            try:
+                with open(meta) as f:
+                    size = int(f.read() or 0)
+                entries.append((os.stat(meta).st_mtime, size, name[:-5]))
+            except (IOError, OSError, ValueError):
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+        for _, size, unique_id in sorted(entries):
+            if total <= limit:
+                break
+            if unique_id in keep:
+                continue
+            tree, meta = entry_paths(root, unique_id)
+            os.unlink(meta)
+            shutil.rmtree(tree, ignore_errors=True)
+            total -= size
+            freed += size
+
+        return freed
+
+
+def materialize(unique_id, archive, dest, extract):
+    """
+      takes in an artifact identifier, the path of its archive in the store,
+      a destination directory and the function used to extract an archive
+      returns dest, populated with the artifact's contents
+
+      the artifact is extracted into the cache on first use only
+    """
+    mode = cache_mode()
+    if mode == 'off':
+        return extract(archive, dest)
+
+    root = cache_root()
+    if not osp.isdir(root):
+        os.makedirs(root)
+
+    with locked(root):
+        tree = populate(root, unique_id, archive, extract)
+        assemble(tree, dest, mode)
+
+    evict(root, cache_limit(), keep=(unique_id,))
+    return dest
@@ -0,0 +1,268 @@
+#!/usr/bin/python
+# cgroup.py -- cgroup v2 accounting of runs       -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    cgroup v2 accounting of runs.
+
+    Where the unified hierarchy is mounted and the cgroup peval runs in is
+    delegated to its user, run.sh is started in a leaf cgroup of its own,
+
+      <cgroup of peval>/peval.<pid>.<n>
+
+    Everything run.sh starts stays in the leaf, daemons that re-parent
+    themselves to init included, and at exit the kernel's own counters are
+    read:
+
+      cpu_usec, user_usec, system_usec  :: from cpu.stat
+      memory_peak                       :: memory.peak, in bytes
+      io_read_bytes, io_write_bytes     :: io.stat, over every device
+
+    The kernel only lets a cgroup without processes of its own hand
+    controllers to its children, so peval first moves itself into a
+    'peval.supervisor' leaf next to the run's.  Counters of controllers
+    that are not delegated read as None; cpu.stat is always there.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import errno
+import itertools
+import os
+import os.path as osp
+import signal
+import time
+
+
+CONTROLLERS = ['cpu', 'memory', 'io', 'pids']
+
+SUPERVISOR = 'peval.supervisor'
+
+COUNTER = itertools.count()
+
+
+class Unavailable(Exception):
+    pass
+
+
+def read_file(path):
+    with open(path) as f:
+        return f.read()
+
+
+def write_file(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def mount_point():
+    """
+      where the unified (version 2) hierarchy is mounted, None if nowhere
+    """
+    try:
+        lines = read_file('/proc/self/mountinfo').splitlines()
+    except IOError:
+        return None
+    for line in lines:
+        mount, fields = line.split(' - ', 1)
+        if fields.split()[0] == 'cgroup2':
+            return mount.split()[4]
+    return None
+
+
+def own_cgroup():
+    """
+      the path of our cgroup within the unified hierarchy
+    """
+    for line in read_file('/proc/self/cgroup').splitlines():
+        if line.startswith('0::'):
+            return line[3:]
+    raise Unavailable("not in a cgroup v2 hierarchy")
+
+
+def delegate(parent):
+    """
+      enables what CONTROLLERS parent offers for its children, moving
+      peval into the supervisor leaf first if need be
+    """
+    offered = read_file(osp.join(parent, 'cgroup.controllers')).split()
+    enabled = read_file(osp.join(parent, 'cgroup.subtree_control')).split()
+    wanted = [c for c in CONTROLLERS if c in offered and c not in enabled]
+    if not wanted:
+        return
+
+    supervisor = osp.join(parent, SUPERVISOR)
+    try:
+        os.mkdir(supervisor)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    write_file(osp.join(supervisor, 'cgroup.procs'), str(os.getpid()))
+    write_file(osp.join(parent, 'cgroup.subtree_control'),
+               ' '.join('+' + c for c in wanted))
+
+
+class Leaf(object):
+    """
+      the cgroup of one run
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def create(cls):
+        """
+          returns a new Leaf; raises Unavailable when cgroups are not
+          mounted or not delegated to us
+        """
+        root = mount_point()
+        if root is None:
+            raise Unavailable("cgroup2 is not mounted")
+        parent = root + own_cgroup()
+        if osp.basename(parent) == SUPERVISOR:
+            parent = osp.dirname(parent)
+
+        path = osp.join(parent, 'peval.%d.%d' % (os.getpid(), next(COUNTER)))
+        try:
+            delegate(parent)
+            os.mkdir(path)
+        except (IOError, OSError) as e:
+            raise Unavailable("cannot create a cgroup under {}: {}".format(
+              parent, e.strerror or e))
+        return cls(path)
+
+    def enter(self):
+        """
+          moves the calling process into the leaf; a preexec_fn for Popen
+        """
+        write_file(osp.join(self.path, 'cgroup.procs'), str(os.getpid()))
+
+    def pids(self):
+        try:
+            text = read_file(osp.join(self.path, 'cgroup.procs'))
+        except IOError:
+            return []
+        return [int(pid) for pid in text.split()]
+
+    def read(self, name):
+        try:
+            return read_file(osp.join(self.path, name))
+        except IOError:
+            return None
+
+    def usage_usec(self):
+        """
+          CPU time used in the leaf so far, in microseconds
+        """
+        return self.cpu_stat().get('usage_usec', 0)
+
+    def cpu_stat(self):
+        text = self.read('cpu.stat') or ''
+        return dict((key, int(value)) for key, value in
+                    (line.split() for line in text.splitlines()))
+
+    def io_bytes(self):
+        text = self.read('io.stat')
+        if text is None:
+            return None, None
+        read_bytes, write_bytes = 0, 0
+        for line in text.splitlines():
+            for field in line.split()[1:]:
+                key, value = field.split('=')
+                if key == 'rbytes':
+                    read_bytes += int(value)
+                elif key == 'wbytes':
+                    write_bytes += int(value)
+        return read_bytes, write_bytes
+
+    def stats(self):
+        """
+          returns the counters of the leaf, as listed above
+        """
+        cpu = self.cpu_stat()
+        peak = self.read('memory.peak')
+        read_bytes, write_bytes = self.io_bytes()
+        return dict(
+          cpu_usec=cpu.get('usage_usec', 0),
+          user_usec=cpu.get('user_usec'),
+          system_usec=cpu.get('system_usec'),
+          memory_peak=int(peak) if peak else None,
+          io_read_bytes=read_bytes,
+          io_write_bytes=write_bytes)
+
+    def limit_memory(self, limit):
+        """
+          has the kernel kill processes of the leaf rather than let it use
+          more than limit bytes; returns False where memory is not delegated
+        """
+        path = osp.join(self.path, 'memory.max')
+        if not osp.exists(path):
+            return False
+        write_file(path, str(limit))
+        return True
+
+    def oom_kills(self):
+        """
+          processes of the leaf the kernel killed for passing memory.max
+        """
+        for line in (self.read('memory.events') or '').splitlines():
+            name, _, value = line.partition(' ')
+            if name == 'oom_kill':
+                return int(value)
+        return 0
+
+    def kill(self):
+        """
+          kills whatever run.sh left behind in the leaf
+        """
+        if osp.exists(osp.join(self.path, 'cgroup.kill')):
+            write_file(osp.join(self.path, 'cgroup.kill'), '1')
+            return
+        for pid in self.pids():
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def remove(self, timeout=5.0):
+        """
+          removes the leaf once its killed processes are gone
+        """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                os.rmdir(self.path)
+                return True
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    return True
+                if e.errno != errno.EBUSY or time.time() > deadline:
+                    return False
+            time.sleep(0.05)
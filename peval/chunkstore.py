@@ -0,0 +1,337 @@
+#!/usr/bin/python
+# chunkstore.py -- content defined chunk store    -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Content defined chunk store.
+
+    The 'cdc' codec (suffix '.tar.cdc') does not compress an archive as a
+    whole.  The uncompressed tar stream is cut into chunks wherever a gear
+    hash over the preceding bytes hits a boundary pattern, so an insertion
+    or deletion only changes the chunks around it.  Every chunk is stored
+    once, zlib compressed, under its SHA256 in
+
+      <store>/chunks/ab/abcdef...
+
+    and the file named by the identifier is a manifest listing the chunks
+    of the archive in order.  Successive revisions of an artifact, and
+    datasets that contain one another, share most of their chunks.
+
+    This module imports no other part of peval so that codec may import
+    it.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import bisect
+import errno
+import hashlib
+import os
+import os.path as osp
+import struct
+import tempfile
+import zlib
+
+import xdg.BaseDirectory
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+MAGIC = b'peval-cdc 1\n'
+
+MIN_CHUNK = 64 << 10
+AVG_BITS = 18           # chunks average MIN_CHUNK + 256 KiB
+MAX_CHUNK = 1 << 20
+MASK = (1 << AVG_BITS) - 1
+
+LEVEL = 6
+
+"""
+  a fixed table of pseudo-random 32 bit words; changing it moves every
+  boundary, so existing chunks would no longer be shared with new ones
+"""
+GEAR = [struct.unpack('>I', hashlib.sha256(b'gear %d' % i).digest()[:4])[0]
+        for i in range(256)]
+
+"""
+  bytes that reach the low AVG_BITS of the hash, and how many positions
+  Chunker.scan tests at once
+"""
+WINDOW = AVG_BITS
+SCAN = 64 << 10
+
+GEAR_WORDS = None if numpy is None else numpy.array(GEAR, numpy.uint32)
+
+"""
+  the chunk directory; benchmarks point this at a scratch directory
+"""
+ROOT = None
+
+
+def chunk_root():
+    if ROOT:
+        return ROOT
+    return osp.join(xdg.BaseDirectory.save_data_path('peval'), 'chunks')
+
+
+def chunk_path(root, sha):
+    return osp.join(root, sha[:2], sha)
+
+
+class Chunker(object):
+    """
+      finds chunk boundaries in a growing buffer, carrying the gear hash
+      over from one call to the next so that no byte is hashed twice
+
+      a boundary only tests the low AVG_BITS of the hash, and those only
+      depend on the last WINDOW bytes, so nothing before MIN_CHUNK - WINDOW
+      is hashed at all.  with numpy every position of a block is tested at
+      once; without it the hash rolls a byte at a time, at a few MB/s.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.h, self.position = 0, 0
+
+    def boundary(self, data):
+        """
+          returns the length of the chunk at the start of data, or None if
+          more data is needed to tell
+        """
+        limit = min(len(data), MAX_CHUNK)
+        if numpy is not None:
+            end = self.scan(data, limit)
+        else:
+            end = self.roll(data, limit)
+
+        if end is None and limit == MAX_CHUNK:
+            end = MAX_CHUNK
+        if end is not None:
+            self.reset()
+        return end
+
+    def roll(self, data, limit):
+        gear, h = GEAR, self.h
+        start = max(self.position, MIN_CHUNK - WINDOW)
+        warm = max(start, min(limit, MIN_CHUNK))
+        for b in data[start:warm]:
+            h = ((h << 1) + gear[b]) & MASK
+
+        for end, b in enumerate(data[warm:limit], warm + 1):
+            h = ((h << 1) + gear[b]) & MASK
+            if not h:
+                return end
+
+        self.h, self.position = h, max(warm, limit)
+        return None
+
+    def scan(self, data, limit):
+        """
+          roll, SCAN bytes at a time: the hash after each byte is summed
+          from the gear words of the WINDOW bytes up to it
+        """
+        start = max(self.position, MIN_CHUNK)
+        while start < limit:
+            end = min(start + SCAN, limit)
+            # copied out, as a view would stop the caller resizing data
+            window = bytes(data[start - WINDOW + 1:end])
+            g = GEAR_WORDS[numpy.frombuffer(window, numpy.uint8)]
+            n = end - start
+            h = numpy.zeros(n, numpy.uint32)
+            for shift in range(WINDOW):
+                h += g[WINDOW - 1 - shift:WINDOW - 1 - shift + n] << shift
+            hits = numpy.flatnonzero((h & MASK) == 0)
+            if len(hits):
+                return start + int(hits[0]) + 1
+            start = end
+
+        self.position = limit
+        return None
+
+
+def store_chunk(root, chunk):
+    """
+      writes chunk unless it is already stored; returns its SHA256 and
+      whether it was new
+    """
+    sha = hashlib.sha256(chunk).hexdigest()
+    path = chunk_path(root, sha)
+    if osp.exists(path):
+        # touched, so that peval gc sees it is in use again
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return sha, False
+
+    directory = osp.dirname(path)
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    fd, tmp = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(zlib.compress(bytes(chunk), LEVEL))
+        os.rename(tmp, path)
+    except Exception:
+        if osp.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return sha, True
+
+
+def load_chunk(root, sha):
+    with open(chunk_path(root, sha), 'rb') as f:
+        return zlib.decompress(f.read())
+
+
+class ChunkWriter(object):
+    """
+      file object that chunks everything written to it into the chunk store
+      and writes the manifest to fileobj on close
+    """
+
+    def __init__(self, fileobj, root=None):
+        self.fileobj = fileobj
+        self.root = root or chunk_root()
+        self.buffer = bytearray()
+        self.chunker = Chunker()
+        self.chunks = []
+        self.new_bytes = 0
+        self.closed = False
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while True:
+            end = self.chunker.boundary(self.buffer)
+            if end is None:
+                break
+            self.emit(self.buffer[:end])
+            del self.buffer[:end]
+
+    def emit(self, chunk):
+        sha, new = store_chunk(self.root, chunk)
+        if new:
+            self.new_bytes += len(chunk)
+        self.chunks.append((sha, len(chunk)))
+
+    def close(self):
+        if self.closed:
+            return
+        if self.buffer:
+            self.emit(self.buffer)
+            self.buffer = bytearray()
+        self.fileobj.write(MAGIC)
+        for sha, length in self.chunks:
+            self.fileobj.write(('%s %d\n' % (sha, length)).encode('ascii'))
+        self.closed = True
+
+
+def read_manifest(fileobj):
+    """
+      returns [(sha, length)] of the manifest in fileobj
+    """
+    if fileobj.readline() != MAGIC:
+        raise ValueError("not a chunk manifest")
+    chunks = []
+    for line in fileobj:
+        sha, length = line.decode('ascii').split()
+        chunks.append((sha, int(length)))
+    return chunks
+
+
+class ChunkReader(object):
+    """
+      seekable file object reading back the archive of a manifest
+    """
+
+    def __init__(self, fileobj, root=None):
+        self.root = root or chunk_root()
+        self.chunks = read_manifest(fileobj)
+        self.offsets = [0]
+        for sha, length in self.chunks:
+            self.offsets.append(self.offsets[-1] + length)
+        self.position = 0
+        self.cached = (None, b'')
+
+    @property
+    def size(self):
+        return self.offsets[-1]
+
+    def chunk(self, index):
+        if self.cached[0] != index:
+            self.cached = (index, load_chunk(self.root, self.chunks[index][0]))
+        return self.cached[1]
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        parts = []
+        while size > 0 and self.position < self.size:
+            index = bisect.bisect_right(self.offsets, self.position) - 1
+            data = self.chunk(index)
+            skip = self.position - self.offsets[index]
+            part = data[skip:skip + size]
+            parts.append(part)
+            self.position += len(part)
+            size -= len(part)
+        return b''.join(parts)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self.cached = (None, b'')
+
+
+def manifest_chunks(path):
+    with open(path, 'rb') as f:
+        return read_manifest(f)
+
+
+def stored_size(root, sha):
+    try:
+        return os.path.getsize(chunk_path(root, sha))
+    except OSError:
+        return 0
@@ -0,0 +1,335 @@
+#!/usr/bin/python
+# codec.py -- archive compression codecs          -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Compression codecs for archives in the store.
+
+    An identifier's suffix names the codec its archive was written with,
+    e.g. 'digest.tar.bz2' or 'digest.tar.zst', so archives written with any
+    codec stay readable whatever the current setting is.
+
+    Each codec prefers a multi-threaded command line tool (lbzip2, pigz,
+    xz -T, zstd -T) and falls back to a python implementation when the tool
+    is not installed.  Whatever a tool writes, the fallback must be able to
+    read, so that an archive moves between hosts with different tools.
+
+    The 'cdc' codec keeps the archive in the content defined chunk store
+    instead (see chunkstore.py).  It is slow to write: chunking runs at a
+    few tens of MB/s with numpy and a few MB/s without it.
+
+    This module only depends on the standard library and chunkstore so
+    that utility may import it.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import contextlib
+import gzip
+import multiprocessing
+import os
+import os.path as osp
+import subprocess
+import sys
+import tarfile
+
+from . import chunkstore
+
+
+def which(program):
+    """
+      returns the full path of program on $PATH or None
+    """
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = osp.join(directory, program)
+        if osp.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def threads():
+    try:
+        return int(os.environ.get('PEVAL_CODEC_THREADS', 0)) or \
+               multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+class Codec(object):
+    """
+      name       :: what users call the codec in PEVAL_CODEC / peval.conf
+      suffix     :: appended to the digest to form the identifier
+      compress   :: candidate tools as functions of the thread count
+      decompress :: candidate tools as functions of the thread count
+      tar_mode   :: tarfile's own compression, if it has one
+      module     :: python module used when no tool is available
+    """
+    def __init__(self, name, suffix, compress=(), decompress=(),
+                 tar_mode=None, module=None):
+        self.name = name
+        self.suffix = suffix
+        self.compress = compress
+        self.decompress = decompress
+        self.tar_mode = tar_mode
+        self.module = module
+
+    def __repr__(self):
+        return "Codec(%r)" % self.name
+
+    def command(self, candidates):
+        n = threads()
+        for candidate in candidates:
+            cmd = candidate(n)
+            if which(cmd[0]):
+                return cmd
+        return None
+
+    def compress_command(self):
+        return self.command(self.compress)
+
+    def decompress_command(self):
+        return self.command(self.decompress)
+
+    def python_stream(self, fileobj, writing):
+        """
+          returns a file object (de)compressing through self.module,
+          None if the module is not installed
+        """
+        if self.module == 'chunkstore':
+            if writing:
+                return chunkstore.ChunkWriter(fileobj)
+            return chunkstore.ChunkReader(fileobj)
+
+        if self.module == 'gzip':
+            # no name or timestamp in the header, so archives are reproducible
+            return gzip.GzipFile(filename='', mode='wb' if writing else 'rb',
+                                 fileobj=fileobj, mtime=0)
+
+        if self.module == 'zstandard':
+            try:
+                import zstandard
+            except ImportError:
+                return None
+            if writing:
+                return zstandard.ZstdCompressor(threads=-1) \
+                  .stream_writer(fileobj)
+            return zstandard.ZstdDecompressor().stream_reader(fileobj)
+
+        if self.module == 'lz4':
+            try:
+                import lz4.frame
+            except ImportError:
+                return None
+            return lz4.frame.LZ4FrameFile(fileobj, 'wb' if writing else 'rb')
+
+        return None
+
+    @property
+    def available(self):
+        if self.compress_command() or self.tar_mode is not None:
+            return True
+        if self.module is None:
+            return False
+        if self.module == 'chunkstore':
+            return True
+        try:
+            __import__(self.module)
+        except ImportError:
+            return False
+        return True
+
+
+CODECS = dict((c.name, c) for c in [
+    Codec('bz2', '.tar.bz2',
+      # not pbzip2, whose many streams python 2's bz2 stops reading
+      # after the first; lbzip2 writes one
+      compress=[lambda n: ['lbzip2', '-c', '-n%d' % n]],
+      decompress=[lambda n: ['lbzip2', '-dc', '-n%d' % n],
+                  lambda n: ['pbzip2', '-dc', '-p%d' % n]],
+      tar_mode='bz2'),
+    Codec('gz', '.tar.gz',
+      compress=[lambda n: ['pigz', '-n', '-c', '-p', str(n)]],
+      decompress=[lambda n: ['pigz', '-dc', '-p', str(n)]],
+      module='gzip'),
+    Codec('xz', '.tar.xz',
+      compress=[lambda n: ['xz', '-c', '-T%d' % n]],
+      decompress=[lambda n: ['xz', '-dc', '-T%d' % n]],
+      tar_mode='xz' if sys.version_info[0] >= 3 else None),
+    Codec('zst', '.tar.zst',
+      compress=[lambda n: ['zstd', '-c', '-q', '-T%d' % n]],
+      decompress=[lambda n: ['zstd', '-dc', '-q']],
+      module='zstandard'),
+    Codec('lz4', '.tar.lz4',
+      compress=[lambda n: ['lz4', '-c', '-q']],
+      decompress=[lambda n: ['lz4', '-dc', '-q']],
+      module='lz4'),
+    Codec('none', '.tar', tar_mode=''),
+    Codec('cdc', '.tar.cdc', module='chunkstore'),
+])
+
+DEFAULT = 'bz2'
+
+# the same on every python, so that archives of a tree are byte identical
+FORMAT = tarfile.GNU_FORMAT
+
+
+def get(name):
+    if name not in CODECS:
+        raise ValueError(
+          "Unknown codec '%s', expected one of %s"
+          % (name, ", ".join(sorted(CODECS))))
+    return CODECS[name]
+
+
+def for_path(path):
+    """
+      returns the codec whose suffix path carries, or None
+    """
+    # longest suffix first so that '.tar.bz2' is not taken for '.tar'
+    for c in sorted(CODECS.values(), key=lambda c: -len(c.suffix)):
+        if path.endswith(c.suffix):
+            return c
+    return None
+
+
+def check_exit(proc, cmd):
+    rc = proc.wait()
+    if rc != 0:
+        raise IOError("'%s' exited with code %d" % (" ".join(cmd), rc))
+
+
+def stop(proc):
+    """
+      kills proc unless it has exited, reaps it and closes its pipes
+    """
+    if proc.poll() is None:
+        proc.kill()
+    proc.wait()
+    for pipe in (proc.stdin, proc.stdout):
+        if pipe is not None:
+            try:
+                pipe.close()
+            except (IOError, OSError):
+                # whatever was still buffered for the tool is not wanted
+                pass
+
+
+@contextlib.contextmanager
+def writer(path, c):
+    """
+      yields a tarfile which is compressed with codec c into path; path is
+      removed again if anything fails before the archive is complete
+    """
+    try:
+        with open(path, 'wb') as out:
+            with write_to(out, c) as tar:
+                yield tar
+    except BaseException:
+        if osp.exists(path):
+            os.unlink(path)
+        raise
+
+
+@contextlib.contextmanager
+def write_to(out, c):
+    """
+      yields a tarfile which is compressed with codec c into the file out
+    """
+    cmd = c.compress_command()
+    if cmd:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=out)
+        try:
+            with contextlib.closing(tarfile.open(
+              fileobj=proc.stdin, mode='w|', format=FORMAT)) as tar:
+                yield tar
+            proc.stdin.close()
+            check_exit(proc, cmd)
+        finally:
+            stop(proc)
+        return
+
+    if c.tar_mode is not None:
+        mode = 'w:' + c.tar_mode if c.tar_mode else 'w'
+        with contextlib.closing(
+          tarfile.open(fileobj=out, mode=mode, format=FORMAT)) as tar:
+            yield tar
+        return
+
+    stream = c.python_stream(out, True)
+    if stream is None:
+        raise ValueError(
+          "Codec '%s' needs '%s' on $PATH or the python module '%s'"
+          % (c.name, c.compress[0](1)[0], c.module))
+    with contextlib.closing(stream):
+        with contextlib.closing(
+          tarfile.open(fileobj=stream, mode='w|', format=FORMAT)) as tar:
+            yield tar
+
+
+@contextlib.contextmanager
+def reader(path, whole=True):
+    """
+      yields a tarfile reading path; archives written by a tool are read
+      as a stream, so members must be visited in order.
+
+      unless whole is set, the caller may stop before the end; the tool is
+      then killed instead of being checked for success.
+    """
+    c = for_path(path)
+    cmd = c.decompress_command() if c else None
+
+    if cmd:
+        with open(path, 'rb') as src:
+            proc = subprocess.Popen(cmd, stdin=src, stdout=subprocess.PIPE)
+            try:
+                with contextlib.closing(
+                  tarfile.open(fileobj=proc.stdout, mode='r|')) as tar:
+                    yield tar
+                if whole:
+                    # drain so the tool is not killed by SIGPIPE
+                    while proc.stdout.read(1 << 16):
+                        pass
+                    check_exit(proc, cmd)
+            finally:
+                stop(proc)
+        return
+
+    if c is None or c.tar_mode is not None:
+        with contextlib.closing(tarfile.open(path)) as tar:
+            yield tar
+        return
+
+    with open(path, 'rb') as src:
+        stream = c.python_stream(src, False)
+        if stream is None:
+            raise ValueError(
+              "Codec '%s' needs '%s' on $PATH or the python module '%s'"
+              % (c.name, c.decompress[0](1)[0], c.module))
+        with contextlib.closing(stream):
+            with contextlib.closing(tarfile.open(fileobj=stream, mode='r|')) as tar:
+                yield tar
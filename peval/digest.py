@@ -0,0 +1,341 @@
+#!/usr/bin/python
+# digest.py -- versioned artifact digests         -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Versioned artifact digests.
+
+    Version 1 is utility.digest_paths: SHA1 over absolute file names and
+    the hex SHA1 of every 4 KiB chunk.  Its identifiers are 40 hex digits.
+
+    Version 2 is a BLAKE2b tree hash.  Every file is cut into BLOCK sized
+    blocks which are hashed concurrently on a thread pool, the block
+    digests are combined per file, and the files are combined under their
+    names relative to the artifact root.  Its identifiers are 64 hex digits,
+    so an identifier tells which version produced it.
+
+      leaf  = H(0x00 || block)
+      file  = H(0x01 || size || leaf...)
+      tree  = H(0x02 || entry...)      entries sorted by name
+      entry = len(name) || name || kind || executable || len(node) || node
+
+    where kind is 'f' (node is the file hash) or 'l' (node is the symlink
+    target).
+
+    This module only depends on the standard library (and pyblake2 on
+    python 2) so that utility may import it.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import collections
+import hashlib
+import multiprocessing
+import os
+import os.path as osp
+import stat
+import struct
+import sys
+
+from multiprocessing.pool import ThreadPool
+
+try:
+    blake2b = hashlib.blake2b
+except AttributeError:
+    try:
+        from pyblake2 import blake2b
+    except ImportError:
+        blake2b = None
+
+
+BLOCK = 4 << 20
+BUFFER_SIZE = 1 << 20
+
+LENGTHS = {40: 1, 64: 2}
+
+
+def available(version):
+    return version == 1 or (version == 2 and blake2b is not None)
+
+
+def version_of(identifier):
+    """
+      returns the digest version of an identifier such as 'abc...def.tar.bz2'
+      or None when it is not one of ours
+    """
+    hexpart = osp.basename(identifier).split('.', 1)[0]
+    try:
+        int(hexpart, 16)
+    except ValueError:
+        return None
+    return LENGTHS.get(len(hexpart))
+
+
+def split_identifier(identifier):
+    """
+      'abc...def.tar.bz2' -> ('abc...def', '.tar.bz2')
+    """
+    hexpart, _, suffix = identifier.partition('.')
+    return hexpart, ('.' + suffix if suffix else '')
+
+
+def to_bytes(text):
+    if isinstance(text, bytes):
+        return text
+    if sys.version_info[0] < 3:
+        # no surrogateescape here, but paths are str, not unicode, unless
+        # a caller decoded them, so utf-8 gives the bytes python 3 would
+        return text.encode('utf-8')
+    return text.encode('utf-8', 'surrogateescape')
+
+
+def H():
+    return blake2b(digest_size=32)
+
+
+def leaf(data):
+    h = H()
+    h.update(b'\x00')
+    h.update(data)
+    return h.digest()
+
+
+def file_node(size, leaves):
+    h = H()
+    h.update(b'\x01')
+    h.update(struct.pack('>Q', size))
+    for digest in leaves:
+        h.update(digest)
+    return h.digest()
+
+
+def tree_node(entries):
+    h = H()
+    h.update(b'\x02')
+    for name, kind, executable, node in sorted(entries):
+        name = to_bytes(name)
+        h.update(struct.pack('>I', len(name)))
+        h.update(name)
+        h.update(kind)
+        h.update(b'x' if executable else b'-')
+        h.update(struct.pack('>I', len(node)))
+        h.update(node)
+    return h.hexdigest()
+
+
+def is_executable(mode):
+    return bool(mode & stat.S_IXUSR)
+
+
+def default_threads():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+class TreeDigest(object):
+    """
+      streaming version 2 digest with the same interface as
+      utility.PathDigest:
+
+        begin_file(path, arcname), update(data)..., end_file()
+        add_special(path, arcname)           symlinks and empty files
+        add_node(path, arcname, mode, node)  a file hashed earlier
+
+      blocks are handed to a thread pool as they fill up; at most a few
+      blocks per thread are held in memory at any time.  once hexdigest()
+      has been called, file_nodes maps each path to the hash of its file.
+    """
+
+    def __init__(self, threads=None):
+        if blake2b is None:
+            raise ValueError(
+              "digest version 2 needs BLAKE2 (python >= 3.6 or pyblake2)")
+        self.threads = threads or default_threads()
+        self.pool = ThreadPool(self.threads)
+        self.inflight = collections.deque()
+        self.entries = []
+        self.links = {}
+        self.paths = {}
+        self.file_nodes = {}
+        self.current = None
+
+    def submit(self, block):
+        result = self.pool.apply_async(leaf, (block,))
+        self.current['leaves'].append(result)
+        self.inflight.append(result)
+        while len(self.inflight) > 2 * self.threads:
+            self.inflight.popleft().wait()
+
+    def begin_file(self, path, arcname, mode=None):
+        if mode is None:
+            mode = os.stat(path).st_mode
+        self.current = dict(name=arcname, mode=mode, size=0, leaves=[],
+                            pending=[], pending_size=0)
+        self.paths[arcname] = path
+
+    def update(self, data):
+        if not data:
+            return
+        cur = self.current
+        cur['size'] += len(data)
+        cur['pending'].append(data)
+        cur['pending_size'] += len(data)
+        if cur['pending_size'] >= BLOCK:
+            data = b''.join(cur['pending'])
+            whole = len(data) - len(data) % BLOCK
+            for i in range(0, whole, BLOCK):
+                self.submit(data[i:i + BLOCK])
+            rest = data[whole:]
+            cur['pending'] = [rest] if rest else []
+            cur['pending_size'] = len(rest)
+
+    def end_file(self):
+        cur = self.current
+        if cur['pending_size']:
+            self.submit(b''.join(cur['pending']))
+        self.entries.append((cur['name'], b'f', is_executable(cur['mode']),
+                             (cur['size'], cur['leaves'])))
+        self.links[cur['name']] = self.entries[-1]
+        self.current = None
+
+    def add_node(self, path, arcname, mode, node):
+        self.entries.append((arcname, b'f', is_executable(mode), node))
+        self.links[arcname] = self.entries[-1]
+        self.paths[arcname] = path
+
+    def add_symlink(self, arcname, target):
+        self.entries.append((arcname, b'l', False, to_bytes(target)))
+
+    def add_hardlink(self, arcname, linkname):
+        """
+          a tar member that repeats an earlier member's contents
+        """
+        _, kind, executable, node = self.links[linkname]
+        self.entries.append((arcname, kind, executable, node))
+
+    def add_special(self, path, arcname):
+        if osp.islink(path):
+            self.add_symlink(arcname, os.readlink(path))
+        else:
+            self.begin_file(path, arcname)
+            self.end_file()
+
+    def hexdigest(self):
+        entries = []
+        for name, kind, executable, node in self.entries:
+            if kind == b'f' and isinstance(node, tuple):
+                size, leaves = node
+                node = file_node(size, [r.get() for r in leaves])
+            if kind == b'f' and self.paths.get(name):
+                self.file_nodes[self.paths[name]] = node
+            entries.append((name, kind, executable, node))
+        self.close()
+        return tree_node(entries)
+
+    def close(self):
+        """
+          stops the thread pool; called by hexdigest, and by whoever gives
+          up on the digest before that
+        """
+        self.pool.close()
+        self.pool.join()
+
+
+def hash_block(task):
+    path, offset, length = task
+    h = H()
+    h.update(b'\x00')
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while length > 0:
+            data = f.read(min(length, BUFFER_SIZE))
+            if not data:
+                break
+            h.update(data)
+            length -= len(data)
+    return h.digest()
+
+
+def digest_files(items, threads=None):
+    """
+      takes in [(path, arcname)] for the files of an artifact
+      returns the version 2 digest over them, reading and hashing blocks of
+      all files concurrently.  this is used where no archive is written.
+    """
+    if blake2b is None:
+        raise ValueError(
+          "digest version 2 needs BLAKE2 (python >= 3.6 or pyblake2)")
+
+    tasks, files, entries = [], [], []
+    for path, arcname in items:
+        st = os.lstat(path)
+        if stat.S_ISLNK(st.st_mode):
+            entries.append((arcname, b'l', False, to_bytes(os.readlink(path))))
+            continue
+        first = len(tasks)
+        for offset in range(0, st.st_size, BLOCK):
+            tasks.append((path, offset, min(BLOCK, st.st_size - offset)))
+        files.append((arcname, st, first, len(tasks)))
+
+    pool = ThreadPool(threads or default_threads())
+    try:
+        leaves = pool.map(hash_block, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    for arcname, st, first, last in files:
+        entries.append((arcname, b'f', is_executable(st.st_mode),
+                        file_node(st.st_size, leaves[first:last])))
+    return tree_node(entries)
+
+
+def digest_archive(tar, threads=None):
+    """
+      takes in an open tarfile, read in order
+      returns the version 2 digest of its members, as it would have been
+      computed when the artifact was registered
+    """
+    d = TreeDigest(threads)
+    try:
+        for member in tar:
+            if member.isreg():
+                d.begin_file(None, member.name, member.mode)
+                f = tar.extractfile(member)
+                for buf in iter(lambda: f.read(BUFFER_SIZE), b''):
+                    d.update(buf)
+                d.end_file()
+            elif member.issym():
+                d.add_symlink(member.name, member.linkname)
+            elif member.islnk():
+                d.add_hardlink(member.name, member.linkname)
+        return d.hexdigest()
+    finally:
+        d.close()
@@ -28,40 +28,213 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import argparse
+import datetime
 import sys
 import pony.orm as pny
 from . import model as mod
 import os.path as osp
+from . import metrics
+from . import store
 from . import utility
 import subprocess, os, psutil
+import collections
+import itertools
+import multiprocessing
+import time
 
 
+"""
+  seconds a wait for the evaluation pool may block before ^C is seen
+"""
+WAIT = 1e6
+
+"""
+  how many runs found their evaluation cached, and how many did not
+"""
+EVALUATION_CACHE = collections.Counter()
+
+
+#####################################
+##         PENDING
+#####################################
+
+"""
+  runs fetched per round trip; each batch is read completely before any
+  evaluation is written, so no statement holds a read lock on index.db
+  while the evaluations are saved
+"""
+BATCH = 500
+
+"""
+  a run to evaluate, with everything evaluating it needs from index.db:
+  the identifiers of its output, ground truth, input and evaluator, the
+  challenge problem and team it belongs to, and the identifier of a
+  successful evaluation, by the same evaluator, of a run with the same
+  output and dataset (None if there is none).  identifiers name contents,
+  so the evaluator would only produce that evaluation again.
+"""
+Pending = collections.namedtuple('Pending', 'run_id output eval_digest '
+                                 'in_digest evaluator cp_ids team cached')
+
+"""
+  the unary + keeps SQLite from scanning every evaluation of the evaluator
+  for the cached one, rather than the few runs with the same output
+"""
+COLUMNS = """
+SELECT r.id, r.output, d.eval_digest, d.in_digest, cp.evaluator,
+       cp.id, cp.revision_major, cp.revision_minor, e.team,
+       (SELECT v.id FROM Run o JOIN evaluation v ON v.run = o.id
+        WHERE o.output = r.output AND o.dataset = r.dataset
+          AND +v.evaluator = cp.evaluator AND v.did_succeed
+        LIMIT 1)
+"""
+
+JOINS = """
+FROM Run r
+JOIN dataset d ON d.in_digest = r.dataset
+JOIN engine e ON e.id = r.engine
+JOIN solution s ON s.id = r.configured_solution_solution
+JOIN challenge_problem cp
+  ON cp.id = s.challenge_problem_id
+ AND cp.revision_major = s.challenge_problem_revision_major
+ AND cp.revision_minor = s.challenge_problem_revision_minor
+"""
+
+"""
+  the runs without an evaluation: a NOT EXISTS probe of the index on
+  evaluation (run), walked in batches by run id
+"""
+PENDING = """
+{columns}
+""" + JOINS + """
+WHERE NOT EXISTS (SELECT 1 FROM evaluation x WHERE x.run = r.id)
+{filters}
+"""
+
+RUN = COLUMNS + JOINS + "WHERE r.id = ?"
+
+
+def pending_row(row):
+    return Pending(row[0], row[1], row[2], row[3], row[4],
+                   tuple(row[5:8]), row[8], row[9])
+
+
+def pending_filters(team=None, challenge_problem=None, since=None):
+    """
+      returns (SQL, parameters) restricting pending runs to those of team
+      (an id or a description), of challenge_problem (an id), or started
+      on or after since (a YYYY-MM-DD date)
+    """
+    filters, parameters = [], []
+    if team is not None:
+        filters.append("AND e.team IN "
+                       "(SELECT id FROM team WHERE id = ? OR description = ?)")
+        parameters.extend([team, team])
+    if challenge_problem is not None:
+        filters.append("AND s.challenge_problem_id = ?")
+        parameters.append(challenge_problem)
+    if since is not None:
+        filters.append("AND r.started >= ?")
+        parameters.append(since)
+    return '\n'.join(filters), parameters
+
+
+def count_pending(connection, filters=('', [])):
+    sql, parameters = filters
+    query = PENDING.format(columns="SELECT COUNT(*)", filters=sql)
+    return connection.execute(query, parameters).fetchone()[0]
+
+
+def pending_evaluations(connection, filters=('', []), batch=BATCH):
+    """
+      yields lists of Pending, batch at a time, for the runs that have no
+      evaluation.  every batch is one query that starts after the last run
+      of the one before, so runs evaluated in between do not shift it.
+    """
+    sql, parameters = filters
+    query = PENDING.format(columns=COLUMNS,
+                           filters=sql + "\nAND r.id > ? ORDER BY r.id LIMIT ?")
+    last = -1
+    while True:
+        rows = connection.execute(query, parameters + [last, batch]).fetchall()
+        if not rows:
+            return
+        yield [pending_row(row) for row in rows]
+        last = rows[-1][0]
+
+
+def pending_run(run_id):
+    """
+      returns the Pending of run_id, evaluated or not
+    """
+    connection = store.connect()
+    try:
+        row = connection.execute(RUN, [run_id]).fetchone()
+    finally:
+        connection.close()
+    if not row:
+        raise utility.FormattedError("run_id {} not valid", run_id)
+    return pending_row(row)
+
+
+def evaluation_parts(p):
+    """
+      returns the (label, identifier) parts unpack_parts takes to evaluate
+      the Pending p, so that evaluating needs no database
+    """
+    if p.evaluator is None:
+        raise utility.FormattedError(
+          "No registered evaluator for challenge problem {}",
+          p.cp_ids
+        )
+    return (
+      ('result', p.output),
+      ('ground_truth', p.eval_digest),
+      ('input', p.in_digest),
+      ('evaluator', p.evaluator),
+      ('output', None)
+    )
+
+
+def is_cached(p, recompute):
+    cached = not recompute and bool(p.cached) and utility.has_resource(p.cached)
+    EVALUATION_CACHE['hit' if cached else 'miss'] += 1
+    if cached:
+        utility.write("reusing evaluation {} for run {}".format(
+          p.cached, p.run_id))
+    return cached
+
+
+#####################################
+##         EVALUATE
+#####################################
+
 def register_stub(arguments):
     print("STUB FOUND :: ", arguments)
 
 
 def evaluate_all_cli(arguments):
-    unevaluated_run_ids = get_unevaluted_run_ids()
-    print("Preparing to evaluate runs {}".format(list(unevaluated_run_ids)))
-
-    exceptions = []
-    for i in unevaluated_run_ids:
-        print("-"*80)
-        print("Evaluating run {}".format(i))
-        print("-"*80)
-        try:
-            evaluate_single_run(i, False)
-        except utility.FormattedError as e:
-            exceptions.append(str(e))
+    filters = pending_filters(arguments.team, arguments.challenge_problem,
+                              arguments.since)
+    connection = store.connect()
+    try:
+        num_ran = count_pending(connection, filters)
+        print("Preparing to evaluate {} runs".format(num_ran))
+        exceptions = evaluate_runs(pending_evaluations(connection, filters),
+                                   num_ran, arguments.jobs,
+                                   arguments.recompute,
+                                   group_size(arguments.group_size))
+    finally:
+        connection.close()
 
     num_exns = len(exceptions)
-    num_ran = len(unevaluated_run_ids)
     num_no_exns = num_ran - num_exns
 
     print('-'*80)
     print ("-- Results:")
     print('-'*80)
     print("Evaluated {} runs. Succeeded: {}, failed: {}".format(num_ran, num_no_exns, num_exns))
+    print(cache_report())
     print('-'*80)
     print
 
@@ -73,103 +246,242 @@ def evaluate_all_cli(arguments):
         raise utility.FormattedError(pretty_exceptions)
 
 
-@mod.pny.db_session
-def get_unevaluted_run_ids():
-    run_ids      = pny.select(r.id for r in mod.Run)
-    eval_run_ids = pny.select(e.run.id for e in mod.Evaluation)
-    return set(run_ids) - set(eval_run_ids)
+class Progress(object):
+    """
+      counts evaluated runs and estimates the time left from the runs that
+      needed an evaluator
+    """
+    def __init__(self, total):
+        self.total, self.done, self.skipped = total, 0, 0
+        self.start = time.time()
+
+    def skip(self, count=1):
+        self.done += count
+        self.skipped += count
+
+    def report(self, run_id, error):
+        self.done += 1
+        elapsed = time.time() - self.start
+        eta = elapsed / max(self.done - self.skipped, 1) * \
+              max(self.total - self.done, 0)
+        print("[{}/{}] run {} {}, {:.0f} s elapsed, about {:.0f} s left"
+              .format(self.done, self.total, run_id,
+                      "evaluated" if error is None else "failed",
+                      elapsed, eta))
+
+    def throughput(self):
+        evaluated = self.done - self.skipped
+        elapsed = time.time() - self.start
+        return "Ran the evaluator on {} runs in {:.0f} s ({:.1f} runs/minute)"\
+          .format(evaluated, elapsed,
+                  60.0 * evaluated / elapsed if elapsed else 0)
+
+
+def evaluate_runs(batches, total, jobs=1, recompute=False, size=1):
+    """
+      evaluates the lists of Pending in batches, jobs at a time, each in a
+      process and sandbox of its own.  only this process writes to index.db
+      and publishes to the store, one evaluation after the other, as the
+      evaluations finish.  runs whose evaluation is cached, or whose output
+      another run of the batch shares, reuse that evaluation.  evaluators
+      with an eval-batch.sh evaluate up to size runs per process (see
+      prepare_group).
+      returns the messages of those that failed.
+    """
+    exceptions, progress = [], Progress(total)
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    try:
+        for batch in batches:
+            evaluate_batch(batch, pool, jobs, size, recompute, exceptions,
+                           progress)
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+    print(progress.throughput())
+    return exceptions
+
+
+def evaluate_batch(batch, pool, jobs, size, recompute, exceptions, progress):
+    inputs, cached, sharing, evaluators = [], [], {}, {}
+    for p in batch:
+        try:
+            parts = evaluation_parts(p)
+        except utility.FormattedError as e:
+            exceptions.append(str(e))
+            progress.skip()
+            continue
+        if is_cached(p, recompute):
+            cached.append((p.run_id, p.evaluator, p.cached, True, None))
+            continue
+        # the parts but the empty output name what the evaluation depends on
+        key = parts[:-1]
+        if key in sharing and not recompute:
+            sharing[key].append(p.run_id)
+        else:
+            sharing[key], evaluators[p.run_id] = [p.run_id], p.evaluator
+            inputs.append((p.run_id, parts))
+
+    # all cached evaluations of the batch are saved in one transaction
+    if cached:
+        save_evaluations(cached)
+        progress.skip(len(cached))
+
+    groups = evaluation_groups(inputs, size, jobs)
+    if pool:
+        prepared = results(pool.imap_unordered(prepare_group_isolated, groups))
+    else:
+        prepared = (prepare_group_isolated(g) for g in groups)
+
+    others = dict((runs[0], runs[1:]) for runs in sharing.values())
+    for run_id, prepared_evaluation, error in itertools.chain.from_iterable(
+      prepared):
+        evaluator = evaluators[run_id]
+        if error is None:
+            try:
+                record_evaluation(run_id, evaluator, *prepared_evaluation)
+            except utility.FormattedError as e:
+                error = str(e)
+        if error is not None:
+            exceptions.append(error)
+
+        if error is None and others[run_id]:
+            # looked up as misses, but served from the cache after all
+            save_evaluations([(other, evaluator, prepared_evaluation[1], True,
+                               prepared_evaluation[3])
+                              for other in others[run_id]])
+            EVALUATION_CACHE['miss'] -= len(others[run_id])
+            EVALUATION_CACHE['hit'] += len(others[run_id])
+        elif error is not None:
+            exceptions.extend(
+              "run {} was not evaluated: it has the output of run "
+              "{}, whose evaluation failed".format(other, run_id)
+              for other in others[run_id])
+        # runs sharing the output needed no evaluator of their own
+        progress.skip(len(others[run_id]))
+        progress.report(run_id, error)
+
+
+def results(iterator):
+    """
+      the results of a pool's imap; waiting with a timeout keeps ^C from
+      being held back until the pool is done under python 2
+    """
+    while True:
+        try:
+            yield iterator.next(WAIT)
+        except StopIteration:
+            return
+
+
+def prepare_isolated(inputs, p_flag=False):
+    """
+      prepare_evaluation, catching its errors
+      returns (run_id, what record_evaluation takes, None) or
+      (run_id, None, the message of the error)
+    """
+    try:
+        return inputs[0], prepare_evaluation(inputs, p_flag), None
+    except utility.FatalError as e:
+        # the error goes back as text, since it may not survive pickling
+        return inputs[0], None, str(e)
+    except Exception as e:
+        return inputs[0], None, "run {}: {}".format(inputs[0], e)
 
 
 def evaluate_run_cli(arguments):
     run_id = arguments.run_id
     p_flag = arguments.persist
-    evaluate_single_run(run_id, p_flag)
-
-
-def evaluate_single_run(run_id, p_flag):
-    check_run(run_id)
-
+    evaluate_single_run(run_id, p_flag, arguments.recompute)
+    if EVALUATION_CACHE['hit']:
+        print("Reused a cached evaluation of run {}".format(run_id))
+
+
+def cache_report():
+    looked_up = EVALUATION_CACHE['hit'] + EVALUATION_CACHE['miss']
+    return "Reused cached evaluations for {} of {} runs ({:.0f}%)".format(
+      EVALUATION_CACHE['hit'], looked_up,
+      100.0 * EVALUATION_CACHE['hit'] / looked_up if looked_up else 0)
+
+
+def evaluate_single_run(run_id, p_flag, recompute=False):
+    p = pending_run(run_id)
+    parts = evaluation_parts(p)
+    if is_cached(p, recompute):
+        save_evaluations([(run_id, p.evaluator, p.cached, True, None)])
+        return
+    record_evaluation(run_id, p.evaluator,
+                      *prepare_evaluation((run_id, parts), p_flag))
+
+
+def prepare_evaluation(inputs, p_flag):
+    """
+      takes in (run_id, what evaluation_parts returns)
+      runs the evaluator in a sandbox and stages its output, touching
+      neither index.db nor the published store
+      returns (return code, output identifier, staged output path, the
+      metrics the evaluator reported)
+    """
+    run_id, parts = inputs
     with utility.TemporaryDirectory(persist=p_flag) as sandbox:
 
         result_path, ground_path, input_path, eval_path, output_path = \
-          hash_to_paths(run_id, sandbox)
+          utility.unpack_parts(sandbox, *parts)
 
         rc, output_path = \
           evaluate_run(result_path, ground_path, input_path, eval_path, output_path)
 
         out_hash, out_hash_path = \
-          utility.prepare_resource(output_path, sandbox)
+          utility.prepare_resource(output_path, kind='evaluation')
 
-        if rc:
-            utility.write("Evaluator returned nonzero exit code: " + str(rc))
-            did_succeed = False
-        else:
-            did_succeed = True
+        run_metrics = metrics.read_metrics(output_path)
 
-        try:
-            save_evaluation(run_id, out_hash, did_succeed)
-        except mod.pny.core.ConstraintError as e:
-            raise utility.FormattedError("Conflict : {}",  e)
-        utility.commit_resource(out_hash_path)
+    return rc, out_hash, out_hash_path, run_metrics
 
-        if rc:
-            raise utility.FormattedError("Evaluator returned nonzero exit code: " + str(rc))
 
-@mod.pny.db_session
-def check_run(run_id):
-    if not mod.Run.get(id=run_id):
-        raise utility.FormattedError("run_id {} not valid", run_id)
+def record_evaluation(run_id, evaluator_id, rc, out_hash, out_hash_path,
+                      run_metrics):
+    if rc:
+        utility.write("Evaluator returned nonzero exit code: " + str(rc))
+        did_succeed = False
+    else:
+        did_succeed = True
 
-@mod.pny.db_session
-def save_evaluation(run_id, out_hash, did_succeed):
-    r = mod.Run.get(id=run_id)
-    cp = r.configured_solution.solution.challenge_problem
-    ev = cp.evaluator
-    if not ev:
-        raise utility.FormattedError(
-          "No registered evaluator for challenge problem {}",
-          cp.cp_ids
-        )
+    try:
+        save_evaluations([(run_id, evaluator_id, out_hash, did_succeed,
+                           run_metrics)])
+    except mod.pny.core.ConstraintError as e:
+        raise utility.FormattedError("Conflict : {}",  e)
+    utility.commit_resource(out_hash_path)
 
-    evaluation = mod.Evaluation.get(run=r)
-    if evaluation:
-        utility.write("Old evaluation found, deleting it to save the new one.")
-        evaluation.delete()
-        pny.flush()
-    evaluation = mod.Evaluation(
-        id = out_hash,
-        evaluator = ev,
-        run = r,
-        did_succeed = did_succeed
-    )
+    if rc:
+        raise utility.FormattedError("Evaluator returned nonzero exit code: " + str(rc))
 
 
 @mod.pny.db_session
-def hash_to_paths(run_id, dest):
-    r = mod.Run.get(id=run_id)
-    if not r:
-        raise utility.FormattedError("run_id {} not valid", run_id)
-
-    cp = r.configured_solution.solution.challenge_problem
-    ev = cp.evaluator
-    if not ev:
-        raise utility.FormattedError(
-          "No registered evaluator for challenge problem {}",
-          cp.cp_ids
+def save_evaluations(records):
+    """
+      saves (run_id, evaluator_id, out_hash, did_succeed, metrics) records
+      in one transaction, replacing the evaluations and metrics the runs
+      had.  metrics None takes those of a run evaluated as out_hash before,
+      for evaluations served from the cache.
+    """
+    for run_id, evaluator_id, out_hash, did_succeed, run_metrics in records:
+        r = mod.Run.get(id=run_id)
+        if run_metrics is None:
+            run_metrics = metrics.shared_metrics(out_hash)
+        evaluation = mod.Evaluation.get(run=r)
+        if evaluation:
+            utility.write("Old evaluation found, deleting it to save the new one.")
+            evaluation.delete()
+            pny.flush()
+        evaluation = mod.Evaluation(
+            id = out_hash,
+            evaluator = mod.Evaluator[evaluator_id],
+            run = r,
+            did_succeed = did_succeed
         )
-
-    output_hash = r.output
-    ground_hash = r.dataset.eval_digest
-    input_hash  = r.dataset.in_digest
-    eval_hash   = ev.id
-
-    return utility.unpack_parts(dest,
-      ('result', output_hash),
-      ('ground_truth', ground_hash),
-      ('input', input_hash),
-      ('evaluator', eval_hash),
-      ('output', None)
-    )
+        metrics.replace_metrics(r, run_metrics)
 
 
 def evaluate_run(result_path, ground_path, input_path, eval_path, output_path):
@@ -183,6 +495,117 @@ def evaluate_run(result_path, ground_path, input_path, eval_path, output_path):
     return rc, output_path
 
 
+#####################################
+##         BATCH PROTOCOL
+#####################################
+
+"""
+  an evaluator declares that it evaluates many runs in one process by
+  shipping eval-batch.sh next to its eval.sh.  runs that share a ground
+  truth and input are then handed to one
+
+    eval-batch.sh MANIFEST GROUND_TRUTH
+
+  with INPUT_DIR set as for eval.sh.  every line of MANIFEST is a result
+  directory and the output directory its evaluation goes to, separated by
+  a tab.  a nonzero exit status counts for every run of the group, and a
+  run whose output directory was not written fails on its own.
+"""
+BATCH_SCRIPT = 'eval-batch.sh'
+
+
+def group_size(size=None):
+    """
+      runs handed to one eval-batch.sh at most; 1 starts eval.sh per run
+    """
+    if size is None:
+        size = utility.store_setting('evaluate', 'group_size', 20)
+    return max(int(size), 1)
+
+
+def evaluation_groups(inputs, size, jobs=1):
+    """
+      splits inputs, as prepare_evaluation takes them, into lists of runs
+      with the same ground truth, input and evaluator, at most size long
+      and short enough that jobs processes all get some
+    """
+    groups = collections.OrderedDict()
+    for run_input in inputs:
+        groups.setdefault(run_input[1][1:4], []).append(run_input)
+    for group in groups.values():
+        length = min(size, max(1, -(-len(group) // jobs)))
+        for start in range(0, len(group), length):
+            yield group[start:start + length]
+
+
+def prepare_group(inputs, p_flag):
+    """
+      prepare_evaluation for a list of inputs sharing ground truth, input and
+      evaluator, in one eval-batch.sh if the evaluator has one
+      returns [(run_id, what record_evaluation takes, None) or
+      (run_id, None, the message of the error)]
+    """
+    if len(inputs) == 1:
+        return [prepare_isolated(inputs[0], p_flag)]
+
+    with utility.TemporaryDirectory(persist=p_flag) as sandbox:
+        ground_path, input_path, eval_path = \
+          utility.unpack_parts(sandbox, *inputs[0][1][1:4])
+        if not utility.file_from_tree(BATCH_SCRIPT, eval_path, False):
+            return [prepare_isolated(i, p_flag) for i in inputs]
+
+        manifest, outputs = osp.join(sandbox, 'manifest'), []
+        with open(manifest, 'w') as f:
+            for run_id, parts in inputs:
+                result_path = utility.unpack_part(
+                  parts[0][1], sandbox, 'result-{}'.format(run_id))
+                output_path = osp.join(osp.realpath(sandbox),
+                                       'output-{}'.format(run_id))
+                f.write("{}\t{}\n".format(result_path, output_path))
+                outputs.append((run_id, output_path))
+
+        rc = evaluate_group_run(manifest, ground_path, input_path, eval_path)
+
+        prepared = []
+        for run_id, output_path in outputs:
+            if not osp.isdir(output_path):
+                prepared.append((run_id, None,
+                  "run {}: {} wrote no evaluation (exit code {})".format(
+                    run_id, BATCH_SCRIPT, rc)))
+                continue
+            try:
+                prepared.append((run_id, (rc,) + utility.prepare_resource(
+                  output_path, kind='evaluation') +
+                  (metrics.read_metrics(output_path),), None))
+            except utility.FatalError as e:
+                prepared.append((run_id, None, str(e)))
+        return prepared
+
+
+def prepare_group_isolated(inputs):
+    """
+      prepare_group in a pool worker; a failure before the evaluator ran
+      fails every run of the group
+    """
+    try:
+        return prepare_group(inputs, False)
+    except utility.FatalError as e:
+        return [(i[0], None, str(e)) for i in inputs]
+    except Exception as e:
+        return [(i[0], None, "run {}: {}".format(i[0], e)) for i in inputs]
+
+
+def evaluate_group_run(manifest, ground_path, input_path, eval_path):
+
+    for _, rc, _, _ in utility.process_watch(
+      eval_path, [BATCH_SCRIPT, manifest, ground_path]
+               , INPUT_DIR=input_path
+    ):
+        pass
+
+    return rc
+
+
 #####################################
 ##         PARSERS
 #####################################
@@ -195,11 +618,36 @@ def run_subparser(subparsers):
     parser.add_argument('--persist', action='store_true', default=False,
       help="make directory persist for debugging purposes")
 
+    parser.add_argument('--recompute', action='store_true', default=False,
+      help="run the evaluator even if the evaluation is cached")
+
     parser.set_defaults(func=evaluate_run_cli)
 
 
+def date(text):
+    try:
+        return datetime.datetime.strptime(text, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+          "{} is not a YYYY-MM-DD date".format(text))
+
+
 def all_subparser(subparsers):
     parser = subparsers.add_parser('all')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+      help="evaluations to run at a time, each in a process of its own")
+    parser.add_argument('--recompute', action='store_true', default=False,
+      help="run the evaluator even for runs whose evaluation is cached")
+    parser.add_argument('--group-size', type=int, default=None,
+      help="runs handed to one eval-batch.sh at most, when the evaluator "
+           "has one; 1 starts eval.sh for every run "
+           "(default: [evaluate] group_size, 20)")
+    parser.add_argument('--team', type=str, default=None,
+      help="only runs of this team, by id or description")
+    parser.add_argument('--cp', dest='challenge_problem', type=int,
+      default=None, help="only runs of this challenge problem")
+    parser.add_argument('--since', type=date, default=None,
+      help="only runs started on or after this YYYY-MM-DD date")
     parser.set_defaults(func=evaluate_all_cli)
 
 
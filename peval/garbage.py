@@ -0,0 +1,394 @@
+#!/usr/bin/python
+# garbage.py -- store garbage collection          -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Garbage collection of the artifact store.
+
+    Mark: every identifier that a column of index.db refers to (see
+    store.ARTIFACT_COLUMNS) is read in a single read transaction.
+
+    Sweep: the fan-out directories are swept concurrently, removing
+
+      archive  :: archives that nothing refers to
+      index    :: member indexes of removed or missing archives
+      partial  :: '.tmp-' files left behind by interrupted writes
+      stage    :: directories of .staging left behind by interrupted runs
+      chunk    :: chunks that no remaining manifest lists
+
+    The digest memo (see memo.py) forgets the paths that are gone too.
+
+    peval keeps working meanwhile.  Nothing changed within GRACE of the
+    mark is removed, which covers an archive committed just before its row
+    is written to index.db; commit_resource and store_chunk touch what
+    they find already stored, so reuse counts as a change.  Commits wait
+    for the store lock while the sweep runs.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import collections
+import os
+import os.path as osp
+import shutil
+import time
+from multiprocessing.pool import ThreadPool
+
+from . import cache
+from . import chunkstore
+from . import codec
+from . import digest as digests
+from . import layout
+from . import members
+from . import memo
+from . import store
+from . import utility
+
+
+GRACE = 60 * 60
+
+UNITS = {'m': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+
+KINDS = ['archive', 'index', 'partial', 'stage', 'chunk']
+
+Garbage = collections.namedtuple('Garbage', 'kind path size')
+
+
+def parse_since(text, now=None):
+    """
+      takes in an age such as '12h' or '30d', or a date such as
+      '2015-06-01' or '2015-06-01 12:00'
+      returns it in seconds since the epoch
+    """
+    text = text.strip()
+    unit = text[-1:].lower()
+    if unit in UNITS:
+        try:
+            return (now or time.time()) - float(text[:-1]) * UNITS[unit]
+        except ValueError:
+            pass
+    for form in ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return time.mktime(time.strptime(text, form))
+        except ValueError:
+            continue
+    raise utility.FormattedError("Cannot read '{}' as an age or a date", text)
+
+
+def changed(path):
+    """
+      returns when path last changed, None if it is gone.  a hardlink or a
+      touch moves ctime, so a freshly published archive counts as changed.
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    return max(st.st_mtime, st.st_ctime)
+
+
+def tree_changed(path):
+    latest = changed(path) or 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            latest = max(latest, changed(osp.join(dirpath, name)) or 0)
+    return latest
+
+
+#####################################
+##         MARK
+#####################################
+
+def mark():
+    """
+      returns every identifier index.db refers to, as of one snapshot
+    """
+    connection = store.connect()
+    try:
+        connection.execute("BEGIN")
+        return store.referenced_identifiers(connection)
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+#####################################
+##         SWEEP
+#####################################
+
+def shard_garbage(directory, live, keep_after, partial_after):
+    """
+      returns the Garbage of one fan-out directory, archives first
+    """
+    archives, rest = [], []
+    names = set(os.listdir(directory))
+    gone = set()
+
+    for name in sorted(names):
+        path = osp.join(directory, name)
+        if layout.is_identifier(name):
+            if name in live or (changed(path) or keep_after) >= keep_after:
+                continue
+            archives.append(Garbage('archive', path, osp.getsize(path)))
+            gone.add(name)
+        elif name.startswith('.tmp-'):
+            if (changed(path) or partial_after) < partial_after:
+                rest.append(Garbage('partial', path, osp.getsize(path)))
+
+    for name in sorted(names):
+        if not name.endswith(members.SUFFIX):
+            continue
+        archive = name[:-len(members.SUFFIX)]
+        path = osp.join(directory, name)
+        if archive in gone or (archive not in names and
+                               (changed(path) or partial_after)
+                               < partial_after):
+            rest.append(Garbage('index', path, osp.getsize(path)))
+
+    return archives + rest
+
+
+def flat_garbage(root, live, keep_after):
+    """
+      returns the Garbage among the top level archives a dry run leaves
+      unmigrated, which the real collection would find in their shards
+    """
+    found = []
+    for name in layout.flat_archives(root):
+        path = osp.join(root, name)
+        if name in live or (changed(path) or keep_after) >= keep_after:
+            continue
+        found.append(Garbage('archive', path, osp.getsize(path)))
+        index = members.index_path(path)
+        if osp.isfile(index):
+            found.append(Garbage('index', index, osp.getsize(index)))
+    return found
+
+
+def stage_garbage(root, partial_after):
+    staging = osp.join(root, utility.STAGING)
+    if not osp.isdir(staging):
+        return []
+    found = []
+    for name in sorted(os.listdir(staging)):
+        path = osp.join(staging, name)
+        if tree_changed(path) < partial_after:
+            found.append(Garbage('stage', path, cache.tree_size(path)))
+    return found
+
+
+def staged_manifests(root, stages):
+    """
+      yields the cdc archives of every stage that is not garbage
+    """
+    staging = osp.join(root, utility.STAGING)
+    if not osp.isdir(staging):
+        return
+    for name in os.listdir(staging):
+        path = osp.join(staging, name)
+        if path in stages or not osp.isdir(path):
+            continue
+        for entry in os.listdir(path):
+            c = codec.for_path(entry)
+            if c is not None and c.name == 'cdc':
+                yield osp.join(path, entry)
+
+
+def live_chunks(root, swept, stages):
+    """
+      returns the SHA256 of every chunk listed by an archive that is kept
+    """
+    manifests = [path for path, c in store.stored_archives()
+                 if c.name == 'cdc' and path not in swept]
+    manifests.extend(staged_manifests(root, stages))
+    live = set()
+    for path in manifests:
+        try:
+            live.update(sha for sha, length in
+                        chunkstore.manifest_chunks(path))
+        except (IOError, OSError):
+            continue # published or removed since it was listed
+        except ValueError:
+            # a partially written manifest; keeping everything is safe
+            return None
+    return live
+
+
+def chunk_garbage(directory, live, partial_after):
+    found = []
+    for name in sorted(os.listdir(directory)):
+        path = osp.join(directory, name)
+        if (changed(path) or partial_after) >= partial_after:
+            continue
+        if name.startswith('.tmp-'):
+            found.append(Garbage('partial', path, osp.getsize(path)))
+        elif name not in live:
+            found.append(Garbage('chunk', path, osp.getsize(path)))
+    return found
+
+
+def subdirectories(root, width):
+    if not osp.isdir(root):
+        return []
+    return [osp.join(root, name) for name in sorted(os.listdir(root))
+            if len(name) == width and osp.isdir(osp.join(root, name))]
+
+
+def remove(garbage, keep_after, partial_after):
+    """
+      removes garbage unless it changed since it was found; returns what
+      was removed
+    """
+    removed = []
+    for g in garbage:
+        after = keep_after if g.kind == 'archive' else partial_after
+        if g.kind == 'stage':
+            if tree_changed(g.path) >= after:
+                continue
+            shutil.rmtree(g.path, ignore_errors=True)
+        else:
+            if (changed(g.path) or after) >= after:
+                continue
+            os.unlink(g.path)
+        removed.append(g)
+    return removed
+
+
+def collect(threads=None, keep_since=None, dry_run=False):
+    """
+      marks and sweeps the store
+      returns the Garbage that was removed, or would be with dry_run
+    """
+    root = osp.normpath(utility.location_resource())
+    start = time.time()
+    partial_after = start - GRACE
+    keep_after = partial_after if keep_since is None \
+                               else min(partial_after, keep_since)
+
+    if not dry_run:
+        layout.migrate(root)
+    live = mark()
+    utility.write("{} identifiers referenced by index.db".format(len(live)))
+
+    pool = ThreadPool(threads or digests.default_threads())
+    try:
+        def sweep(find, directories, *args):
+            found = pool.map(lambda d: find(d, *args), directories)
+            if dry_run:
+                return [g for gs in found for g in gs]
+            return [g for gs in pool.map(
+                      lambda gs: remove(gs, keep_after, partial_after), found)
+                    for g in gs]
+
+        # a dry run removes nothing, so writers need not wait for it
+        with cache.locked(root, exclusive=not dry_run):
+            swept = sweep(shard_garbage, subdirectories(root, layout.FANOUT),
+                          live, keep_after, partial_after)
+            if dry_run:
+                swept.extend(flat_garbage(root, live, keep_after))
+            stages = stage_garbage(root, partial_after)
+            if not dry_run:
+                stages = remove(stages, keep_after, partial_after)
+            swept.extend(stages)
+
+            chunks = live_chunks(root,
+              set(g.path for g in swept if g.kind == 'archive'),
+              set(g.path for g in stages))
+            if chunks is not None:
+                swept.extend(sweep(chunk_garbage,
+                  subdirectories(chunkstore.chunk_root(), 2),
+                  chunks, partial_after))
+    finally:
+        pool.close()
+        pool.join()
+
+    if not dry_run:
+        index = layout.PrefixIndex(root)
+        try:
+            for g in swept:
+                if g.kind == 'archive':
+                    index.discard(osp.basename(g.path))
+        finally:
+            index.close()
+
+    return swept
+
+
+#####################################
+##         CLI
+#####################################
+
+MB = float(1 << 20)
+
+def gc_cli(arguments):
+    keep_since = None
+    if arguments.keep_since:
+        keep_since = parse_since(arguments.keep_since)
+
+    swept = collect(arguments.threads, keep_since, arguments.dry_run)
+
+    counts = collections.Counter(g.kind for g in swept)
+    sizes = collections.Counter()
+    for g in swept:
+        sizes[g.kind] += g.size
+        if arguments.verbose:
+            print(g.kind, g.path)
+
+    print("{:<8} {:>8} {:>12}".format("kind", "files", "MiB"))
+    for kind in KINDS:
+        print("{:<8} {:>8} {:>12.1f}".format(kind, counts[kind],
+                                             sizes[kind] / MB))
+    print("{} {:.1f} MiB".format(
+      "reclaimable:" if arguments.dry_run else "reclaimed:",
+      sum(sizes.values()) / MB))
+
+    if not arguments.dry_run:
+        memos = memo.DigestMemo()
+        try:
+            print("digest memo: forgot {} paths that are gone".format(
+              memos.prune()))
+        finally:
+            memos.close()
+
+
+def generate_parser(parser):
+    parser.add_argument('--dry-run', action='store_true', default=False,
+      help="only report what would be removed and the space it takes")
+
+    parser.add_argument('--keep-since', default=None,
+      help="keep unreferenced archives stored within an age such as "
+           "'30d' or since a date such as '2015-06-01'")
+
+    parser.add_argument('--threads', type=int, default=None,
+      help="sweeping threads, one per core by default")
+
+    parser.add_argument('-v', '--verbose', action='store_true', default=False,
+      help="list every file removed")
+
+    parser.set_defaults(func=gc_cli)
+    return parser
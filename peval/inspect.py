@@ -27,24 +27,54 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from __future__ import print_function
+
 import argparse
 import sys
 from . import model as mod
+from . import members
 from . import utility
 
 
 def inspect_operation_cli(arguments):
     identifier = utility.glob_resource(arguments.hash)
+    if arguments.list is not None:
+        return list_members(identifier, arguments.list)
+    if arguments.cat is not None:
+        return cat_member(identifier, arguments.cat)
     return inspect_operation(identifier)
 
 def inspect_operation(identifier):
     with utility.TemporaryDirectory(persist=True) as sandbox:
         utility.unpack_part(identifier, sandbox)
 
+def list_members(identifier, pattern='*'):
+    try:
+        for entry in members.matching(identifier, pattern):
+            print(entry['name'])
+    except (ValueError, IOError) as e:
+        raise utility.FormattedError("Cannot read '{}': {}", identifier, e)
+
+def cat_member(identifier, name):
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    try:
+        for data in members.read_member(identifier, name):
+            out.write(data)
+    except (ValueError, IOError) as e:
+        raise utility.FormattedError("Cannot read '{}': {}", identifier, e)
+    out.flush()
+
 def generate_parser(parser):
 
     # initialize subparsers
     parser.add_argument('hash', type=str, help="unique identifier hash")
 
+    parser.add_argument('--list', nargs='?', const='*', default=None,
+      metavar='PATTERN',
+      help="list the files in the artifact, or those matching PATTERN")
+
+    parser.add_argument('--cat', type=str, default=None, metavar='PATH',
+      help="write one file of the artifact to stdout without unpacking it")
+
     parser.set_defaults(func=inspect_operation_cli)
     return parser
@@ -0,0 +1,493 @@
+#!/usr/bin/python
+# jobqueue.py -- queue of runs and evaluations    -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Queue of runs and evaluations shared by workers.
+
+    Every job is a row of the job table holding the arguments of a peval
+    command, in one of these states:
+
+      pending  :: waiting for a worker
+      leased   :: held by a worker until lease_expires, which the worker
+                  pushes LEASE seconds ahead every LEASE / 3 seconds
+      done     :: the command exited with 0
+      failed   :: the command failed, or its lease expired MAX_ATTEMPTS
+                  times
+
+    A worker takes the pending job of the highest priority.  Among jobs of
+    equal priority it takes one of the team with the fewest jobs leased,
+    so that no team waits behind a large submission of another, and the
+    oldest job of that team.  Leasing is one IMMEDIATE transaction, so no
+    two workers take the same job.  When a worker dies, its lease runs out
+    and the job goes back to pending.
+
+    The queue lives in index.db unless [queue] location in peval.conf
+    names another SQLite file.  Workers on several machines share the work
+    when their locations name the same file.  An evaluation has to run on
+    the node whose index.db holds its run, so it is queued for that node.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import collections
+import contextlib
+import json
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+from . import batch
+from . import evaluate
+from . import model as mod
+from . import store
+from . import utility
+
+
+LEASE = 60.0
+POLL = 5.0
+MAX_ATTEMPTS = 3
+
+STATES = ['pending', 'leased', 'done', 'failed']
+
+NODE = socket.gethostname()
+
+"""
+  the version of model.UPGRADES that makes the job table
+"""
+SCHEMA = 17
+
+Job = collections.namedtuple('Job', 'id command team node priority attempts')
+
+
+def run_node(any_node=False):
+    """
+      the node a queued run is pinned to: the one queueing it, whose
+      index.db and store hold its artifacts, unless every node shares them
+    """
+    return None if any_node else NODE
+
+
+def queue_location():
+    return utility.store_setting('queue', 'location', mod.DB_LOC)
+
+
+class JobQueue(object):
+    """
+      the job table; every thread needs a JobQueue of its own
+    """
+
+    def __init__(self, location=None):
+        location = location or queue_location()
+        self.connection = sqlite3.connect(location, timeout=60,
+                                          isolation_level=None)
+        if location != mod.DB_LOC:
+            # index.db has it from model.upgrade
+            self.connection.executescript(mod.UPGRADES[SCHEMA])
+
+    def close(self):
+        self.connection.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # IMMEDIATE takes the write lock up front, so that what is read
+        # inside cannot change before it is written
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def add(self, command, team=None, node=None, priority=0):
+        """
+          queues the peval arguments command unless they already are
+          pending or leased; a job of them that is done or failed goes
+          back to pending.  returns whether they were queued
+        """
+        now = time.time()
+        with self.transaction() as c:
+            cursor = c.execute(
+              "INSERT OR IGNORE INTO job (command, team, node, priority, "
+              "created) VALUES (?, ?, ?, ?, ?)",
+              (json.dumps(command), team, node, priority, now))
+            if cursor.rowcount == 1:
+                return True
+            # command is unique, so the row it hit is the only job of them
+            cursor = c.execute(
+              "UPDATE job SET state = 'pending', team = ?, node = ?, "
+              "priority = ?, attempts = 0, worker = NULL, "
+              "lease_expires = NULL, rc = NULL, created = ?, finished = NULL "
+              "WHERE command = ? AND state IN ('done', 'failed')",
+              (team, node, priority, now, json.dumps(command)))
+            return cursor.rowcount == 1
+
+    def expire(self, c, now):
+        """
+          returns the jobs of workers whose leases ran out to pending, or
+          fails them once they have had MAX_ATTEMPTS
+        """
+        c.execute(
+          "UPDATE job SET worker = NULL, lease_expires = NULL, "
+          "state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+          "finished = CASE WHEN attempts >= ? THEN ? END "
+          "WHERE state = 'leased' AND lease_expires < ?",
+          (MAX_ATTEMPTS, MAX_ATTEMPTS, now, now))
+
+    def lease(self, worker, node=NODE):
+        """
+          returns the next Job for worker on node, None if there is none
+        """
+        now = time.time()
+        with self.transaction() as c:
+            self.expire(c, now)
+            (priority,) = c.execute(
+              "SELECT MAX(priority) FROM job WHERE state = 'pending' "
+              "AND (node IS NULL OR node = ?)", (node,)).fetchone()
+            if priority is None:
+                return None
+
+            leased = dict(c.execute(
+              "SELECT team, COUNT(*) FROM job WHERE state = 'leased' "
+              "GROUP BY team"))
+            oldest = c.execute(
+              "SELECT team, MIN(id) FROM job WHERE state = 'pending' "
+              "AND priority = ? AND (node IS NULL OR node = ?) "
+              "GROUP BY team", (priority, node)).fetchall()
+            team, job_id = min(
+              oldest, key=lambda head: (leased.get(head[0], 0), head[1]))
+
+            c.execute(
+              "UPDATE job SET state = 'leased', worker = ?, "
+              "lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+              (worker, now + LEASE, job_id))
+            row = c.execute(
+              "SELECT id, command, team, node, priority, attempts FROM job "
+              "WHERE id = ?", (job_id,)).fetchone()
+        return Job(row[0], json.loads(row[1]), *row[2:])
+
+    def heartbeat(self, job_id, worker):
+        """
+          extends the lease of worker on job_id
+          returns False if worker no longer holds it
+        """
+        with self.transaction() as c:
+            cursor = c.execute(
+              "UPDATE job SET lease_expires = ? WHERE id = ? AND worker = ? "
+              "AND state = 'leased'", (time.time() + LEASE, job_id, worker))
+            return cursor.rowcount == 1
+
+    def finish(self, job_id, worker, rc):
+        with self.transaction() as c:
+            c.execute(
+              "UPDATE job SET state = ?, rc = ?, finished = ?, "
+              "lease_expires = NULL WHERE id = ? AND worker = ? "
+              "AND state = 'leased'",
+              ('done' if rc == 0 else 'failed', rc, time.time(),
+               job_id, worker))
+
+    def release(self, job_id, worker):
+        """
+          hands a job worker gave up on back, without counting the attempt
+        """
+        with self.transaction() as c:
+            c.execute(
+              "UPDATE job SET state = 'pending', worker = NULL, "
+              "lease_expires = NULL, attempts = attempts - 1 "
+              "WHERE id = ? AND worker = ? AND state = 'leased'",
+              (job_id, worker))
+
+    def retry(self):
+        """
+          returns every failed job to pending; returns how many
+        """
+        with self.transaction() as c:
+            return c.execute(
+              "UPDATE job SET state = 'pending', attempts = 0, worker = NULL, "
+              "rc = NULL, finished = NULL WHERE state = 'failed'").rowcount
+
+    def rekey(self, mapping):
+        """
+          renames the identifiers in the commands of every job by mapping
+          {old: new}, as peval store rekey does in index.db; a job that
+          becomes the same as another replaces it.  returns how many jobs
+          were renamed.
+        """
+        renamed = 0
+        with self.transaction() as c:
+            for job_id, command in c.execute(
+              "SELECT id, command FROM job").fetchall():
+                old = json.loads(command)
+                new = [mapping.get(argument, argument) for argument in old]
+                if new != old:
+                    c.execute("UPDATE OR REPLACE job SET command = ? "
+                              "WHERE id = ?", (json.dumps(new), job_id))
+                    renamed += 1
+        return renamed
+
+    def counts(self):
+        """
+          returns {(team, state): jobs}
+        """
+        return dict(((team, state), count) for team, state, count in
+                    self.connection.execute(
+                      "SELECT team, state, COUNT(*) FROM job "
+                      "GROUP BY team, state"))
+
+
+#####################################
+##         WORKER
+#####################################
+
+class Worker(threading.Thread):
+    """
+      leases jobs one after the other and runs each as a peval process of
+      its own, until stopping is set or, with idle_exit, none is left
+    """
+
+    def __init__(self, name, stopping, idle_exit=False, poll=POLL, logs=None):
+        super(Worker, self).__init__(name=name)
+        self.stopping = stopping
+        self.idle_exit = idle_exit
+        self.poll = poll
+        self.logs = logs
+
+    def run(self):
+        queue = JobQueue()
+        try:
+            while not self.stopping.is_set():
+                job = queue.lease(self.name)
+                if job is None:
+                    if self.idle_exit:
+                        return
+                    self.stopping.wait(self.poll)
+                    continue
+                self.execute(queue, job)
+        finally:
+            queue.close()
+
+    def execute(self, queue, job):
+        command = [sys.executable, '-m', 'peval'] + job.command
+        sys.stderr.write("{}: job {}: peval {}\n".format(
+          self.name, job.id, ' '.join(job.command)))
+
+        out = None
+        if self.logs:
+            out = open(os.path.join(self.logs, '{}.log'.format(job.id)), 'a')
+        try:
+            process = subprocess.Popen(command, stdout=out,
+                                       stderr=subprocess.STDOUT if out else None)
+            beat = time.time() + LEASE / 3
+            while process.poll() is None:
+                if self.stopping.is_set():
+                    process.terminate()
+                    process.wait()
+                    queue.release(job.id, self.name)
+                    return
+                if time.time() >= beat:
+                    if not queue.heartbeat(job.id, self.name):
+                        # the lease ran out and the job went to another
+                        # worker, which is running it again
+                        process.terminate()
+                        process.wait()
+                        return
+                    beat = time.time() + LEASE / 3
+                self.stopping.wait(0.5)
+        finally:
+            if out:
+                out.close()
+
+        queue.finish(job.id, self.name, process.returncode)
+        sys.stderr.write("{}: job {}: {}\n".format(
+          self.name, job.id,
+          "done" if process.returncode == 0
+          else "failed ({})".format(process.returncode)))
+
+
+def worker_cli(arguments):
+    if arguments.logs and not os.path.isdir(arguments.logs):
+        os.makedirs(arguments.logs)
+
+    stopping = threading.Event()
+    # finish by handing running jobs back, as on ^C
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+
+    workers = [Worker('{}:{}:{}'.format(NODE, os.getpid(), i), stopping,
+                      arguments.idle_exit, arguments.poll, arguments.logs)
+               for i in range(arguments.jobs)]
+    for w in workers:
+        w.start()
+    try:
+        while any(w.is_alive() for w in workers):
+            for w in workers:
+                w.join(1.0)
+    except KeyboardInterrupt:
+        stopping.set()
+        for w in workers:
+            w.join()
+
+
+#####################################
+##         QUEUEING
+#####################################
+
+@mod.pny.db_session
+def solution_team(solution_id):
+    s = mod.Solution.get(id=solution_id)
+    if not s:
+        raise utility.FormattedError("solution {} is not registered",
+                                     solution_id)
+    return s.engine.team.id
+
+
+def add_cli(arguments):
+    if arguments.matrix == '-':
+        entries = batch.read_matrix(sys.stdin)
+    else:
+        with open(utility.test_path(arguments.matrix)) as f:
+            entries = batch.read_matrix(f)
+
+    queue = JobQueue()
+    try:
+        added = sum(queue.add(['run'] + list(entry),
+                              solution_team(entry[1]),
+                              run_node(arguments.any_node),
+                              arguments.priority)
+                    for entry in entries)
+    finally:
+        queue.close()
+    print("queued {} runs, {} already were".format(
+      added, len(entries) - added))
+
+
+def evaluations_cli(arguments):
+    connection = store.connect()
+    try:
+        runs = [p for batch in evaluate.pending_evaluations(connection)
+                for p in batch]
+    finally:
+        connection.close()
+    queue = JobQueue()
+    try:
+        added = sum(queue.add(['evaluate', 'run', str(p.run_id)], p.team,
+                              NODE, arguments.priority)
+                    for p in runs)
+    finally:
+        queue.close()
+    print("queued {} evaluations, {} already were".format(
+      added, len(runs) - added))
+
+
+def status_cli(arguments):
+    queue = JobQueue()
+    try:
+        counts = queue.counts()
+    finally:
+        queue.close()
+    teams = sorted(set(team for team, state in counts))
+    print("{:<8}".format("team") + "".join("{:>10}".format(s) for s in STATES))
+    for team in teams:
+        print("{:<8}".format(team) + "".join(
+          "{:>10}".format(counts.get((team, s), 0)) for s in STATES))
+
+
+def retry_cli(arguments):
+    queue = JobQueue()
+    try:
+        print("{} failed jobs queued again".format(queue.retry()))
+    finally:
+        queue.close()
+
+
+#####################################
+##         PARSERS
+#####################################
+
+def add_subparser(subparsers):
+    parser = subparsers.add_parser('add')
+    parser.add_argument('matrix', type=str,
+      help="file of 'engine solution config dataset' lines, or - for "
+           "stdin, as for run-batch")
+    parser.add_argument('--priority', type=int, default=0,
+      help="jobs of higher priority are leased first")
+    parser.add_argument('--any-node', action='store_true', default=False,
+      help="let workers on every node run the jobs, for nodes that share "
+           "index.db and the store; by default only this node's do")
+    parser.set_defaults(func=add_cli)
+
+
+def evaluations_subparser(subparsers):
+    parser = subparsers.add_parser('evaluations')
+    parser.add_argument('--priority', type=int, default=0,
+      help="jobs of higher priority are leased first")
+    parser.set_defaults(func=evaluations_cli)
+
+
+def status_subparser(subparsers):
+    parser = subparsers.add_parser('status')
+    parser.set_defaults(func=status_cli)
+
+
+def retry_subparser(subparsers):
+    parser = subparsers.add_parser('retry')
+    parser.set_defaults(func=retry_cli)
+
+
+def generate_parser(parser):
+    subparsers = parser.add_subparsers(help="subcommand")
+
+    # initialize subparsers
+    add_subparser(subparsers)
+    evaluations_subparser(subparsers)
+    status_subparser(subparsers)
+    retry_subparser(subparsers)
+
+    return parser
+
+
+def generate_worker_parser(parser):
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+      help="jobs to run at a time")
+
+    parser.add_argument('--idle-exit', action='store_true', default=False,
+      help="exit once no job is pending instead of waiting for more")
+
+    parser.add_argument('--poll', type=float, default=POLL,
+      help="seconds between looks at an empty queue")
+
+    parser.add_argument('--logs', type=str, default=None,
+      help="directory to write the output of each job to, <job id>.log")
+
+    parser.set_defaults(func=worker_cli)
+    return parser
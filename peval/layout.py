@@ -0,0 +1,252 @@
+#!/usr/bin/python
+# layout.py -- fan-out layout of the store        -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Fan-out layout of the artifact store.
+
+    Archives live in directories named by the first two hex digits of
+    their identifier, next to their member index:
+
+      <store>/ab/abcdef....tar.bz2
+      <store>/ab/abcdef....tar.bz2.idx
+
+    and <store>/prefixes.db indexes every identifier, so that resolving a
+    unique prefix is one indexed lookup instead of a directory scan.
+
+    Stores from before the fan-out keep their archives at the top level.
+    Those are moved into place one at a time as they are looked up, or
+    all at once by migrate().  Once none are left the prefix index records
+    it, and lookups no longer search the top level.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import errno
+import glob
+import os
+import os.path as osp
+import sqlite3
+
+from . import codec
+from . import digest
+from . import members
+
+
+FANOUT = 2
+
+INDEX = 'prefixes.db'
+
+"""
+  the prefix index's user_version once no archive is left at the top
+  level, so that resolve stops looking there
+"""
+MIGRATED = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifact (
+  name TEXT NOT NULL PRIMARY KEY
+);
+"""
+
+
+def is_identifier(fname):
+    return digest.version_of(fname) is not None and \
+           codec.for_path(fname) is not None
+
+
+def artifact_path(root, fname):
+    """
+      where the archive fname belongs; anything that is not an archive
+      (index.db, peval.conf, ...) stays at the top level
+    """
+    if is_identifier(fname):
+        return osp.join(root, fname[:FANOUT], fname)
+    return osp.join(root, fname)
+
+
+def make_shard(root, fname):
+    try:
+        os.mkdir(osp.dirname(artifact_path(root, fname)))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def migrate_one(root, fname, index=None):
+    """
+      moves a top level archive and its index into its shard and adds it to
+      the prefix index, which is opened unless given; returns the new path,
+      or None if there was nothing to move
+    """
+    flat = osp.join(root, fname)
+    if not is_identifier(fname) or not osp.isfile(flat):
+        return None
+    make_shard(root, fname)
+    path = artifact_path(root, fname)
+    # the index first, so that a moved archive always has its index
+    for source, destination in [(members.index_path(flat),
+                                 members.index_path(path)),
+                                (flat, path)]:
+        try:
+            os.rename(source, destination)
+        except OSError as e:
+            # there is no index, or another process moved it first
+            if e.errno != errno.ENOENT:
+                raise
+
+    if index is not None:
+        index.add(fname)
+        return path
+    index = PrefixIndex(root)
+    try:
+        index.add(fname)
+    finally:
+        index.close()
+    return path
+
+
+def flat_archives(root, pattern='*'):
+    return [osp.basename(p) for p in glob.glob(osp.join(root, pattern))
+            if is_identifier(osp.basename(p)) and osp.isfile(p)]
+
+
+def sharded_archives(root):
+    """
+      yields the name of every archive in a shard
+    """
+    for shard in sorted(os.listdir(root)):
+        directory = osp.join(root, shard)
+        if len(shard) != FANOUT or not osp.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if is_identifier(name):
+                yield name
+
+
+class PrefixIndex(object):
+    """
+      every identifier in the store, kept in SQLite.  the index is
+      rebuilt from the shards whenever the database is missing, and
+      records whether archives remain at the top level.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        location = osp.join(root, INDEX)
+        fresh = not osp.exists(location)
+        self.connection = sqlite3.connect(location, timeout=30)
+        self.connection.executescript(SCHEMA)
+        if fresh:
+            self.rebuild()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def rebuild(self):
+        self.connection.execute("DELETE FROM artifact")
+        self.connection.executemany(
+          "INSERT OR IGNORE INTO artifact (name) VALUES (?)",
+          ((name,) for name in sharded_archives(self.root)))
+        self.mark_migrated(not flat_archives(self.root))
+        self.connection.commit()
+
+    @property
+    def migrated(self):
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        return version == MIGRATED
+
+    def mark_migrated(self, migrated):
+        self.connection.execute(
+          "PRAGMA user_version = %d" % (MIGRATED if migrated else 0))
+
+    def add(self, name):
+        self.connection.execute(
+          "INSERT OR IGNORE INTO artifact (name) VALUES (?)", (name,))
+
+    def discard(self, name):
+        self.connection.execute("DELETE FROM artifact WHERE name = ?", (name,))
+
+    def candidates(self, prefix, limit=2):
+        """
+          returns up to limit identifiers starting with prefix
+        """
+        if not prefix:
+            rows = self.connection.execute(
+              "SELECT name FROM artifact LIMIT ?", (limit,))
+        else:
+            # a range scan of the primary key rather than LIKE, which
+            # would not use it
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            rows = self.connection.execute(
+              "SELECT name FROM artifact WHERE name >= ? AND name < ? "
+              "ORDER BY name LIMIT ?", (prefix, upper, limit))
+        return [str(name) for (name,) in rows]
+
+
+def resolve(root, prefix):
+    """
+      returns the names of up to two archives whose identifiers start with
+      prefix.  the top level is only searched while the store is not fully
+      migrated and the index knows fewer than two such archives, which
+      would make the prefix unique; whatever is found there is moved into
+      place.
+    """
+    index = PrefixIndex(root)
+    try:
+        names = set(name for name in index.candidates(prefix)
+                    if osp.exists(artifact_path(root, name)))
+        if len(names) > 1 or index.migrated:
+            return sorted(names)
+
+        for name in flat_archives(root, prefix + '*'):
+            migrate_one(root, name, index)
+            names.add(name)
+        if not names and not flat_archives(root):
+            index.mark_migrated(True)
+        return sorted(names)[:2]
+    finally:
+        index.close()
+
+
+def migrate(root):
+    """
+      moves every top level archive into its shard and rebuilds the prefix
+      index; returns the number of archives moved
+    """
+    moved = 0
+    index = PrefixIndex(root)
+    try:
+        for name in flat_archives(root):
+            if migrate_one(root, name, index):
+                moved += 1
+        index.rebuild()
+    finally:
+        index.close()
+    return moved
@@ -0,0 +1,341 @@
+#!/usr/bin/python
+# limits.py -- resource limits of a run           -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Resource limits of a run.
+
+    run.sh and everything it starts are held to
+
+      memory        :: bytes resident in the whole tree
+      cpu_seconds   :: CPU time used by the whole tree
+      wall_seconds  :: time since run.sh started
+      file_size     :: bytes of any single file written
+      output_size   :: bytes in the output directory
+
+    Every process gets the setrlimit of cpu_seconds and file_size
+    (RLIMIT_CPU, RLIMIT_FSIZE), which the kernel enforces per process at
+    once.  Memory is not held to RLIMIT_AS, which limits address space
+    rather than memory and stops runtimes that reserve a lot of it long
+    before they use it; in a cgroup the kernel enforces memory.max
+    instead.  The tree as a whole is checked by a Watchdog thread, which
+    tears it down when a limit is passed: SIGTERM to run.sh's process
+    group and every process of the tree, then SIGKILL to whatever is left
+    GRACE seconds later.  run.sh leads a process group of its own for
+    this.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import collections
+import errno
+import math
+import os
+import resource
+import signal
+import threading
+import time
+
+from . import sampler
+
+
+INTERVAL = 0.5
+GRACE = 10.0
+
+FIELDS = ['memory', 'cpu_seconds', 'wall_seconds', 'file_size', 'output_size']
+
+SIZES = dict(k=1 << 10, m=1 << 20, g=1 << 30, t=1 << 40)
+SECONDS = dict(s=1, m=60, h=3600, d=86400)
+
+
+def parse_size(text):
+    """
+      takes in bytes such as '512M', '4g' or '1000'
+    """
+    text = str(text).strip().lower().rstrip('b')
+    if text and text[-1] in SIZES:
+        return int(float(text[:-1]) * SIZES[text[-1]])
+    return int(text)
+
+
+def parse_seconds(text):
+    """
+      takes in a time such as '90', '90s', '30m' or '2h'
+    """
+    text = str(text).strip().lower()
+    if text and text[-1] in SECONDS:
+        return float(text[:-1]) * SECONDS[text[-1]]
+    return float(text)
+
+
+PARSERS = dict(memory=parse_size, cpu_seconds=parse_seconds,
+               wall_seconds=parse_seconds, file_size=parse_size,
+               output_size=parse_size)
+
+
+class Limits(collections.namedtuple('Limits', FIELDS)):
+    """
+      limits of a run; None is no limit
+    """
+
+    def __nonzero__(self):
+        return any(value is not None for value in self)
+
+    __bool__ = __nonzero__
+
+    @classmethod
+    def parse(cls, settings):
+        """
+          takes in {field: text}, as read from peval.conf
+        """
+        return cls(*[None if settings.get(f) in (None, '', 'none')
+                     else PARSERS[f](settings[f]) for f in FIELDS])
+
+    def update(self, other):
+        """
+          returns these limits with those set in other replacing them
+        """
+        return Limits(*[b if b is not None else a for a, b in zip(self, other)])
+
+
+NONE = Limits(*[None] * len(FIELDS))
+
+
+#####################################
+##         IN THE CHILD
+#####################################
+
+def set_rlimit(which, value):
+    soft, hard = resource.getrlimit(which)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(which, (value, hard))
+
+
+def preexec(limits, grace=GRACE, then=None):
+    """
+      a preexec_fn putting the child in a process group of its own under
+      the rlimits of limits, then calling then
+    """
+    def setup():
+        os.setpgrp()
+        if limits.cpu_seconds is not None:
+            # SIGXCPU at the limit, which the hard limit's SIGKILL follows
+            soft = int(math.ceil(limits.cpu_seconds))
+            hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+            if hard != resource.RLIM_INFINITY:
+                soft = min(soft, hard)
+            else:
+                hard = soft + int(math.ceil(grace))
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+        if limits.file_size is not None:
+            set_rlimit(resource.RLIMIT_FSIZE, limits.file_size)
+        if then:
+            then()
+    return setup
+
+
+def largest_file(path):
+    largest = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                largest = max(largest,
+                              os.lstat(os.path.join(root, name)).st_size)
+            except OSError:
+                pass
+    return largest
+
+
+def enforced_limit(rc, limits, usage=None, outputdir=None, leaf=None):
+    """
+      the limit the kernel enforced on run.sh or a descendant, if any,
+      from its return code as returned by utility.reap, the rusage of the
+      tree and what it left in outputdir.  a shell reports a child killed
+      by signal n as 128 + n.  a run that exited 0 hit no limit, whatever
+      it used: the kernel allows a file of exactly file_size bytes.
+    """
+    if not rc:
+        return None
+    killed = lambda signum: rc in (-signum, 128 + signum)
+    if limits.cpu_seconds is not None and (killed(signal.SIGXCPU) or
+       usage and usage['user_seconds'] + usage['system_seconds'] >
+                 limits.cpu_seconds):
+        return 'cpu_seconds'
+    if limits.file_size is not None and (killed(signal.SIGXFSZ) or
+       outputdir and largest_file(outputdir) > limits.file_size):
+        return 'file_size'
+    if limits.memory is not None and leaf is not None and leaf.oom_kills():
+        return 'memory'
+    return None
+
+
+#####################################
+##         WATCHDOG
+#####################################
+
+def directory_size(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def signal_pid(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+
+def signal_group(pgid, signum):
+    try:
+        os.killpg(pgid, signum)
+    except OSError as e:
+        if e.errno not in (errno.ESRCH, errno.EPERM):
+            raise
+
+
+class Watchdog(threading.Thread):
+    """
+      holds the process tree of process to limits, tearing it down when
+      one is passed; hit names the limit, None while none was
+    """
+
+    def __init__(self, process, limits, outputdir=None, leaf=None,
+                 interval=INTERVAL, grace=GRACE):
+        super(Watchdog, self).__init__(name='peval-watchdog')
+        self.daemon = True
+        self.process = process
+        self.limits = limits
+        self.outputdir = outputdir
+        self.leaf = leaf
+        self.interval = interval
+        self.grace = grace
+        self.start_time = time.time()
+        self.hit = None
+        self.stopped = threading.Event()
+
+    def tree(self):
+        if self.leaf is not None:
+            return self.leaf.pids()
+        try:
+            children = self.process.children(recursive=True)
+        except sampler.GONE:
+            return []
+        return [self.process.pid] + [child.pid for child in children]
+
+    def processes(self):
+        processes = [self.process]
+        try:
+            processes.extend(self.process.children(recursive=True))
+        except sampler.GONE:
+            return []
+        return processes
+
+    def usage(self):
+        """
+          returns (bytes resident, CPU seconds) of the tree.  the CPU time
+          of every live process includes that of the children it reaped,
+          so none is counted twice.
+        """
+        rss, cpu = 0, 0.0
+        for process in self.processes():
+            try:
+                rss += process.memory_info().rss
+                cpu += sampler.cpu_seconds(process.cpu_times())
+            except sampler.GONE:
+                continue
+        if self.leaf is not None:
+            cpu = self.leaf.usage_usec() / 1e6
+            current = self.leaf.read('memory.current')
+            if current:
+                rss = int(current)
+        return rss, cpu
+
+    def check(self):
+        """
+          returns the limit passed, if any
+        """
+        limits = self.limits
+        if limits.wall_seconds is not None and \
+           time.time() - self.start_time > limits.wall_seconds:
+            return 'wall_seconds'
+        if limits.memory is not None or limits.cpu_seconds is not None:
+            rss, cpu = self.usage()
+            if limits.memory is not None and rss > limits.memory:
+                return 'memory'
+            if limits.cpu_seconds is not None and cpu > limits.cpu_seconds:
+                return 'cpu_seconds'
+        if limits.output_size is not None and self.outputdir and \
+           directory_size(self.outputdir) > limits.output_size:
+            return 'output_size'
+        return None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            hit = self.check()
+            if hit:
+                self.hit = hit
+                self.teardown()
+                return
+
+    def teardown(self):
+        """
+          SIGTERM to the tree, then SIGKILL to what is left after grace
+        """
+        pids = set(self.tree())
+        for signum in (signal.SIGTERM, signal.SIGKILL):
+            signal_group(self.process.pid, signum)
+            for pid in pids:
+                signal_pid(pid, signum)
+            if signum == signal.SIGKILL:
+                break
+            deadline = time.time() + self.grace
+            while time.time() < deadline:
+                pids = set(self.tree())
+                if not pids:
+                    return
+                time.sleep(0.1)
+            pids |= set(self.tree())
+
+    def stop(self):
+        """
+          stops watching once run.sh has exited, and tears down whatever
+          it left running in its process group
+        """
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+        signal_group(self.process.pid, signal.SIGKILL)
+        return self.hit
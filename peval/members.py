@@ -0,0 +1,210 @@
+#!/usr/bin/python
+# members.py -- member index of stored archives   -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Member index of stored archives.
+
+    Next to every archive written by utility sits '<identifier>.idx', a
+    JSON list with one entry per member:
+
+      name      :: path within the artifact
+      type      :: 'file', 'link' (a hardlink), 'symlink' or 'other'
+      size      :: bytes of contents
+      mode      :: permission bits
+      offset    :: where the contents start in the uncompressed tar stream
+      linkname  :: target of links
+
+    Only plain tar ('.tar') and chunk store ('.tar.cdc') archives are
+    seekable, so only there is a member read by seeking straight to its
+    offset.  For the compressed codecs (bz2, gz, xz, zst, lz4) the index
+    just lists the members: reading one still decompresses the stream from
+    the start up to it, and stops there.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import fnmatch
+import json
+import os
+import os.path as osp
+import tarfile
+
+from . import chunkstore
+from . import codec
+
+
+SUFFIX = '.idx'
+
+BUFFER_SIZE = 1 << 20
+
+
+def index_path(archive):
+    return archive + SUFFIX
+
+
+def member_type(tarinfo):
+    if tarinfo.isreg():
+        return 'file'
+    if tarinfo.islnk():
+        return 'link'
+    if tarinfo.issym():
+        return 'symlink'
+    return 'other'
+
+
+def entry(tarinfo, offset):
+    return dict(name=tarinfo.name, type=member_type(tarinfo),
+                size=tarinfo.size if tarinfo.isreg() else 0,
+                mode=tarinfo.mode, offset=offset,
+                linkname=tarinfo.linkname)
+
+
+def written_entries(tar):
+    """
+      takes in a tarfile that has just been written
+      returns the index of its members.  headers are rebuilt to learn their
+      length, which is exactly what was written since tobuf is pure.
+    """
+    entries, offset = [], 0
+    for tarinfo in tar.members:
+        offset += len(tarinfo.tobuf(tar.format, tar.encoding, tar.errors))
+        entries.append(entry(tarinfo, offset))
+        if tarinfo.isreg():
+            blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+            offset += (blocks + bool(remainder)) * tarfile.BLOCKSIZE
+    return entries
+
+
+def read_entries(archive):
+    """
+      returns the index of an archive by reading it through
+    """
+    with codec.reader(archive) as tar:
+        return [entry(tarinfo, tarinfo.offset_data) for tarinfo in tar]
+
+
+def save_index(archive, entries):
+    path = index_path(archive)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(entries, f, separators=(',', ':'))
+    os.rename(path + '.tmp', path)
+
+
+def load_index(archive, build=True):
+    """
+      returns the index of archive, building and saving it if it is missing
+      and build is set
+    """
+    try:
+        with open(index_path(archive)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        if not build:
+            return None
+    entries = read_entries(archive)
+    try:
+        save_index(archive, entries)
+    except (IOError, OSError):
+        pass # a read only store still answers
+    return entries
+
+
+def normalize(name):
+    while name.startswith('./'):
+        name = name[2:]
+    return name.lstrip('/')
+
+
+def matching(archive, pattern='*'):
+    """
+      returns the entries whose names match the shell pattern
+    """
+    pattern = normalize(pattern)
+    return [e for e in load_index(archive)
+            if fnmatch.fnmatchcase(e['name'], pattern)]
+
+
+def find(entries, name):
+    """
+      returns the entry holding the contents of name, following hardlinks
+    """
+    by_name = dict((e['name'], e) for e in entries)
+    e = by_name.get(normalize(name))
+    if e is None:
+        raise ValueError("no member named '%s'" % name)
+    while e['type'] == 'link':
+        e = by_name[normalize(e['linkname'])]
+    if e['type'] != 'file':
+        raise ValueError("'%s' is a %s" % (name, e['type']))
+    return e
+
+
+def seekable(archive):
+    """
+      returns an open file object of the uncompressed tar stream if it can
+      be seeked without decompressing, else None
+    """
+    c = codec.for_path(archive)
+    if c is None or c.name == 'none':
+        return open(archive, 'rb')
+    if c.name == 'cdc':
+        with open(archive, 'rb') as f:
+            return chunkstore.ChunkReader(f)
+    return None
+
+
+def read_member(archive, name):
+    """
+      yields the contents of member name of archive, in pieces; a
+      compressed archive is read from its start (see above)
+    """
+    e = find(load_index(archive), name)
+
+    stream = seekable(archive)
+    if stream is not None:
+        try:
+            stream.seek(e['offset'])
+            left = e['size']
+            while left > 0:
+                data = stream.read(min(left, BUFFER_SIZE))
+                if not data:
+                    raise IOError("'%s' is truncated" % archive)
+                left -= len(data)
+                yield data
+        finally:
+            stream.close()
+        return
+
+    with codec.reader(archive, whole=False) as tar:
+        for tarinfo in tar:
+            if tarinfo.offset_data == e['offset']:
+                f = tar.extractfile(tarinfo)
+                for data in iter(lambda: f.read(BUFFER_SIZE), b''):
+                    yield data
+                return
@@ -0,0 +1,221 @@
+#!/usr/bin/python
+# memo.py -- stat based digest memoization        -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Stat based memoization of digests.
+
+    A file whose (device, inode, size, mtime_ns, mode, path) has not
+    changed since it was last hashed is assumed to have the same contents.
+    Two things are remembered in a SQLite database in the XDG cache:
+
+      file :: the version 2 hash of every file that was hashed
+      tree :: the identifier digest of every list of files that was hashed,
+              keyed by the stat signature of the whole list, with the root
+              of the tree
+
+    Only registrations are memoized: they hash the same trees again and
+    again, while run outputs and evaluations live in sandboxes that are
+    gone afterwards.  prune drops the rows of paths that no longer exist.
+
+    Files modified within RACY_SECONDS of being looked at are never
+    remembered, since a later write in the same mtime tick would go unseen.
+
+    This module imports no other part of peval so that utility may import
+    it.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import hashlib
+import os
+import os.path as osp
+import sqlite3
+import time
+
+import xdg.BaseDirectory
+
+
+RACY_SECONDS = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS file (
+  path TEXT NOT NULL,
+  version INTEGER NOT NULL,
+  dev INTEGER NOT NULL,
+  ino INTEGER NOT NULL,
+  size INTEGER NOT NULL,
+  mtime_ns INTEGER NOT NULL,
+  mode INTEGER NOT NULL,
+  node BLOB NOT NULL,
+  PRIMARY KEY (path, version)
+);
+
+CREATE TABLE IF NOT EXISTS tree (
+  signature TEXT NOT NULL PRIMARY KEY,
+  digest TEXT NOT NULL,
+  meta_created DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  root TEXT
+);
+"""
+
+
+def memo_location():
+    return osp.join(xdg.BaseDirectory.save_cache_path('peval'), 'digests.db')
+
+
+def stat_key(path, now=None):
+    """
+      returns (dev, ino, size, mtime_ns, mode) of path, or None when path
+      was modified too recently to be trusted
+    """
+    st = os.lstat(path)
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    if (now or time.time()) - mtime_ns / 1e9 < RACY_SECONDS:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, mtime_ns, st.st_mode)
+
+
+class DigestMemo(object):
+
+    def __init__(self, location=None):
+        self.connection = sqlite3.connect(location or memo_location(),
+                                          timeout=30)
+        self.connection.executescript(SCHEMA)
+        columns = [row[1] for row in
+                   self.connection.execute("PRAGMA table_info(tree)")]
+        if 'root' not in columns:
+            # memos from before roots were kept; prune drops their rows
+            self.connection.execute("ALTER TABLE tree ADD COLUMN root TEXT")
+        self.now = time.time()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def signature(self, items, version):
+        """
+          takes in [(path, arcname)]
+          returns a key for the whole list, None if any file is racy
+        """
+        sha = hashlib.sha1(("%d" % version).encode('ascii'))
+        for path, arcname in sorted(items):
+            key = stat_key(path, self.now)
+            if key is None:
+                return None
+            sha.update(repr((path, arcname) + key).encode('utf-8'))
+        return sha.hexdigest()
+
+    def lookup_tree(self, signature):
+        if signature is None:
+            return None
+        row = self.connection.execute(
+          "SELECT digest FROM tree WHERE signature = ?", (signature,)
+        ).fetchone()
+        return str(row[0]) if row else None
+
+    def remember_tree(self, signature, digest, root=None):
+        if signature is None:
+            return
+        self.connection.execute(
+          "INSERT OR REPLACE INTO tree (signature, digest, root) "
+          "VALUES (?, ?, ?)", (signature, digest, root))
+
+    def prune(self):
+        """
+          forgets the files and trees whose paths no longer exist
+          returns how many rows were dropped
+        """
+        dropped = 0
+        for table, column in (('file', 'path'), ('tree', 'root')):
+            gone = [(path,) for (path,) in self.connection.execute(
+                      "SELECT DISTINCT {} FROM {}".format(column, table))
+                    if path is None or not osp.lexists(path)]
+            for (path,) in gone:
+                dropped += self.connection.execute(
+                  "DELETE FROM {0} WHERE {1} IS ?".format(table, column),
+                  (path,)).rowcount
+        return dropped
+
+    def lookup_files(self, paths, version):
+        """
+          returns {path: node} for every path whose stat key is unchanged
+        """
+        known = {}
+        for path in paths:
+            key = stat_key(path, self.now)
+            if key is None:
+                continue
+            row = self.connection.execute(
+              "SELECT dev, ino, size, mtime_ns, mode, node FROM file "
+              "WHERE path = ? AND version = ?", (path, version)
+            ).fetchone()
+            if row and tuple(row[:5]) == key:
+                known[path] = bytes(row[5])
+        return known
+
+    def remember_files(self, nodes, version):
+        """
+          takes in {path: node}
+        """
+        rows = []
+        for path, node in nodes.items():
+            key = stat_key(path, self.now)
+            if key is not None:
+                rows.append((path, version) + key + (sqlite3.Binary(node),))
+        self.connection.executemany(
+          "INSERT OR REPLACE INTO file "
+          "(path, version, dev, ino, size, mtime_ns, mode, node) "
+          "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+class NoMemo(object):
+    """
+      the interface of DigestMemo, remembering nothing; for trees that are
+      hashed once, like the outputs of runs
+    """
+
+    def close(self):
+        pass
+
+    def signature(self, items, version):
+        return None
+
+    def lookup_tree(self, signature):
+        return None
+
+    def remember_tree(self, signature, digest, root=None):
+        pass
+
+    def lookup_files(self, paths, version):
+        return {}
+
+    def remember_files(self, nodes, version):
+        pass
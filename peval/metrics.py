@@ -0,0 +1,342 @@
+#!/usr/bin/python
+# metrics.py -- scores evaluators report          -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Metrics an evaluator reports, kept in index.db.
+
+    An evaluator that writes metrics.json or metrics.csv at the top of its
+    output directory has every metric in it saved to the metric table when
+    its evaluation is saved, one row per run and metric name.  Finite
+    numbers go to the value column and anything else, NaN and infinities
+    included, to the text column, so that the scores of a challenge
+    problem come out of one query (see EXPORT) without unpacking a single
+    evaluation.
+
+      metrics.json :: {"f1": 0.83, "states": 1204, "parser": "pcfgla"}
+                      nested objects are flattened to "a.b" names
+      metrics.csv  :: name,value lines, an optional name,value header first
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import csv
+import json
+import math
+import os.path as osp
+import sys
+
+from . import members
+from . import model as mod
+from . import store
+from . import utility
+
+
+FILES = ['metrics.json', 'metrics.csv']
+
+
+#####################################
+##         PARSING
+#####################################
+
+def typed(value):
+    """
+      returns value as a float if it is a finite number, else as text.
+      SQLite would store NaN as NULL, so non-finite numbers are text too:
+      'nan', 'inf' or '-inf', or the text they were written as.
+    """
+    if isinstance(value, basestring):
+        try:
+            number = float(value)
+        except ValueError:
+            return value.strip()
+        text = value.strip()
+    elif isinstance(value, (bool, int, long, float)):
+        try:
+            number = float(value)
+        except OverflowError:
+            # an integer out of a float's range
+            return str(value)
+        text = repr(number)
+    else:
+        return json.dumps(value, sort_keys=True)
+    if math.isnan(number) or math.isinf(number):
+        return text
+    return number
+
+
+def flatten(document, prefix=''):
+    if not isinstance(document, dict):
+        return {prefix.rstrip('.') or 'value': typed(document)}
+    metrics = {}
+    for name, value in document.items():
+        if isinstance(value, dict):
+            metrics.update(flatten(value, prefix + name + '.'))
+        else:
+            metrics[prefix + name] = typed(value)
+    return metrics
+
+
+def parse_json(text):
+    return flatten(json.loads(text))
+
+
+def parse_csv(text):
+    metrics = {}
+    for number, row in enumerate(csv.reader(text.splitlines())):
+        if not row or row[0].startswith('#'):
+            continue
+        if number == 0 and [c.strip().lower() for c in row] == ['name', 'value']:
+            continue
+        if len(row) != 2:
+            raise ValueError("line {} is not name,value".format(number + 1))
+        metrics[row[0].strip()] = typed(row[1])
+    return metrics
+
+
+PARSERS = {'metrics.json': parse_json, 'metrics.csv': parse_csv}
+
+
+def parse(name, text):
+    """
+      returns {metric name: float or text} of the contents of a metrics
+      file; a malformed file is reported and yields no metrics, since the
+      evaluation itself is still good
+    """
+    try:
+        return PARSERS[name](text)
+    except ValueError as e:
+        print("ignoring malformed {}: {}".format(name, e), file=sys.stderr)
+        return {}
+
+
+def read_metrics(output_path):
+    """
+      returns the metrics in the evaluator output directory output_path,
+      {} if it has no metrics file
+    """
+    for name in FILES:
+        path = osp.join(output_path, name)
+        if osp.isfile(path):
+            with open(path) as f:
+                return parse(name, f.read())
+    return {}
+
+
+def archived_metrics(identifier):
+    """
+      returns the metrics in the evaluation archive identifier, reading the
+      one file out of it through its member index
+    """
+    archive = utility.get_resource(identifier)
+    try:
+        names = set(e['name'] for e in members.matching(archive, 'metrics.*'))
+        for name in FILES:
+            if name in names:
+                return parse(name, b''.join(members.read_member(archive, name)))
+    except (ValueError, IOError) as e:
+        raise utility.FormattedError("Cannot read '{}': {}", identifier, e)
+    return {}
+
+
+#####################################
+##         SAVING
+#####################################
+
+def replace_metrics(run, metrics):
+    """
+      replaces the metrics of run, an entity of the caller's db_session
+    """
+    for m in list(run.metrics):
+        m.delete()
+    mod.pny.flush()
+    for name, value in sorted(metrics.items()):
+        number = isinstance(value, float)
+        mod.Metric(run=run, name=name,
+                   value=value if number else None,
+                   text=None if number else value)
+
+
+def shared_metrics(identifier):
+    """
+      returns the metrics of a run evaluated as identifier, {} if no such
+      run has any; a cached evaluation has the metrics of the run it was
+      first made for
+    """
+    for other in mod.pny.select(e.run for e in mod.Evaluation
+                                if e.id == identifier):
+        if other.metrics:
+            return dict((m.name, m.value if m.text is None else m.text)
+                        for m in other.metrics)
+    return {}
+
+
+#####################################
+##         EXPORT
+#####################################
+
+"""
+  every run of a challenge problem, its team and its metrics, one row per
+  metric; runs without metrics have one row of NULLs
+"""
+EXPORT = """
+SELECT r.id, r.dataset, r.duration, r.load_average, r.load_max,
+       r.ram_average, r.ram_max, t.description, m.name, m.value, m.text
+FROM Run r
+JOIN engine e ON e.id = r.engine
+JOIN team t ON t.id = e.team
+JOIN solution s ON s.id = r.configured_solution_solution
+LEFT JOIN metric m ON m.run = r.id
+WHERE s.challenge_problem_id = ?
+{filters}
+ORDER BY r.id, m.name
+"""
+
+COLUMNS = ['RUN_ID', 'DATASET', 'DURATION', 'LOAD_AVERAGE', 'LOAD_MAX',
+           'RAM_AVERAGE', 'RAM_MAX', 'TEAM']
+
+
+def export_rows(connection, challenge_problem, revision=None, team=None,
+                names=None):
+    """
+      returns the metric names and [(the COLUMNS of a run, {name: value})]
+      of the runs of challenge_problem, optionally only of revision (major),
+      of team (an id or a description), or of the metrics in names
+    """
+    filters, parameters = [], [challenge_problem]
+    if revision is not None:
+        filters.append("AND s.challenge_problem_revision_major = ?")
+        parameters.append(revision)
+    if team is not None:
+        filters.append("AND (t.id = ? OR t.description = ?)")
+        parameters.extend([team, team])
+    query = EXPORT.format(filters='\n'.join(filters))
+
+    runs, found = [], set()
+    for row in connection.execute(query, parameters):
+        if not runs or runs[-1][0][0] != row[0]:
+            runs.append((row[:8], {}))
+        name, value, text = row[8:]
+        if name is not None and (not names or name in names):
+            runs[-1][1][name] = value if text is None else text
+            found.add(name)
+    return names or sorted(found), runs
+
+
+def export_cli(arguments):
+    connection = store.connect()
+    try:
+        names, runs = export_rows(connection, arguments.challenge_problem,
+                                  arguments.revision, arguments.team,
+                                  arguments.name)
+    finally:
+        connection.close()
+
+    out = csv.writer(sys.stdout)
+    out.writerow(COLUMNS + names)
+    for columns, metrics in runs:
+        out.writerow(list(columns) + [metrics.get(n, '') for n in names])
+
+
+#####################################
+##         INGEST
+#####################################
+
+"""
+  evaluations of runs without metrics, by evaluation
+"""
+UNREAD = """
+SELECT v.id, v.run FROM evaluation v
+WHERE NOT EXISTS (SELECT 1 FROM metric m WHERE m.run = v.run)
+ORDER BY v.id, v.run
+"""
+
+
+@mod.pny.db_session
+def save_metrics(run_ids, metrics):
+    for run_id in run_ids:
+        replace_metrics(mod.Run[run_id], metrics)
+
+
+def ingest_cli(arguments):
+    """
+      reads the metrics of evaluations saved before their evaluator wrote a
+      metrics file, or before peval read them
+    """
+    connection = store.connect()
+    try:
+        rows = connection.execute(UNREAD).fetchall()
+    finally:
+        connection.close()
+
+    evaluations = {}
+    for identifier, run_id in rows:
+        evaluations.setdefault(identifier, []).append(run_id)
+
+    read = 0
+    for identifier, run_ids in sorted(evaluations.items()):
+        if not utility.has_resource(identifier):
+            utility.write("evaluation {} is not in the store".format(identifier))
+            continue
+        metrics = archived_metrics(identifier)
+        if metrics:
+            save_metrics(run_ids, metrics)
+            read += len(run_ids)
+    print("read metrics for {} of {} runs".format(read, len(rows)))
+
+
+#####################################
+##         PARSERS
+#####################################
+
+def export_subparser(subparsers):
+    parser = subparsers.add_parser('export')
+    parser.add_argument('challenge_problem', type=int,
+      help="challenge problem id")
+    parser.add_argument('--revision', type=int, default=None,
+      help="only runs of this major revision of the challenge problem")
+    parser.add_argument('--team', type=str, default=None,
+      help="only runs of this team, by id or description")
+    parser.add_argument('--name', type=str, action='append', default=None,
+      help="metric to export, may be repeated (default: all of them)")
+    parser.set_defaults(func=export_cli)
+
+
+def ingest_subparser(subparsers):
+    parser = subparsers.add_parser('ingest')
+    parser.set_defaults(func=ingest_cli)
+
+
+def generate_parser(parser):
+    subparsers = parser.add_subparsers(help="subcommand")
+
+    # initialize subparsers
+    export_subparser(subparsers)
+    ingest_subparser(subparsers)
+
+    return parser
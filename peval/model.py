@@ -31,6 +31,7 @@
 from datetime import datetime
 import pony.orm as pny
 import os.path as osp
+from . import series
 from . import utility
 
 import pkgutil
@@ -38,21 +39,227 @@ import pkgutil
 DB_LOC = utility.location_resource(fname='index.db')
 DBE = osp.exists(DB_LOC)
 
+"""
+  seconds a connection to index.db waits for another's write to finish
+  before failing with 'database is locked'; concurrent peval run and
+  run-batch processes all save their runs to it
+"""
+BUSY_TIMEOUT = 60
+
+"""
+  user_version of the database db_init.sql creates
+"""
+INITIAL_VERSION = 8
+
+def statements(script):
+    """
+      splits an sql script into its statements, so that they run one at a
+      time inside a transaction; sqlite3's executescript commits whatever
+      transaction is open before it starts
+    """
+    import sqlite3
+    statement = ''
+    for line in script.splitlines(True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ''
+    if statement.strip():
+        yield statement
+
+def apply_step(connection, target, script):
+    """
+      runs script and sets user_version to target as one transaction.
+      the version is read again after BEGIN IMMEDIATE takes the write lock,
+      so when several processes open a new or old index.db at once only the
+      first applies the step and the rest find it done
+    """
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        (version,) = connection.execute("PRAGMA user_version").fetchone()
+        if version < target:
+            for statement in statements(script):
+                connection.execute(statement)
+            connection.execute("PRAGMA user_version = %d" % target)
+        connection.execute("COMMIT")
+    except:
+        connection.execute("ROLLBACK")
+        raise
+
+def connect():
+    import sqlite3
+    # transactions are begun and ended by hand in apply_step
+    return sqlite3.connect(DB_LOC, timeout=BUSY_TIMEOUT, isolation_level=None)
+
 def initialize():
     global DBE
-    import sqlite3
-    connection = sqlite3.connect(DB_LOC)
-    cursor = connection.cursor()
-    cursor.executescript(pkgutil.get_data('peval', 'db_init.sql'))
-    connection.commit()
-    connection.close()
-    DBE = not DBE
-    del sqlite3
+    connection = connect()
+    try:
+        apply_step(connection, INITIAL_VERSION,
+          pkgutil.get_data('peval', 'db_init.sql'))
+    finally:
+        connection.close()
+    DBE = True
+
+"""
+  statements that bring index.db from user_version key - 1 up to key.
+  db_init.sql creates version 8; every later table and fix lives here, so
+  that new and old databases go through the same steps.
+"""
+UPGRADES = {
+  9: """
+    -- the resource time series of a run, see series.py
+    CREATE TABLE run_sample (
+      run INTEGER NOT NULL PRIMARY KEY REFERENCES Run (id) ON DELETE CASCADE,
+      count INTEGER NOT NULL,
+      series BLOB NOT NULL
+    );
+
+    -- save_run stored max as average and the other way round
+    UPDATE Run SET
+      load_average = load_max, load_max = load_average,
+      ram_average = ram_max, ram_max = ram_average;
+  """,
+
+  10: """
+    -- the counters of the cgroup a run was accounted in, see cgroup.py
+    CREATE TABLE run_cgroup (
+      run INTEGER NOT NULL PRIMARY KEY REFERENCES Run (id) ON DELETE CASCADE,
+      cpu_usec INTEGER NOT NULL,
+      user_usec INTEGER,
+      system_usec INTEGER,
+      memory_peak INTEGER,
+      io_read_bytes INTEGER,
+      io_write_bytes INTEGER
+    );
+  """,
+
+  11: """
+    -- the kernel's account of each phase of a run, from wait4
+    CREATE TABLE run_rusage (
+      run INTEGER NOT NULL REFERENCES Run (id) ON DELETE CASCADE,
+      phase TEXT NOT NULL,
+      wall_seconds REAL NOT NULL,
+      user_seconds REAL NOT NULL,
+      system_seconds REAL NOT NULL,
+      max_rss INTEGER NOT NULL,
+      major_faults INTEGER NOT NULL,
+      minor_faults INTEGER NOT NULL,
+      voluntary_switches INTEGER NOT NULL,
+      involuntary_switches INTEGER NOT NULL,
+      PRIMARY KEY (run, phase)
+    );
+  """,
+
+  12: """
+    -- the limits a run was held to, see limits.py, and which it hit
+    CREATE TABLE run_limit (
+      run INTEGER NOT NULL PRIMARY KEY REFERENCES Run (id) ON DELETE CASCADE,
+      memory INTEGER,
+      cpu_seconds REAL,
+      wall_seconds REAL,
+      file_size INTEGER,
+      output_size INTEGER
+    );
+
+    ALTER TABLE Run ADD COLUMN limit_hit TEXT;
+  """,
+
+  13: """
+    -- whether a configuration was run on a dataset, in one probe; see plan.py
+    CREATE INDEX idx_run__configured_solution_dataset ON Run (
+      configured_solution_id, configured_solution_solution, dataset);
+  """,
+
+  14: """
+    -- runs repeated to measure them, see stats.py
+    CREATE TABLE benchmark (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      engine TEXT NOT NULL REFERENCES engine (id) ON DELETE CASCADE,
+      configured_solution_id TEXT NOT NULL,
+      configured_solution_solution TEXT NOT NULL,
+      dataset TEXT NOT NULL REFERENCES dataset (in_digest) ON DELETE CASCADE,
+      warmup INTEGER NOT NULL,
+      repeats INTEGER NOT NULL,
+      ci_width REAL,
+      stopped_early BOOLEAN NOT NULL DEFAULT 0,
+
+      meta_created DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+      FOREIGN KEY (
+        configured_solution_id,
+        configured_solution_solution
+      ) REFERENCES configured_solution (
+        id, solution
+      ) ON DELETE CASCADE
+    );
+
+    ALTER TABLE Run ADD COLUMN benchmark INTEGER
+      REFERENCES benchmark (id) ON DELETE SET NULL;
+    CREATE INDEX idx_run__benchmark ON Run (benchmark);
+  """,
+
+  15: """
+    -- runs by output, to find cached evaluations; see evaluate.py
+    CREATE INDEX idx_run__output ON Run (output);
+  """,
+
+  16: """
+    -- the metrics evaluators report; see metrics.py
+    CREATE TABLE metric (
+      run INTEGER NOT NULL REFERENCES Run (id) ON DELETE CASCADE,
+      name TEXT NOT NULL,
+      value REAL,
+      text TEXT,
+      PRIMARY KEY (run, name)
+    );
+    CREATE INDEX idx_metric__name ON metric (name);
+  """,
+
+  17: """
+    -- the job queue; see jobqueue.py.  it may already have been made by
+    -- peval queue, and is made the same way in a queue outside index.db
+    CREATE TABLE IF NOT EXISTS job (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      command TEXT NOT NULL UNIQUE,
+      team INTEGER,
+      node TEXT,
+      priority INTEGER NOT NULL DEFAULT 0,
+      state TEXT NOT NULL DEFAULT 'pending',
+      attempts INTEGER NOT NULL DEFAULT 0,
+      worker TEXT,
+      lease_expires REAL,
+      rc INTEGER,
+      created REAL NOT NULL,
+      finished REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_job__state
+      ON job (state, priority, team, id);
+  """,
+}
+
+def upgrade():
+    connection = connect()
+    try:
+        # a database another process has only just created may still be
+        # empty, so the initial step is checked like the others
+        steps = [(INITIAL_VERSION, pkgutil.get_data('peval', 'db_init.sql'))]
+        steps.extend(sorted(UPGRADES.items()))
+        for target, script in steps:
+            (version,) = connection.execute(
+              "PRAGMA user_version").fetchone()
+            if version < target:
+                apply_step(connection, target, script)
+    finally:
+        connection.close()
 
 if not DBE:
     initialize()
+upgrade()
 
-db = pny.Database("sqlite", DB_LOC, create_db=False)
+# the timeout goes to sqlite3.connect; pony takes the write lock with
+# BEGIN IMMEDIATE, which then waits rather than failing at once
+db = pny.Database("sqlite", DB_LOC, create_db=False, timeout=BUSY_TIMEOUT)
 
 class Team(db.Entity):
     _table_ = "team"
@@ -77,6 +284,7 @@ class Engine(db.Entity):
     meta_updated = pny.Required(datetime, default=datetime.utcnow)
     solutions = pny.Set("Solution")
     runs = pny.Set("Run")
+    benchmarks = pny.Set("Benchmark")
 
     @property
     def digest(self):
@@ -94,6 +302,7 @@ class Dataset(db.Entity):
     meta_updated = pny.Required(datetime, default=datetime.utcnow)
     challenge_problems = pny.Set("ChallengeProblem")
     runs = pny.Set("Run")
+    benchmarks = pny.Set("Benchmark")
 
     @property
     def full_path(self):
@@ -178,6 +387,13 @@ class Run(db.Entity):
     ram_max = pny.Required(float)
 
     evaluation = pny.Optional("Evaluation")
+    samples = pny.Optional("RunSample")
+    cgroup = pny.Optional("RunCgroup")
+    rusage = pny.Set("RunRusage")
+    limits = pny.Optional("RunLimit")
+    limit_hit = pny.Optional(str, nullable=True)
+    benchmark = pny.Optional("Benchmark")
+    metrics = pny.Set("Metric")
 
     meta_created = pny.Required(datetime, default=datetime.utcnow)
     meta_updated = pny.Required(datetime, default=datetime.utcnow)
@@ -204,6 +420,76 @@ class Run(db.Entity):
     def cp_ids(self):
         return self.configured_solution.solution.challenge_problem.cp_ids
 
+class RunSample(db.Entity):
+    _table_ = "run_sample"
+    run = pny.PrimaryKey(Run)
+    count = pny.Required(int)
+    series = pny.Required(buffer)
+
+    @property
+    def samples(self):
+        return series.decode(self.series)
+
+
+class RunCgroup(db.Entity):
+    _table_ = "run_cgroup"
+    run = pny.PrimaryKey(Run)
+    cpu_usec = pny.Required(int, size=64)
+    user_usec = pny.Optional(int, size=64)
+    system_usec = pny.Optional(int, size=64)
+    memory_peak = pny.Optional(int, size=64)
+    io_read_bytes = pny.Optional(int, size=64)
+    io_write_bytes = pny.Optional(int, size=64)
+
+
+class RunRusage(db.Entity):
+    _table_ = "run_rusage"
+    run = pny.Required(Run)
+    phase = pny.Required(str)
+    wall_seconds = pny.Required(float)
+    user_seconds = pny.Required(float)
+    system_seconds = pny.Required(float)
+    max_rss = pny.Required(int, size=64)
+    major_faults = pny.Required(int, size=64)
+    minor_faults = pny.Required(int, size=64)
+    voluntary_switches = pny.Required(int, size=64)
+    involuntary_switches = pny.Required(int, size=64)
+    pny.PrimaryKey(run, phase)
+
+
+class RunLimit(db.Entity):
+    _table_ = "run_limit"
+    run = pny.PrimaryKey(Run)
+    memory = pny.Optional(int, size=64)
+    cpu_seconds = pny.Optional(float)
+    wall_seconds = pny.Optional(float)
+    file_size = pny.Optional(int, size=64)
+    output_size = pny.Optional(int, size=64)
+
+
+class Metric(db.Entity):
+    _table_ = "metric"
+    run = pny.Required(Run)
+    name = pny.Required(str)
+    value = pny.Optional(float)
+    text = pny.Optional(str, nullable=True)
+    pny.PrimaryKey(run, name)
+
+
+class Benchmark(db.Entity):
+    _table_ = "benchmark"
+    id = pny.PrimaryKey(int, auto=True)
+    engine = pny.Required(Engine)
+    configured_solution = pny.Required("ConfiguredSolution")
+    dataset = pny.Required(Dataset)
+    warmup = pny.Required(int)
+    repeats = pny.Required(int)
+    ci_width = pny.Optional(float)
+    stopped_early = pny.Required(bool, default=False)
+    meta_created = pny.Required(datetime, default=datetime.utcnow)
+    runs = pny.Set(Run)
+
+
 class Evaluation(db.Entity):
     _table_ = "evaluation"
     id = pny.Required(str)
@@ -230,6 +516,7 @@ class ConfiguredSolution(db.Entity):
     filename = pny.Required(str)
     solution = pny.Required(Solution)
     runs = pny.Set(Run)
+    benchmarks = pny.Set(Benchmark)
     pny.PrimaryKey(id, solution)
     meta_created = pny.Required(datetime, default=datetime.utcnow)
     meta_updated = pny.Required(datetime, default=datetime.utcnow)
@@ -40,6 +40,13 @@ from . import register
 from . import run
 from . import utility
 from . import inspect
+from . import store
+from . import garbage
+from . import report
+from . import batch
+from . import jobqueue
+from . import plan
+from . import metrics
 
 
 def register_parser(subparsers):
@@ -66,6 +73,54 @@ def inspect_parser(subparsers):
     return parser
 
 
+def store_parser(subparsers):
+    parser = subparsers.add_parser('store')
+    store.generate_parser(parser)
+    return parser
+
+
+def gc_parser(subparsers):
+    parser = subparsers.add_parser('gc')
+    garbage.generate_parser(parser)
+    return parser
+
+
+def report_parser(subparsers):
+    parser = subparsers.add_parser('report')
+    report.generate_parser(parser)
+    return parser
+
+
+def batch_parser(subparsers):
+    parser = subparsers.add_parser('run-batch')
+    batch.generate_parser(parser)
+    return parser
+
+
+def queue_parser(subparsers):
+    parser = subparsers.add_parser('queue')
+    jobqueue.generate_parser(parser)
+    return parser
+
+
+def worker_parser(subparsers):
+    parser = subparsers.add_parser('worker')
+    jobqueue.generate_worker_parser(parser)
+    return parser
+
+
+def plan_parser(subparsers):
+    parser = subparsers.add_parser('plan')
+    plan.generate_parser(parser)
+    return parser
+
+
+def metrics_parser(subparsers):
+    parser = subparsers.add_parser('metrics')
+    metrics.generate_parser(parser)
+    return parser
+
+
 def generate_parser(parser):
     subparsers = parser.add_subparsers(help="subcommand")
 
@@ -73,6 +128,14 @@ def generate_parser(parser):
     run_parser(subparsers)
     evaluate_parser(subparsers)
     inspect_parser(subparsers)
+    store_parser(subparsers)
+    gc_parser(subparsers)
+    report_parser(subparsers)
+    batch_parser(subparsers)
+    queue_parser(subparsers)
+    worker_parser(subparsers)
+    plan_parser(subparsers)
+    metrics_parser(subparsers)
     return parser
 
 
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# plan.py -- runs not yet made                    -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    The runs not yet made.
+
+    Every configured solution is to be run on every dataset of its
+    challenge problem.  The pending ones are found in one query that joins
+    the configurations to the datasets of their challenge problems and
+    drops each pair that has a Run with a NOT EXISTS probe of the index on
+    Run (configured_solution_id, configured_solution_solution, dataset).
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import json
+
+from . import jobqueue
+from . import store
+from . import utility
+
+
+PENDING = """
+SELECT s.engine, s.id, c.id, cd.dataset, e.team, s.challenge_problem_id,
+       s.challenge_problem_revision_major, c.filename
+FROM configured_solution c
+JOIN solution s ON s.id = c.solution
+JOIN engine e ON e.id = s.engine
+JOIN ChallengeProblem_Dataset cd
+  ON cd.challengeproblem_id = s.challenge_problem_id
+ AND cd.challengeproblem_revision_major = s.challenge_problem_revision_major
+ AND cd.challengeproblem_revision_minor = s.challenge_problem_revision_minor
+WHERE NOT EXISTS (
+  SELECT 1 FROM Run r
+  WHERE r.configured_solution_id = c.id
+    AND r.configured_solution_solution = c.solution
+    AND r.dataset = cd.dataset)
+{filters}
+ORDER BY c.meta_updated, c.id, cd.dataset
+"""
+
+FIELDS = ['engine', 'solution', 'config', 'dataset', 'team',
+          'challenge_problem', 'revision', 'filename']
+
+
+def pending_runs(connection, team=None, challenge_problem=None):
+    """
+      returns a dict of FIELDS for every run not yet made, optionally only
+      of team (an id or a description) or challenge_problem (an id)
+    """
+    filters, parameters = [], []
+    if team is not None:
+        filters.append("AND e.team IN "
+                       "(SELECT id FROM team WHERE id = ? OR description = ?)")
+        parameters.extend([team, team])
+    if challenge_problem is not None:
+        filters.append("AND s.challenge_problem_id = ?")
+        parameters.append(challenge_problem)
+    query = PENDING.format(filters='\n'.join(filters))
+    return [dict(zip(FIELDS, row))
+            for row in connection.execute(query, parameters)]
+
+
+def plan_cli(arguments):
+    connection = store.connect()
+    try:
+        runs = pending_runs(connection, arguments.team,
+                            arguments.challenge_problem)
+    finally:
+        connection.close()
+
+    if arguments.enqueue:
+        queue = jobqueue.JobQueue()
+        try:
+            added = sum(queue.add(['run'] + [str(r[f]) for f in FIELDS[:4]],
+                                  r['team'],
+                                  jobqueue.run_node(arguments.any_node),
+                                  arguments.priority)
+                        for r in runs)
+        finally:
+            queue.close()
+        print("queued {} runs, {} already were".format(
+          added, len(runs) - added))
+        return
+
+    for r in runs:
+        if arguments.json:
+            print(json.dumps(r, sort_keys=True))
+        else:
+            print("peval run {engine} {solution} {config} {dataset}".format(**r))
+    utility.write("{} runs pending".format(len(runs)))
+
+
+def generate_parser(parser):
+    parser.add_argument('--team', type=str, default=None,
+      help="only runs of this team, by id or description")
+
+    parser.add_argument('--cp', dest='challenge_problem', type=int,
+      default=None, help="only runs of this challenge problem")
+
+    parser.add_argument('--json', action='store_true', default=False,
+      help="print one JSON object per run instead of 'peval run' lines")
+
+    parser.add_argument('--enqueue', action='store_true', default=False,
+      help="queue the runs for peval worker instead of printing them")
+
+    parser.add_argument('--priority', type=int, default=0,
+      help="priority of queued runs")
+
+    parser.add_argument('--any-node', action='store_true', default=False,
+      help="let workers on every node make the queued runs, for nodes that "
+           "share index.db and the store; by default only this node's do")
+
+    parser.set_defaults(func=plan_cli)
+    return parser
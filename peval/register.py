@@ -46,6 +46,13 @@ def solve_cp_id(cp_id):
     ret = map(int, utility.safesplit(cp_id, '-')) + [ 0, 0, 0 ]
     return ret[:3]
 
+
+def report_dedup(identifier):
+    report = utility.dedup_report()
+    if report:
+        sys.stderr.write(report + "\n")
+    return identifier
+
 """
   I think that i need to modify the inputs to the below functions, but i am
   unsure to the most appropriate way.
@@ -58,16 +65,17 @@ def register_engine_cli(arguments):
     eng_team_id = arguments.eng_team_id
     full_path = utility.resolve_path(arguments.eng_path)
 
-    return register_engine(eng_team_id, full_path)
+    return report_dedup(
+      register_engine(eng_team_id, full_path, arguments.verify))
 
 
-def register_engine(eng_team_id, full_path):
-    with utility.TemporaryDirectory() as tmpdir:
-        engine_hash, hash_path = utility.prepare_resource(full_path, tmpdir)
-        if mod.DBE:
-            register_engine_db(eng_team_id, engine_hash, full_path)
+def register_engine(eng_team_id, full_path, verify=False):
+    engine_hash, hash_path = utility.prepare_resource(full_path,
+      kind='engine', verify=verify, memoize=True)
+    if mod.DBE:
+        register_engine_db(eng_team_id, engine_hash, full_path)
 
-        utility.commit_resource(hash_path)
+    utility.commit_resource(hash_path)
 
     return engine_hash
 
@@ -99,6 +107,9 @@ def engine_subparser(subparsers):
     parser.add_argument('eng_path', type=str,
       help="path to engine")
 
+    parser.add_argument('--verify', action='store_true', default=False,
+      help="rehash every file instead of trusting the digest memo")
+
     parser.set_defaults(func=register_engine_cli)
 
 
@@ -111,22 +122,25 @@ def register_dataset_cli(arguments):
     rel_in   = utility.resolve_path(arguments.in_path)
     rel_eval = utility.resolve_path(arguments.eval_path)
 
-    return register_dataset(major, minor, revision, rel_in, rel_eval)
-
-def register_dataset(major, minor, revision, rel_in, rel_eval):
-    with utility.TemporaryDirectory() as tmpdir:
-        in_hash, in_hash_path = utility.prepare_resource(rel_in, tmpdir)
-        # XXX PMR we will need to store these differently
-        eval_hash, eval_hash_path = utility.prepare_resource(rel_eval, tmpdir)
-
-        if mod.DBE:
-            register_dataset_db(
-                major, minor, revision,
-                in_hash, eval_hash, rel_in, rel_eval
-            )
+    return report_dedup(
+      register_dataset(major, minor, revision, rel_in, rel_eval,
+        arguments.verify))
+
+def register_dataset(major, minor, revision, rel_in, rel_eval, verify=False):
+    in_hash, in_hash_path = utility.prepare_resource(rel_in,
+      kind='dataset', verify=verify, memoize=True)
+    # XXX PMR we will need to store these differently
+    eval_hash, eval_hash_path = utility.prepare_resource(rel_eval,
+      kind='dataset', verify=verify, memoize=True)
+
+    if mod.DBE:
+        register_dataset_db(
+            major, minor, revision,
+            in_hash, eval_hash, rel_in, rel_eval
+        )
 
-        utility.commit_resource(in_hash_path)
-        utility.commit_resource(eval_hash_path)
+    utility.commit_resource(in_hash_path)
+    utility.commit_resource(eval_hash_path)
 
     return in_hash
 
@@ -172,6 +186,9 @@ def dataset_subparser(subparsers):
     parser.add_argument('eval_path', type=str,
       help="path to evaluation artifact")
 
+    parser.add_argument('--verify', action='store_true', default=False,
+      help="rehash every file instead of trusting the digest memo")
+
     parser.set_defaults(func=register_dataset_cli)
 
 
@@ -194,27 +211,29 @@ def register_solution_cli(arguments):
         return osp.abspath(c)
     configs = [validate_config(c) for c in arguments.configs]
 
-    return register_solution(engine_hash, full_path, major,
-      minor, revision, configs)
+    return report_dedup(
+      register_solution(engine_hash, full_path, major,
+        minor, revision, configs, arguments.verify))
 
 
-def register_solution(engine_hash, full_path, major, minor, revision, configs):
-    with utility.TemporaryDirectory() as tmpdir:
-        solution_hash, solution_hash_path = \
-          utility.prepare_resource(full_path, tmpdir)
+def register_solution(engine_hash, full_path, major, minor, revision, configs,
+                      verify=False):
+    solution_hash, solution_hash_path = \
+      utility.prepare_resource(full_path, kind='solution',
+        verify=verify, memoize=True)
 
-        if mod.DBE:
-            register_solution_db(
-                engine_hash, major,
-                minor, revision,
-                solution_hash, configs
-            )
+    if mod.DBE:
+        register_solution_db(
+            engine_hash, major,
+            minor, revision,
+            solution_hash, configs
+        )
 
-        utility.commit_resource(solution_hash_path)
+    utility.commit_resource(solution_hash_path)
 
-        for config in configs:
-            config = utility.resolve_path(config, True)
-            register_configuration(solution_hash, config)
+    for config in configs:
+        config = utility.resolve_path(config, True)
+        register_configuration(solution_hash, config, verify)
 
     return solution_hash
 
@@ -263,6 +282,9 @@ def solution_subparser(subparsers):
     parser.add_argument('configs', type=str, nargs='+',
       help="list of individual configuration files (not a directory containing configuration files) usable by solution.")
 
+    parser.add_argument('--verify', action='store_true', default=False,
+      help="rehash every file instead of trusting the digest memo")
+
     parser.set_defaults(func=register_solution_cli)
 
 
@@ -276,26 +298,27 @@ def register_configuration_cli(arguments):
 
     full_path = utility.resolve_path(arguments.config_path, True)
 
-    return register_configuration(solution_hash, full_path)
+    return report_dedup(
+      register_configuration(solution_hash, full_path, arguments.verify))
 
 
-def register_configuration(solution_hash, full_path):
+def register_configuration(solution_hash, full_path, verify=False):
     # just in case basename is a symlink, we don't want to confuse the user
     #   by changing the expected name to the realpath's basename
     basename = osp.basename(full_path)
 
-    with utility.TemporaryDirectory() as tmpdir:
-        configuration_hash, configuration_hash_path = \
-          utility.prepare_resource(full_path, tmpdir, True)
+    configuration_hash, configuration_hash_path = \
+      utility.prepare_resource(full_path, allow_symbol=True,
+        kind='configuration', verify=verify, memoize=True)
 
-        if mod.DBE:
-            register_configuration_db(
-                solution_hash,
-                configuration_hash,
-                basename
-            )
+    if mod.DBE:
+        register_configuration_db(
+            solution_hash,
+            configuration_hash,
+            basename
+        )
 
-        utility.commit_resource(configuration_hash_path)
+    utility.commit_resource(configuration_hash_path)
 
     return configuration_hash
 
@@ -320,6 +343,9 @@ def configuration_subparser(subparsers):
     parser.add_argument('config_path', type=str,
       help="path to configuration artifact")
 
+    parser.add_argument('--verify', action='store_true', default=False,
+      help="rehash every file instead of trusting the digest memo")
+
     parser.set_defaults(func=register_configuration_cli)
 
 
@@ -336,6 +362,9 @@ def evaluator_subparser(subparsers):
     parser.add_argument('evaluator_path', type=str,
       help="full path to evaluator")
 
+    parser.add_argument('--verify', action='store_true', default=False,
+      help="rehash every file instead of trusting the digest memo")
+
     parser.set_defaults(func=register_evaluator_cli)
 
 
@@ -344,19 +373,21 @@ def register_evaluator_cli(arguments):
     [major, minor, revision] = solve_cp_id(arguments.cp_id)
     full_path = utility.resolve_path(arguments.evaluator_path)
 
-    return register_evaluator(full_path, major, minor, revision)
+    return report_dedup(
+      register_evaluator(full_path, major, minor, revision,
+        arguments.verify))
 
 
-def register_evaluator(full_path, major, minor, revision):
+def register_evaluator(full_path, major, minor, revision, verify=False):
 
-    with utility.TemporaryDirectory() as tmpdir:
-        evaluator_hash, evaluator_hash_path = \
-          utility.prepare_resource(full_path,tmpdir)
+    evaluator_hash, evaluator_hash_path = \
+      utility.prepare_resource(full_path, kind='evaluator',
+        verify=verify, memoize=True)
 
-        if mod.DBE:
-            register_evaluator_db(major, minor, revision, evaluator_hash)
+    if mod.DBE:
+        register_evaluator_db(major, minor, revision, evaluator_hash)
 
-        utility.commit_resource(evaluator_hash_path)
+    utility.commit_resource(evaluator_hash_path)
 
     return evaluator_hash
 
@@ -0,0 +1,271 @@
+#!/usr/bin/python
+# report.py -- resource usage of runs             -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Report the resource usage of runs."""
+
+from __future__ import (absolute_import, division, print_function)
+
+from . import model as mod
+from . import series
+from . import stats
+from . import utility
+
+
+MB = 1024.0 # KiB -> MiB
+
+"""
+  (column, label, scale) of the percentile table
+"""
+ROWS = [
+    ('load', 'load (cores)', 1),
+    ('rss', 'rss (MiB)', 1 / MB),
+    ('vms', 'vms (MiB)', 1 / MB),
+    ('threads', 'threads', 1),
+]
+
+FRACTIONS = [0.5, 0.95, 0.99, 1.0]
+
+"""
+  (column, label, scale) of the counters of runs accounted in a cgroup
+"""
+CGROUP_ROWS = [
+    ('cpu_usec', 'cpu seconds', 1e-6),
+    ('user_usec', 'user seconds', 1e-6),
+    ('system_usec', 'system seconds', 1e-6),
+    ('memory_peak', 'peak (MiB)', 1 / (MB * MB)),
+    ('io_read_bytes', 'read (MiB)', 1 / (MB * MB)),
+    ('io_write_bytes', 'written (MiB)', 1 / (MB * MB)),
+]
+
+
+"""
+  (column, label) of the kernel's account of each phase
+"""
+RUSAGE_ROWS = [
+    ('wall_seconds', 'wall seconds'),
+    ('user_seconds', 'user seconds'),
+    ('system_seconds', 'system seconds'),
+    ('max_rss', 'max rss (KiB)'),
+    ('major_faults', 'major faults'),
+    ('minor_faults', 'minor faults'),
+    ('voluntary_switches', 'voluntary cs'),
+    ('involuntary_switches', 'involuntary cs'),
+]
+
+PHASES = ['pre_process', 'run', 'post_process']
+
+"""
+  (name, label, scale) of what is summarized over the runs of a benchmark
+"""
+BENCHMARK_ROWS = [
+    ('duration', 'duration (s)', 1),
+    ('cpu', 'cpu seconds', 1),
+    ('max_rss', 'max rss (MiB)', 1 / MB),
+]
+
+"""
+  (column, label, scale) of the limits a run was held to
+"""
+LIMIT_ROWS = [
+    ('memory', 'memory (MiB)', 1 / (MB * MB)),
+    ('cpu_seconds', 'cpu seconds', 1),
+    ('wall_seconds', 'wall seconds', 1),
+    ('file_size', 'file (MiB)', 1 / (MB * MB)),
+    ('output_size', 'output (MiB)', 1 / (MB * MB)),
+]
+
+
+@mod.pny.db_session
+def run_usage(run_id):
+    """
+      returns the samples of a run, [] if it exited before the first one
+      was taken, its cgroup counters if it has them,
+      {phase: {column: value}} of its rusage, and its limits and the one it
+      hit if it was held to any
+    """
+    r = mod.Run.get(id=run_id)
+    if not r:
+        raise utility.FormattedError("run_id {} not valid", run_id)
+    exact = None
+    if r.cgroup:
+        exact = dict((column, getattr(r.cgroup, column))
+                     for column, label, scale in CGROUP_ROWS)
+    phases = dict((u.phase, dict((column, getattr(u, column))
+                                 for column, label in RUSAGE_ROWS))
+                  for u in r.rusage)
+    held = None
+    if r.limits:
+        held = dict((column, getattr(r.limits, column))
+                    for column, label, scale in LIMIT_ROWS)
+        held['hit'] = r.limit_hit
+    samples = r.samples.samples if r.samples else []
+    return samples, exact, phases, held
+
+
+@mod.pny.db_session
+def benchmark_runs(benchmark_id):
+    """
+      returns a description of a benchmark and [(run id, {name: value})]
+      of its runs, in order; cpu and max_rss come from the rusage of
+      run.sh
+    """
+    b = mod.Benchmark.get(id=benchmark_id)
+    if not b:
+        raise utility.FormattedError("benchmark {} not valid", benchmark_id)
+    description = "benchmark {}: {} warm-up, {} of {} runs{}".format(
+      b.id, b.warmup, b.runs.count(), b.repeats,
+      ", stopped early" if b.stopped_early else "")
+
+    runs = []
+    for r in b.runs.order_by(mod.Run.id):
+        values = dict(duration=r.duration, cpu=None, max_rss=None)
+        usage = mod.RunRusage.get(run=r, phase='run')
+        if usage:
+            values['cpu'] = usage.user_seconds + usage.system_seconds
+            values['max_rss'] = usage.max_rss
+        runs.append((r.id, values))
+    return description, runs
+
+
+def print_benchmark(benchmark_id):
+    description, runs = benchmark_runs(benchmark_id)
+    print(description)
+    print("{:<14} {:>10} {:>10} {:>10} {:>10}  {}".format(
+      "", "median", "mad", "ci low", "ci high", "outliers (run)"))
+    for name, label, scale in BENCHMARK_ROWS:
+        measured = [(i, v[name]) for i, v in runs if v[name] is not None]
+        if not measured:
+            continue
+        s = stats.summarize([value * scale for i, value in measured])
+        print("{:<14} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}  {}".format(
+          label, s.median, s.mad, s.low, s.high,
+          " ".join(str(measured[k][0]) for k in s.outliers)))
+
+
+def print_summary(run_id, samples):
+    if not samples:
+        print("run {}: no samples, it exited before the first was taken"
+              .format(run_id))
+        return
+    start = samples[0].time
+    print("run {}: {} samples over {:.1f} s".format(
+      run_id, len(samples), samples[-1].time - start))
+
+    print("{:<14} {:>10} {:>10} {:>10} {:>10}".format(
+      "", "p50", "p95", "p99", "max"))
+    for column, label, scale in ROWS:
+        values = [series.percentile(samples, column, f) * scale
+                  for f in FRACTIONS]
+        print("{:<14} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+          label, *values))
+
+    print("cpu seconds    {:>10.2f}".format(series.cpu_seconds(samples)))
+    print("read (MiB)     {:>10.2f}".format(
+      samples[-1].read_bytes / (MB * MB)))
+    print("written (MiB)  {:>10.2f}".format(
+      samples[-1].write_bytes / (MB * MB)))
+
+    top = series.peak(samples, 'rss')
+    print("rss peaked at {:.1f} s with {:.1f} MiB".format(
+      top.time - start, top.rss / MB))
+
+
+def print_exact(exact):
+    print()
+    print("measured by cgroup")
+    for column, label, scale in CGROUP_ROWS:
+        if exact[column] is not None:
+            print("{:<14} {:>10.2f}".format(label, exact[column] * scale))
+
+
+def print_rusage(phases):
+    names = [p for p in PHASES if p in phases]
+    print()
+    print("{:<16}".format("measured by wait4") +
+          "".join("{:>14}".format(p) for p in names))
+    for column, label in RUSAGE_ROWS:
+        print("{:<16}".format(label) +
+              "".join("{:>14}".format(
+                "{:.2f}".format(phases[p][column])
+                if isinstance(phases[p][column], float)
+                else phases[p][column]) for p in names))
+
+
+def print_limits(held):
+    print()
+    print("held to limits, stopped at {}".format(held['hit'])
+          if held['hit'] else "held to limits, none hit")
+    for column, label, scale in LIMIT_ROWS:
+        if held[column] is not None:
+            print("{:<14} {:>10.2f}".format(label, held[column] * scale))
+
+
+def print_samples(samples):
+    """
+      the whole series as CSV, time in seconds since the first sample
+    """
+    start = samples[0].time
+    print(",".join(series.Sample._fields))
+    for s in samples:
+        print(",".join(str(v) for v in (round(s.time - start, 3),) + s[1:]))
+
+
+def report_cli(arguments):
+    if arguments.benchmark:
+        print_benchmark(arguments.run_id)
+        return
+    samples, exact, phases, held = run_usage(arguments.run_id)
+    if arguments.samples:
+        if not samples:
+            raise utility.FormattedError(
+              "run {} was recorded without a time series", arguments.run_id)
+        print_samples(samples)
+        return
+    print_summary(arguments.run_id, samples)
+    if exact:
+        print_exact(exact)
+    if phases:
+        print_rusage(phases)
+    if held:
+        print_limits(held)
+
+
+def generate_parser(parser):
+    parser.add_argument('run_id', type=int,
+      help="this is the run_id as listed in the database")
+
+    parser.add_argument('--samples', action='store_true', default=False,
+      help="print every sample as CSV instead of a summary")
+
+    parser.add_argument('--benchmark', action='store_true', default=False,
+      help="run_id is the id of a benchmark made by peval run --repeat; "
+           "summarize its runs")
+
+    parser.set_defaults(func=report_cli)
+    return parser
@@ -35,7 +35,15 @@ import sys
 from . import model as mod
 import os.path as osp
 import os, psutil, subprocess
+import shutil
 import time
+from . import batch
+from . import cgroup
+from . import limits
+from . import report
+from . import sampler
+from . import series
+from . import stats
 from . import utility
 from datetime import datetime
 
@@ -54,6 +62,16 @@ def run_solution_cli(arguments):
 
     p_flag = arguments.persist
 
+    run_limits = solution_limits(solution_id).update(
+      limits.Limits.parse(dict((field, getattr(arguments, field))
+                               for field in limits.FIELDS)))
+    status = None
+
+    benchmarking = arguments.repeat > 1 or arguments.warmup > 0
+    if arguments.repeat < 1 or arguments.warmup < 0:
+        raise utility.FormattedError(
+          "--repeat must be at least 1 and --warmup at least 0")
+
     with utility.TemporaryDirectory(persist=p_flag) as sandbox:
         engroot, solpath, configpaths, datapath, outpath, logpath =\
           hash_to_paths(
@@ -64,35 +82,129 @@ def run_solution_cli(arguments):
         for config_id in configpaths:
             configpath = config_id if osp.abspath(config_id) \
                                    else osp.join(solpath, config_id)
+            config_label = osp.basename(config_id)
 
-            rc, ram, load, time =\
-              run_solution(
+            run_once = lambda: run_solution(
                 engroot, solpath,
                 configpath,
-                datapath, outpath, logpath)
+                datapath, outpath, logpath, arguments.cgroup, run_limits)
+
+            if not benchmarking:
+                run_id, hit = keep_run(
+                  arguments, config_label, outpath, logpath, run_once())
+                if hit:
+                    status = 1
+                continue
+
+            benchmark_id = new_benchmark(
+              engine_id, solution_id, config_label, dataset_id,
+              arguments.warmup, arguments.repeat, arguments.ci_width)
+
+            for i in range(arguments.warmup):
+                # warms caches up; neither saved nor measured
+                clear_outputs(outpath, logpath)
+                rc = run_once()[0]
+                if rc != 0:
+                    raise utility.FormattedError(
+                      "warm-up run exited with code {}", rc)
+
+            durations, early = [], False
+            for i in range(arguments.repeat):
+                clear_outputs(outpath, logpath)
+                result = run_once()
+                run_id, hit = keep_run(
+                  arguments, config_label, outpath, logpath, result,
+                  benchmark_id)
+                if hit:
+                    # later repetitions would only hit it again
+                    status = 1
+                    break
+                start_t, end_t = result[3]
+                durations.append(end_t - start_t)
+                if arguments.ci_width and i + 1 < arguments.repeat and \
+                   stats.converged(durations, arguments.ci_width):
+                    early = True
+                    break
+
+            finish_benchmark(benchmark_id, early)
+            report.print_benchmark(benchmark_id)
+
+    return status
+
+
+def keep_run(arguments, config_label, outpath, logpath, result,
+             benchmark_id=None):
+    """
+      saves the run result of run_solution made and commits its output
+      returns (run id, the limit it hit or None)
+    """
+    rc, ram, load, time, measures = result
+
+    # a run stopped at a limit is kept, so that runs can be
+    # compared within a budget
+    hit = measures['limit_hit']
+    if hit:
+        sys.stderr.write(
+          "run.sh was stopped at its {} limit\n".format(hit))
+    elif rc != 0:
+        utility.failed_exec()
+        raise utility.FormattedError("solution execution exited with code %d" % rc)
+
+    if osp.exists(logpath):
+        log_hash, log_hash_path = \
+          utility.prepare_resource(logpath, kind='log')
+    else:
+        log_hash, log_hash_path = None, None
+
+    out_hash, out_hash_path = \
+      utility.prepare_resource(outpath, kind='output')
+
+    run_id = save_run( # XXX PMR :: config_id use likely to change
+      arguments.engine, arguments.solution, config_label, arguments.dataset,
+      out_hash, log_hash, time, load, ram, measures, benchmark_id
+    )
+
+    if arguments.journal:
+        batch.record(arguments.journal, 'saved', run_id=run_id,
+          engine=arguments.engine, solution=arguments.solution,
+          config=arguments.config, dataset=arguments.dataset)
 
-            if rc != 0:
-                utility.failed_exec()
-                raise utility.FormattedError("solution execution exited with code %d" % rc)
+    if log_hash:
+        utility.commit_resource(log_hash_path)
 
-            if osp.exists(logpath):
-                log_hash, log_hash_path = \
-                  utility.prepare_resource(logpath, sandbox)
-            else:
-                log_hash, log_hash_path = None, None
+    utility.commit_resource(out_hash_path)
+    return run_id, hit
 
-            out_hash, out_hash_path = \
-              utility.prepare_resource(outpath, sandbox)
 
-            save_run( # XXX PMR :: config_id use likely to change
-              engine_id, solution_id, osp.basename(config_id), dataset_id,
-              out_hash, log_hash, time, load, ram
-            )
+def clear_outputs(outpath, logpath):
+    """
+      removes what an earlier repetition left in outpath and logpath
+    """
+    for path in (outpath, logpath):
+        if osp.isdir(path):
+            shutil.rmtree(path)
+        elif osp.exists(path):
+            os.unlink(path)
 
-            if log_hash:
-                utility.commit_resource(log_hash_path)
 
-            utility.commit_resource(out_hash_path)
+@mod.pny.db_session
+def new_benchmark(engine_id, solution_id, config_label, dataset_id,
+                  warmup, repeats, ci_width):
+    s = mod.Solution.get(id=solution_id)
+    b = mod.Benchmark(
+      engine = mod.Engine.get(id=engine_id),
+      configured_solution = mod.ConfiguredSolution.get(
+        solution = s, filename = config_label),
+      dataset = mod.Dataset.get(in_digest=dataset_id),
+      warmup = warmup, repeats = repeats, ci_width = ci_width
+    )
+    mod.pny.flush()
+    return b.id
+
+
+@mod.pny.db_session
+def finish_benchmark(benchmark_id, stopped_early):
+    mod.Benchmark[benchmark_id].stopped_early = stopped_early
 
 
 def hash_to_paths(dest, engine_hash, solution_hash, config_hash, dataset_hash):
@@ -122,35 +234,72 @@ def hash_to_paths(dest, engine_hash, solution_hash, config_hash, dataset_hash):
     return eng_path, sol_path, config_paths, inp_path, out_path, log_file
 
 
-"""
-  process helpers, likely to be moved to a different file
-"""
-def sum_for_process_children(function, proc):
-    return function(proc) + \
-      sum(function(child) for child in proc.children(recursive=True))
+def new_sampler(proc, leaf=None):
+    """
+      a Sampler of proc, ticking as set in [sampler] of peval.conf
+    """
+    interval = float(utility.store_setting(
+      'sampler', 'interval', sampler.INTERVAL))
+    max_interval = float(utility.store_setting(
+      'sampler', 'max_interval', sampler.MAX_INTERVAL))
+    return sampler.Sampler(proc, interval, max_interval, leaf=leaf)
+
+
+def new_leaf():
+    """
+      a cgroup.Leaf for run.sh, or None when cgroups cannot be used here
+    """
+    try:
+        return cgroup.Leaf.create()
+    except cgroup.Unavailable as e:
+        utility.write("no cgroup accounting, sampling instead: " + str(e))
+        return None
+
+
+def read_limits(section):
+    return limits.Limits.parse(dict(
+      (field, utility.store_setting(section, field))
+      for field in limits.FIELDS))
 
-def sample_ram(proc):
-    def get_ram_usage(process):
-        return process.memory_info().vms >> 10 # bytes -> KiB
-    return sum_for_process_children(get_ram_usage, proc)
 
-def sample_load(proc):
-    def get_cpu_usage(process):
-        return 0.01 * psutil.Process.cpu_percent(process)
-    return sum_for_process_children(get_cpu_usage, proc)
-"""
-  end process helpers
-"""
+@mod.pny.db_session
+def solution_limits(solution_id):
+    """
+      the limits set in [limits] of peval.conf, overridden by those set in
+      [limits_cp<N>] for the challenge problem N of the solution
+    """
+    solution = mod.Solution.get(id=solution_id)
+    if not solution:
+        raise utility.FormattedError("solution {} not valid", solution_id)
+    cp = solution.challenge_problem
+    return read_limits('limits').update(read_limits('limits_cp%d' % cp.id))
 
 
-def run_solution(engroot, solpath, configpath, datasetpath, outputdir, logfile):
+def run_solution(engroot, solpath, configpath, datasetpath, outputdir, logfile,
+                 use_cgroup=False, run_limits=None):
     """
       all input parameters must be valid paths
+      use_cgroup runs run.sh in a cgroup of its own (see cgroup.py)
+      run_limits holds run.sh to limits.Limits (see limits.py)
+
+      besides the summaries kept in Run, returns measures:
+        samples :: the time series of run.sh (see sampler.py)
+        cgroup  :: the counters of its cgroup, None without use_cgroup
+        rusage  :: {phase: the kernel's rusage} for pre_process, run and
+                   post_process (see utility.process_watch)
+        limits    :: run_limits, None without any
+        limit_hit :: the limit run.sh was stopped at, None if it was not
     """
+    run_limits = run_limits or limits.NONE
+    measures = dict(samples=[], cgroup=None,
+                    rusage=dict(pre_process={}, run={}, post_process={}),
+                    limits=run_limits or None, limit_hit=None)
+    grace = float(utility.store_setting('limits', 'grace', limits.GRACE))
 
     utility.write("attempt pre_process.sh")
     for _, rc_pre, _, _ in utility.process_watch(
-      solpath, ['pre_process.sh', configpath, datasetpath, outputdir, logfile], ENGROOT=engroot
+      solpath, ['pre_process.sh', configpath, datasetpath, outputdir, logfile],
+      timeout=None, rusage=measures['rusage']['pre_process'], ENGROOT=engroot
     ):
         pass
 
@@ -158,39 +307,66 @@ def run_solution(engroot, solpath, configpath, datasetpath, outputdir, logfile):
         # XXX PMR :: This perhaps should be returning the error code
         raise utility.FormattedError("pre_process.sh returned exit code %d.", rc_pre)
 
-    ram_samples = []
-    load_samples = []
-
     utility.write("attempting run.sh")
-    for proc_entry , rc_run, start_t, end_t in utility.process_watch(
-      solpath, ['run.sh', configpath, datasetpath, outputdir, logfile],
-      ENGROOT=engroot
-    ):
-        try:
-            curr_load_sample = sample_load(proc_entry)
-            curr_ram_sample  = sample_ram(proc_entry)
-        except (psutil.AccessDenied, psutil.NoSuchProcess):
-            utility.write("Process has probably exited but this could"
-            " also mean that one of the artifact's children is a zombie.")
-            continue
-        load_samples.append(curr_load_sample)
-        ram_samples.append(curr_ram_sample)
+    leaf = new_leaf() if use_cgroup else None
+    preexec_fn = leaf.enter if leaf else None
+    if run_limits:
+        preexec_fn = limits.preexec(run_limits, grace, preexec_fn)
+        if leaf and run_limits.memory is not None:
+            leaf.limit_memory(run_limits.memory)
+    watchdog = None
+    try:
+        # sampling and limits are watched on threads of their own; this
+        # one only waits for the exit
+        watcher = None
+        for proc_entry , rc_run, start_t, end_t in utility.process_watch(
+          solpath, ['run.sh', configpath, datasetpath, outputdir, logfile],
+          timeout=None, preexec_fn=preexec_fn,
+          rusage=measures['rusage']['run'], ENGROOT=engroot
+        ):
+            if watcher is None and proc_entry is not None:
+                watcher = new_sampler(proc_entry, leaf)
+                watcher.start()
+                if run_limits:
+                    watchdog = limits.Watchdog(
+                      proc_entry, run_limits, outputdir, leaf, grace=grace)
+                    watchdog.start()
+
+        if watcher:
+            measures['samples'] = watcher.stop()
+        if leaf:
+            measures['cgroup'] = leaf.stats()
+        if watchdog:
+            measures['limit_hit'] = watchdog.stop() or \
+              limits.enforced_limit(rc_run, run_limits,
+                measures['rusage']['run'], outputdir, leaf)
+    finally:
+        if watchdog:
+            watchdog.stop()
+        if leaf:
+            leaf.kill()
+            if not leaf.remove():
+                utility.write("cannot remove cgroup " + leaf.path)
+    ram_samples = [s.vms for s in measures['samples']]
+    load_samples = [s.load for s in measures['samples']]
 
     utility.write("attempt post_process.sh")
     for _, rc_post, _, _ in utility.process_watch(
-      solpath, ['post_process.sh', configpath, datasetpath, outputdir, logfile], ENGROOT=engroot
+      solpath, ['post_process.sh', configpath, datasetpath, outputdir, logfile],
+      timeout=None, rusage=measures['rusage']['post_process'], ENGROOT=engroot
     ):
         pass
 
     if rc_post != None and rc_post != 0:
         utility.write("post_process.sh returned exit code %d.", rc_post)
 
-    maxavg = lambda li: (max(li), sum(li)/len(li))
+    maxavg = lambda li: (max(li), sum(li)/len(li)) if li else (0.0, 0.0)
 
     return rc_run,\
       maxavg(ram_samples),\
       maxavg(load_samples),\
-      (start_t, end_t)
+      (start_t, end_t),\
+      measures
 
 
 @mod.pny.db_session
@@ -204,8 +380,15 @@ def retrieve_configurations(solution_id):
 @mod.pny.db_session
 def save_run(
       engine_id, solution_id, config_label, dataset_id,
-      output_hash, log_hash, time_info, load_info, ram_info
+      output_hash, log_hash, time_info, load_info, ram_info, measures=None,
+      benchmark_id=None
     ):
+    """
+      load_info and ram_info are (max, average); measures, as returned by
+      run_solution, go to run_sample, run_cgroup and run_rusage.  a run
+      repeated by --repeat belongs to benchmark_id.
+    """
+    measures = measures or {}
 
     e = mod.Engine.get(id=engine_id)
     s = mod.Solution.get(id=solution_id)
@@ -219,21 +402,43 @@ def save_run(
 
     r = mod.Run(
       engine = e, configured_solution = cs, dataset = d,
+      limit_hit = measures.get('limit_hit'),
       output = output_hash,
       started = datetime.fromtimestamp(time_info[0]).strftime(
         '%Y-%m-%d %H:%M:%S'
       ),
       duration = time_info[1] - time_info[0],
 
-      load_average = load_info[0],
-      load_max = load_info[1],
+      load_average = load_info[1],
+      load_max = load_info[0],
 
-      ram_average = ram_info[0],
-      ram_max = ram_info[1]
+      ram_average = ram_info[1],
+      ram_max = ram_info[0]
     )
 
+    samples = measures.get('samples')
+    if samples:
+        mod.RunSample(run = r, count = len(samples),
+                      series = buffer(series.encode(samples)))
+
+    if measures.get('cgroup'):
+        mod.RunCgroup(run = r, **measures['cgroup'])
+
+    if measures.get('limits'):
+        mod.RunLimit(run = r, **measures['limits']._asdict())
+
+    for phase, usage in measures.get('rusage', {}).items():
+        if usage: # phases without a script have none
+            mod.RunRusage(run = r, phase = phase, **usage)
+
     if log_hash:
-        r.log_id = log_hash
+        r.log = log_hash
+
+    if benchmark_id is not None:
+        r.benchmark = mod.Benchmark[benchmark_id]
+
+    mod.pny.flush()
+    return r.id
 
 
 def generate_parser(parser):
@@ -253,6 +458,41 @@ def generate_parser(parser):
     parser.add_argument('--persist', action='store_true', default=False,
       help="make directory persist for debugging purposes")
 
+    parser.add_argument('--cgroup', action='store_true',
+      default=utility.store_setting('run', 'cgroup', 'no') == 'yes',
+      help="account for run.sh exactly in a cgroup v2 of its own, "
+           "where cgroups are delegated to us")
+
+    parser.add_argument('--repeat', type=int, default=1,
+      help="runs to make and save as one benchmark")
+
+    parser.add_argument('--warmup', type=int, default=0,
+      help="runs to make first without saving them")
+
+    parser.add_argument('--ci-width', type=float,
+      default=float(utility.store_setting('benchmark', 'ci_width', 0.05)),
+      help="stop repeating once the 95%% confidence interval of the median "
+           "duration is narrower than this fraction of it; 0 never stops "
+           "early")
+
+    parser.add_argument('--memory', type=str, default=None,
+      help="resident bytes run.sh and its descendants may use, e.g. 4G")
+
+    parser.add_argument('--cpu-seconds', type=str, default=None,
+      help="CPU time run.sh and its descendants may use, e.g. 90m")
+
+    parser.add_argument('--wall-seconds', type=str, default=None,
+      help="time run.sh may take, e.g. 2h")
+
+    parser.add_argument('--file-size', type=str, default=None,
+      help="bytes any file written may grow to")
+
+    parser.add_argument('--output-size', type=str, default=None,
+      help="bytes the output directory may grow to")
+
+    parser.add_argument('--journal', type=str, default=None,
+      help="JSON lines file to record the saved run in, as run-batch does")
+
     parser.set_defaults(func=run_solution_cli)
 
     return parser
@@ -0,0 +1,223 @@
+#!/usr/bin/python
+# sampler.py -- resource usage sampler            -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Resource usage sampler.
+
+    A Sampler thread watches the process tree of a running artifact while
+    the caller waits for it to exit.  Every tick lists the tree once and
+    reads each process once, recording
+
+      time  :: seconds since the epoch
+      load  :: cores busy since the previous tick, from cumulative CPU
+               times rather than cpu_percent, which reads 0.0 on the first
+               call for every new Process object
+      vms         :: virtual memory of the tree in KiB
+      rss         :: resident memory of the tree in KiB
+      threads     :: threads in the tree
+      read_bytes  :: bytes read from storage so far
+      write_bytes :: bytes written to storage so far
+
+    Ticks start INTERVAL apart and back off by BACKOFF up to MAX_INTERVAL,
+    so that short runs are sampled densely and long runs cheaply.  The
+    samples are stored with series.encode.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import threading
+import time
+
+import psutil
+
+from .series import Sample
+
+
+INTERVAL = 0.1
+MAX_INTERVAL = 2.0
+BACKOFF = 1.5
+
+GONE = (psutil.NoSuchProcess, psutil.AccessDenied)
+
+
+def cpu_seconds(times):
+    """
+      user and system time of a process, and of the children it has
+      waited for, so that the time of a descendant carries over to its
+      parent when it exits
+    """
+    return times.user + times.system + \
+           getattr(times, 'children_user', 0) + \
+           getattr(times, 'children_system', 0)
+
+
+def io_bytes(process):
+    """
+      (read, written) bytes of a process, zeros where the platform or our
+      privileges do not tell
+    """
+    try:
+        counters = process.io_counters()
+    except (AttributeError, NotImplementedError, psutil.AccessDenied):
+        return 0, 0
+    return counters.read_bytes, counters.write_bytes
+
+
+def read_process(process):
+    """
+      returns (cpu seconds, vms KiB, rss KiB, threads, read bytes, written
+      bytes) of one process
+    """
+    def read():
+        times, memory = process.cpu_times(), process.memory_info()
+        return (cpu_seconds(times), memory.vms >> 10, memory.rss >> 10,
+                process.num_threads()) + io_bytes(process)
+
+    oneshot = getattr(process, 'oneshot', None)
+    if oneshot is None:
+        return read()
+    with oneshot():
+        return read()
+
+
+def alive(key):
+    """
+      whether the process (pid, create_time) still runs, e.g. re-parented
+      out of the tree
+    """
+    try:
+        return psutil.Process(key[0]).create_time() == key[1]
+    except GONE:
+        return False
+
+
+class Sampler(threading.Thread):
+    """
+      samples the tree of process (a psutil.Process) until stop is called.
+      given the cgroup.Leaf process runs in, the tree is whatever is in the
+      leaf and load comes from the leaf's own CPU counter.
+    """
+
+    def __init__(self, process, interval=INTERVAL, max_interval=MAX_INTERVAL,
+                 backoff=BACKOFF, leaf=None):
+        super(Sampler, self).__init__(name='peval-sampler')
+        self.daemon = True
+        self.process = process
+        self.leaf = leaf
+        self.usage_usec = 0
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.backoff = backoff
+        self.samples = []
+        self.stopped = threading.Event()
+
+        # (pid, create_time) -> (cpu seconds, read bytes, written bytes)
+        # at the previous tick, so that a recycled pid is never mistaken
+        # for the process it replaced
+        self.counters = {}
+        self.read_bytes, self.write_bytes = 0, 0
+        try:
+            self.last = process.create_time()
+        except GONE:
+            self.last = time.time()
+
+    def tree(self):
+        if self.leaf is not None:
+            processes = []
+            for pid in self.leaf.pids():
+                try:
+                    processes.append(psutil.Process(pid))
+                except GONE:
+                    pass
+            return processes
+        processes = [self.process]
+        try:
+            processes.extend(self.process.children(recursive=True))
+        except GONE:
+            pass
+        return processes
+
+    def tick(self):
+        """
+          takes one sample; returns it, or None if the tree is gone
+        """
+        now = time.time()
+        counters, busy, vms, rss, threads = {}, 0.0, 0, 0, 0
+        for process in self.tree():
+            try:
+                key = (process.pid, process.create_time())
+                seconds, process_vms, process_rss, process_threads, \
+                  read_bytes, write_bytes = read_process(process)
+            except GONE:
+                continue
+            # a process first seen now has been running since it started
+            before = self.counters.get(key, (0.0, 0, 0))
+            busy += max(0.0, seconds - before[0])
+            self.read_bytes += max(0, read_bytes - before[1])
+            self.write_bytes += max(0, write_bytes - before[2])
+            counters[key] = (seconds, read_bytes, write_bytes)
+            vms += process_vms
+            rss += process_rss
+            threads += process_threads
+
+        if not counters:
+            return None
+        if self.leaf is not None:
+            usage_usec = self.leaf.usage_usec()
+            busy = (usage_usec - self.usage_usec) / 1e6
+            self.usage_usec = usage_usec
+        for key in set(self.counters) - set(counters):
+            # a process that exited was waited for by its parent, whose
+            # children times now hold all it used; only the part since the
+            # last tick is new
+            if self.leaf is None and not alive(key):
+                busy -= self.counters[key][0]
+        busy = max(0.0, busy)
+        elapsed, self.last, self.counters = now - self.last, now, counters
+        sample = Sample(now, busy / max(elapsed, 1e-3), vms, rss, threads,
+                        self.read_bytes, self.write_bytes)
+        self.samples.append(sample)
+        return sample
+
+    def run(self):
+        interval = self.interval
+        while not self.stopped.is_set():
+            if self.tick() is None:
+                break
+            self.stopped.wait(interval)
+            interval = min(self.max_interval, interval * self.backoff)
+
+    def stop(self):
+        """
+          stops sampling and returns the samples
+        """
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+        return self.samples
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+# series.py -- resource usage time series         -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Resource usage time series of a run.
+
+    Every Sample of a run is kept in the run_sample table as one blob: a
+    version byte, then zlib compressed varints, column by column, of the
+    differences between successive samples scaled to integers.  Samples
+    change slowly from one tick to the next, so a run of an hour takes a
+    few KiB.
+
+    Ticks back off as a run goes on (see sampler.py), so percentiles weigh
+    every sample by the time it stands for rather than counting samples.
+
+    This module imports no other part of peval so that sampler may import
+    it.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import collections
+import zlib
+
+
+VERSION = 1
+
+"""
+  (column, scale) in the order they are encoded: time in milliseconds,
+  load in thousandths of a core, memory in KiB, I/O in bytes
+"""
+COLUMNS = [
+    ('time', 1000),
+    ('load', 1000),
+    ('vms', 1),
+    ('rss', 1),
+    ('threads', 1),
+    ('read_bytes', 1),
+    ('write_bytes', 1),
+]
+
+Sample = collections.namedtuple('Sample', [name for name, scale in COLUMNS])
+
+
+def put_varint(out, value):
+    value = (value << 1) ^ (value >> 63) # zigzag, so small negatives stay small
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def get_varint(data, position):
+    value, shift = 0, 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    return (value >> 1) ^ -(value & 1), position
+
+
+def encode(samples):
+    """
+      takes in [Sample]
+      returns the blob stored in run_sample
+    """
+    out = bytearray()
+    put_varint(out, len(samples))
+    for index, (name, scale) in enumerate(COLUMNS):
+        previous = 0
+        for sample in samples:
+            value = int(round(sample[index] * scale))
+            put_varint(out, value - previous)
+            previous = value
+    return bytes(bytearray([VERSION])) + zlib.compress(bytes(out), 9)
+
+
+def decode(blob):
+    """
+      returns the [Sample] of a blob made by encode
+    """
+    blob = bytearray(blob)
+    if not blob or blob[0] != VERSION:
+        raise ValueError("unknown series encoding")
+    data = bytearray(zlib.decompress(bytes(blob[1:])))
+    count, position = get_varint(data, 0)
+    columns = []
+    for name, scale in COLUMNS:
+        values, total = [], 0
+        for _ in range(count):
+            delta, position = get_varint(data, position)
+            total += delta
+            values.append(total / scale if scale != 1 else total)
+        columns.append(values)
+    return [Sample(*row) for row in zip(*columns)]
+
+
+def weights(samples):
+    """
+      the seconds each sample stands for: the time since the one before.
+      the first stands for as long as the second.
+    """
+    spans = [b.time - a.time for a, b in zip(samples, samples[1:])]
+    return spans[:1] + spans if spans else [1.0] * len(samples)
+
+
+def percentile(samples, column, fraction):
+    """
+      returns the value of column that samples stay at or below for the
+      given fraction of the time
+    """
+    if not samples:
+        return None
+    pairs = sorted(zip([getattr(s, column) for s in samples],
+                       weights(samples)))
+    total = sum(w for v, w in pairs)
+    seen = 0.0
+    for value, weight in pairs:
+        seen += weight
+        if seen >= fraction * total:
+            return value
+    return pairs[-1][0]
+
+
+def cpu_seconds(samples):
+    """
+      integral of the load over the series; each load is the average since
+      the sample before
+    """
+    return sum(b.load * (b.time - a.time) for a, b in zip(samples, samples[1:]))
+
+
+def peak(samples, column):
+    """
+      returns the sample at which column was highest, the first if several
+    """
+    if not samples:
+        return None
+    return max(samples, key=lambda s: getattr(s, column))
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# stats.py -- statistics of repeated runs         -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Statistics of repeated runs.
+
+    Run times are skewed and now and then one run is disturbed, so the
+    summaries are robust ones:
+
+      median    :: the middle value
+      mad       :: median absolute deviation from the median
+      low, high :: bootstrap confidence interval of the median, from
+                   RESAMPLES resamples with a fixed seed, so that the same
+                   values always give the same interval
+      outliers  :: indexes of values whose modified z-score,
+                   0.6745 (x - median) / mad, exceeds OUTLIER in magnitude
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import collections
+import random
+
+
+CONFIDENCE = 0.95
+RESAMPLES = 2000
+OUTLIER = 3.5
+MIN_SAMPLES = 3
+
+Summary = collections.namedtuple('Summary', 'n median mad low high outliers')
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def mad(values):
+    m = median(values)
+    return median([abs(v - m) for v in values])
+
+
+def bootstrap_interval(values, confidence=CONFIDENCE, resamples=RESAMPLES,
+                       seed=0):
+    """
+      returns (low, high) of the percentile bootstrap interval of the
+      median of values
+    """
+    rng = random.Random(seed)
+    n = len(values)
+    medians = sorted(median([values[rng.randrange(n)] for _ in range(n)])
+                     for _ in range(resamples))
+    tail = (1 - confidence) / 2
+    return (medians[int(tail * (resamples - 1))],
+            medians[int(round((1 - tail) * (resamples - 1)))])
+
+
+def outliers(values, threshold=OUTLIER):
+    m, d = median(values), mad(values)
+    if d == 0:
+        return []
+    return [i for i, v in enumerate(values)
+            if abs(0.6745 * (v - m) / d) > threshold]
+
+
+def summarize(values, confidence=CONFIDENCE):
+    """
+      returns the Summary of values, which must not be empty
+    """
+    low, high = bootstrap_interval(values, confidence)
+    return Summary(len(values), median(values), mad(values), low, high,
+                   outliers(values))
+
+
+def converged(values, width, confidence=CONFIDENCE):
+    """
+      whether the confidence interval of the median of values is narrower
+      than width times the median, given at least MIN_SAMPLES of them
+    """
+    if len(values) < MIN_SAMPLES:
+        return False
+    low, high = bootstrap_interval(values, confidence)
+    return high - low <= width * abs(median(values))
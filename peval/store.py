@@ -0,0 +1,339 @@
+#!/usr/bin/python
+# store.py -- artifact store maintenance          -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Maintain the artifact store."""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import os
+import os.path as osp
+import sqlite3
+
+from . import model as mod
+from . import cache
+from . import chunkstore
+from . import codec
+from . import digest as digests
+from . import layout
+from . import members
+from . import utility
+
+
+"""
+  every (table, column) of index.db holding an identifier of an archive in
+  the store, followed by the columns that merely refer to those.  a table
+  added to model.UPGRADES with such a column belongs here too.
+"""
+ARTIFACT_COLUMNS = [
+    ('engine', 'id'),
+    ('solution', 'id'),
+    ('configured_solution', 'id'),
+    ('dataset', 'in_digest'),
+    ('dataset', 'eval_digest'),
+    ('evaluator', 'id'),
+    ('evaluation', 'id'),
+    ('Run', 'output'),
+    ('Run', 'log'),
+]
+
+REFERENCE_COLUMNS = ARTIFACT_COLUMNS + [
+    ('solution', 'engine'),
+    ('configured_solution', 'solution'),
+    ('Run', 'engine'),
+    ('Run', 'configured_solution_id'),
+    ('Run', 'configured_solution_solution'),
+    ('Run', 'dataset'),
+    ('ChallengeProblem_Dataset', 'dataset'),
+    ('challenge_problem', 'evaluator'),
+    ('evaluation', 'evaluator'),
+    ('benchmark', 'engine'),
+    ('benchmark', 'configured_solution_id'),
+    ('benchmark', 'configured_solution_solution'),
+    ('benchmark', 'dataset'),
+]
+
+
+def connect():
+    return sqlite3.connect(mod.DB_LOC, timeout=mod.BUSY_TIMEOUT)
+
+
+def referenced_identifiers(connection):
+    ids = set()
+    for table, column in ARTIFACT_COLUMNS:
+        query = "SELECT DISTINCT {1} FROM {0} WHERE {1} IS NOT NULL"
+        for (identifier,) in connection.execute(query.format(table, column)):
+            ids.add(str(identifier))
+    return ids
+
+
+#####################################
+##         REKEY
+#####################################
+
+def archive_digest(path, threads=None):
+    try:
+        with codec.reader(path) as tar:
+            return digests.digest_archive(tar, threads)
+    except (ValueError, IOError) as e:
+        raise utility.FormattedError("Cannot read '{}': {}", path, e)
+
+
+def plan_rekey(connection, threads=None):
+    """
+      returns {old identifier: new identifier} for every version 1
+      identifier in index.db whose archive is in the store
+    """
+    ids = referenced_identifiers(connection)
+    mapping = {}
+    for old in sorted(ids):
+        if digests.version_of(old) != 1:
+            continue
+        try:
+            path = utility.get_resource(old)
+        except utility.FormattedError:
+            utility.write("missing from the store, left as is: " + old)
+            continue
+        hexpart, suffix = digests.split_identifier(old)
+        mapping[old] = archive_digest(path, threads) + suffix
+        print(old, "->", mapping[old])
+
+    # identical contents registered from two places now share a digest;
+    # merging their rows is beyond a rename, so leave both alone
+    counts = collections.Counter(mapping.values())
+    for old, new in list(mapping.items()):
+        if counts[new] > 1 or new in ids:
+            utility.write("duplicate contents, left as is: " + old)
+            del mapping[old]
+
+    return mapping
+
+
+def apply_rekey(connection, mapping):
+    """
+      publishes every archive under its new name, then rewrites index.db in
+      a single transaction, then drops the old names.  an interruption
+      leaves the store readable under whichever names index.db holds.
+    """
+    root = utility.location_resource()
+    index = layout.PrefixIndex(root)
+    for old, new in mapping.items():
+        new_path = utility.artifact_location(new)
+        old_index = members.index_path(utility.get_resource(old))
+        layout.make_shard(root, new)
+        if osp.exists(old_index) and \
+           not osp.exists(members.index_path(new_path)):
+            os.link(old_index, members.index_path(new_path))
+        if not osp.exists(new_path):
+            os.link(utility.get_resource(old), new_path)
+        index.add(new)
+    index.close()
+
+    # foreign keys are checked once every column has been rewritten
+    connection.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for table, column in REFERENCE_COLUMNS:
+            connection.executemany(
+              "UPDATE {0} SET {1} = ? WHERE {1} = ?".format(table, column),
+              [(new, old) for old, new in mapping.items()])
+        violations = connection.execute("PRAGMA foreign_key_check").fetchall()
+        if violations:
+            raise utility.FormattedError(
+              "Rekeying would break foreign keys: {}", violations)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    # queued jobs name artifacts in their commands; jobqueue imports this
+    # module, so it is imported here
+    from . import jobqueue
+    if osp.exists(jobqueue.queue_location()):
+        queue = jobqueue.JobQueue()
+        try:
+            utility.write("rekeyed {} queued jobs".format(queue.rekey(mapping)))
+        finally:
+            queue.close()
+
+    # exclusive, as peval gc takes it to remove archives, so that no
+    # writer or sandbox is using an old name while it goes
+    index = layout.PrefixIndex(root)
+    try:
+        with cache.locked(root, exclusive=True):
+            for old in mapping:
+                path = utility.get_resource(old)
+                index.discard(old)
+                os.unlink(path)
+                if osp.exists(members.index_path(path)):
+                    os.unlink(members.index_path(path))
+    finally:
+        index.close()
+
+
+def rekey_cli(arguments):
+    connection = connect()
+    try:
+        mapping = plan_rekey(connection, arguments.threads)
+        print("{} identifiers to rekey".format(len(mapping)))
+        if mapping and not arguments.dry_run:
+            apply_rekey(connection, mapping)
+    finally:
+        connection.close()
+
+
+def rekey_subparser(subparsers):
+    parser = subparsers.add_parser('rekey',
+      help="re-identify version 1 artifacts with version 2 digests")
+
+    parser.add_argument('--dry-run', action='store_true', default=False,
+      help="only print the identifiers that would change")
+
+    parser.add_argument('--threads', type=int, default=None,
+      help="hashing threads, one per core by default")
+
+    parser.set_defaults(func=rekey_cli)
+
+
+#####################################
+##         STATS
+#####################################
+
+MB = float(1 << 20)
+
+def stored_archives():
+    """
+      yields (path, codec) for every archive in the store
+    """
+    root = utility.location_resource()
+    for name in layout.flat_archives(root):
+        yield osp.join(root, name), codec.for_path(name)
+    for name in layout.sharded_archives(root):
+        yield utility.artifact_location(name), codec.for_path(name)
+
+
+def stats_cli(arguments):
+    counts = collections.Counter()
+    sizes = collections.Counter()
+    manifests = []
+    for path, c in stored_archives():
+        counts[c.name] += 1
+        sizes[c.name] += osp.getsize(path)
+        if c.name == 'cdc':
+            manifests.append(path)
+
+    print("{:<8} {:>8} {:>12}".format("codec", "archives", "MiB"))
+    for name in sorted(counts):
+        print("{:<8} {:>8} {:>12.1f}".format(name, counts[name],
+                                             sizes[name] / MB))
+
+    if not manifests:
+        return
+
+    # a chunk shared by many archives is stored once
+    root = chunkstore.chunk_root()
+    logical, unique = 0, {}
+    for path in manifests:
+        for sha, length in chunkstore.manifest_chunks(path):
+            logical += length
+            unique[sha] = length
+    stored = sum(chunkstore.stored_size(root, sha) for sha in unique)
+
+    print()
+    print("chunk store: {} archives, {} chunks".format(
+      len(manifests), len(unique)))
+    print("  archived    {:>12.1f} MiB".format(logical / MB))
+    print("  unique      {:>12.1f} MiB".format(sum(unique.values()) / MB))
+    print("  on disk     {:>12.1f} MiB ({:.0%} saved)".format(
+      stored / MB, 1 - stored / float(max(logical, 1))))
+
+
+def stats_subparser(subparsers):
+    parser = subparsers.add_parser('stats',
+      help="space used by the store, per codec and in the chunk store")
+
+    parser.set_defaults(func=stats_cli)
+
+
+#####################################
+##         INDEX
+#####################################
+
+def index_cli(arguments):
+    built = 0
+    for path, c in stored_archives():
+        if osp.exists(members.index_path(path)):
+            continue
+        try:
+            members.load_index(path)
+        except (ValueError, IOError) as e:
+            utility.write("cannot index {}: {}".format(path, e))
+            continue
+        built += 1
+    print("{} member indexes written".format(built))
+
+
+def index_subparser(subparsers):
+    parser = subparsers.add_parser('index',
+      help="write the member index of archives stored without one")
+
+    parser.set_defaults(func=index_cli)
+
+
+#####################################
+##         MIGRATE
+#####################################
+
+def migrate_cli(arguments):
+    moved = layout.migrate(utility.location_resource())
+    print("{} archives moved into fan-out directories".format(moved))
+
+
+def migrate_subparser(subparsers):
+    parser = subparsers.add_parser('migrate',
+      help="move every archive of a flat store into fan-out directories "
+           "and rebuild the prefix index")
+
+    parser.set_defaults(func=migrate_cli)
+
+
+#####################################
+##         PARSERS
+#####################################
+
+def generate_parser(parser):
+    subparsers = parser.add_subparsers(help="subcommand")
+
+    # initialize subparsers
+    rekey_subparser(subparsers)
+    stats_subparser(subparsers)
+    index_subparser(subparsers)
+    migrate_subparser(subparsers)
+
+    return parser
@@ -35,7 +35,9 @@
 
 from __future__ import (absolute_import, division, print_function)
 
+import atexit
 import contextlib
+import errno
 
 import shutil
 
@@ -45,7 +47,6 @@ from itertools import ifilter
 import os
 import os.path as osp
 import glob
-import tarfile
 import tempfile
 import inspect
 import xdg.BaseDirectory
@@ -55,6 +56,18 @@ import time
 import subprocess
 import psutil
 
+from . import cache
+from . import codec
+from . import digest as digests
+from . import memo
+from . import layout
+from . import members
+
+try:
+    from ConfigParser import SafeConfigParser as ConfigParser
+except ImportError:
+    from configparser import ConfigParser
+
 
 """
   ::SUCC_COMMENT
@@ -91,22 +104,201 @@ def location_resource(
   ):
     return osp.join(location, fname)
 
+def artifact_location(fname):
+    """
+      where the archive fname lives in the store (see layout.py)
+    """
+    return layout.artifact_path(osp.normpath(location_resource()), fname)
+
 def glob_resource(fname):
-    path = location_resource(fname=(fname + "*"))
-    candidates = glob.glob(path)
+    candidates = layout.resolve(location_resource(), fname)
     if len(candidates) != 1:
-        raise FormattedError("Identifier %s is not unique. Please specify further", path)
-    return test_path(candidates[0])
+        raise FormattedError("Identifier %s is not unique. Please specify further", fname + "*")
+    return test_path(artifact_location(candidates[0]))
+
+def store_setting(section, key, default=None):
+    """
+      looks a setting up in the environment as PEVAL_<SECTION>_<KEY>, then
+      in the store's peval.conf, e.g.
+
+        [codec]
+        default = zst
+        engine = xz
+
+      returns default when neither defines it
+    """
+    env = "PEVAL_" + section.upper() + ("_" + key.upper() if key else "")
+    if env in os.environ:
+        return os.environ[env]
+
+    conf = ConfigParser()
+    conf.read(location_resource('peval.conf'))
+    if conf.has_option(section, key or 'default'):
+        return conf.get(section, key or 'default')
+    return default
+
+def codec_for(kind=None):
+    """
+      returns the codec new archives of kind (engine, solution, output, ...)
+      are written with.  a setting for the kind wins over the default one.
+    """
+    name = codec.DEFAULT
+    name = store_setting('codec', None, name)
+    if kind:
+        name = store_setting('codec', kind, name)
+    try:
+        return codec.get(name)
+    except ValueError as e:
+        raise FormattedError(str(e))
 
 def get_resource(fname='.'):
-    path = location_resource(fname=fname)
+    path = artifact_location(fname)
+    if not osp.exists(path):
+        # still at the top level of a store from before the fan-out
+        path = layout.migrate_one(location_resource(), fname) or path
     return test_path(path)
 
+def has_resource(fname):
+    try:
+        get_resource(fname)
+    except FormattedError:
+        return False
+    return True
+
+"""
+  how many commit_resource calls found their identifier already stored
+"""
+STORE_COMMITS = {'new': 0, 'existing': 0}
+
 def commit_resource(full_path):
-    srcdir, fname = osp.split(test_path(resolve_path(full_path)))
-    copy_directory_files(srcdir, location_resource(), [fname])
+    """
+      publishes an archive made by prepare_resource into the store.  an
+      archive staged in the store is hardlinked into place, others are
+      copied next to their destination and renamed into place, so the
+      store never holds a partial archive.
+    """
+    full_path = test_path(resolve_path(full_path))
+    srcdir, fname = osp.split(full_path)
+    staged = osp.dirname(srcdir) == osp.realpath(location_resource(STAGING))
+
+    # shared with other writers, exclusive while peval gc removes files
+    with cache.locked(location_resource()):
+        if has_resource(fname):
+            # identifiers name contents, so this one is already stored.
+            # touching it tells a running peval gc that it is in use.
+            STORE_COMMITS['existing'] += 1
+            cache.touch(get_resource(fname))
+        else:
+            STORE_COMMITS['new'] += 1
+            target = artifact_location(fname)
+            layout.make_shard(location_resource(), fname)
+            # the member index goes first, so that no stored archive lacks one
+            if osp.exists(members.index_path(full_path)):
+                publish(members.index_path(full_path),
+                        members.index_path(target))
+            publish(full_path, target)
+            durable(osp.dirname(target))
+
+            index = layout.PrefixIndex(location_resource())
+            try:
+                index.add(fname)
+            finally:
+                index.close()
+
+    if staged:
+        shutil.rmtree(srcdir, ignore_errors=True)
     return True
 
+"""
+  archives are written into a fresh directory under STAGING, which is on
+  the same filesystem as the store, and hardlinked into place from there
+"""
+STAGING = '.staging'
+
+def staging_dir():
+    root = location_resource(STAGING)
+    try:
+        os.mkdir(root)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return tempfile.mkdtemp(prefix='stage.', dir=root)
+
+def fsync_policy():
+    """
+      [store] fsync: always  flush every archive before it is published
+                     batch   flush everything published when peval exits
+                     never   leave it to the operating system
+    """
+    policy = store_setting('store', 'fsync', 'batch')
+    if policy not in ('always', 'batch', 'never'):
+        raise FormattedError(
+          "[store] fsync must be always, batch or never, not '{}'", policy)
+    return policy
+
+def fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+PENDING_FSYNC = []
+
+@atexit.register
+def sync_pending():
+    while PENDING_FSYNC:
+        try:
+            fsync_path(PENDING_FSYNC.pop())
+        except OSError as e:
+            # removed meanwhile, e.g. by peval gc
+            if e.errno != errno.ENOENT:
+                raise
+
+def durable(path):
+    policy = fsync_policy()
+    if policy == 'always':
+        fsync_path(path)
+    elif policy == 'batch' and path not in PENDING_FSYNC:
+        PENDING_FSYNC.append(path)
+
+def publish(src, dst):
+    """
+      makes the finished file src appear at dst in one step
+    """
+    if fsync_policy() == 'always':
+        fsync_path(src)
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            return # published concurrently, and with the same contents
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        fd, tmp = tempfile.mkstemp(prefix='.tmp-', dir=osp.dirname(dst))
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmp)
+            if fsync_policy() == 'always':
+                fsync_path(tmp)
+            os.rename(tmp, dst)
+        finally:
+            if osp.exists(tmp):
+                os.unlink(tmp)
+    durable(dst)
+
+def dedup_report():
+    """
+      returns a line summarizing STORE_COMMITS, or None if nothing was
+      committed
+    """
+    total = STORE_COMMITS['new'] + STORE_COMMITS['existing']
+    if not total:
+        return None
+    return "{} of {} artifacts already in the store ({:.0%} deduplicated)" \
+      .format(STORE_COMMITS['existing'], total,
+              STORE_COMMITS['existing'] / total)
+
 def write(message):
     """
       debugging tool prints out message and other helper data
@@ -189,14 +381,18 @@ def FormatMessage(message, *args):
 
 def untar_to_directory(src, dest):
     """
-      Untars a tar.bz2 file to a directory then returns the appropriate dest
+      Untars an archive to a directory then returns the appropriate dest
+
+      the codec is chosen by src's suffix (see codec.py)
     """
     if not (osp.exists(dest)):
       os.mkdir(dest)
-    with tarfile.open(src) as tar:
-        li = map(lambda x: x.path, tar.getmembers())
-        tar.extractall(dest)
-        return dest
+    try:
+        with codec.reader(src) as tar:
+            tar.extractall(dest)
+    except (ValueError, IOError) as e:
+        raise FormattedError("Cannot unpack '{}': {}", src, e)
+    return dest
 
 
 def unpack_parts(dest, *args):
@@ -222,10 +418,17 @@ def unpack_part(unique_id, dest, label=''):
       retrieves resource path for id.tar.bz2
       creates directory dest/label
       untars id.tar.bz2 to dest/label/...
+
+      archives are unpacked once into the extracted-artifact cache and
+      dest/label is assembled from there (see cache.py)
     """
     fname = get_resource(unique_id)
     dstdir = osp.join(dest, label)
-    return untar_to_directory(fname, dstdir)
+    try:
+        return cache.materialize(osp.basename(fname), fname, dstdir,
+                                 untar_to_directory)
+    except ValueError as e:
+        raise FormattedError(str(e))
 
 
 def resolve_path(path, allow_symbol=False):
@@ -239,15 +442,28 @@ def resolve_path(path, allow_symbol=False):
     return path
 
 
-def prepare_resource(inpath, dstdir, allow_symbol=False):
+def prepare_resource(inpath, dstdir=None, allow_symbol=False, kind=None,
+                     verify=False, memoize=False):
     """
       Take inpath and dstdir then produces inpath.tar.bz2, 
       renames to its digest, moves to dstdir. returns digest.tar.bz2
 
+      without dstdir the archive is staged in the store, from where
+      commit_resource publishes it without copying
+
       allow_symbol determines if inpath allows preservation of symlinks
+      kind selects the codec (see codec_for), so the suffix may differ
+
+      with memoize, digests are memoized by stat (see memo.py): files that
+      did not change are not hashed again, and a tree that did not change
+      at all and is already in the store is returned from there without
+      being archived.  registrations memoize; run outputs and evaluations,
+      which are only ever hashed once, do not.  verify rehashes everything
+      regardless.
     """
-    inpath, dstdir = resolve_path(inpath, allow_symbol), \
-                     resolve_path(dstdir)
+    inpath = resolve_path(inpath, allow_symbol)
+    if dstdir:
+        dstdir = resolve_path(dstdir)
 
     perf = inpath
 
@@ -259,20 +475,58 @@ def prepare_resource(inpath, dstdir, allow_symbol=False):
 
     contents = map(osp.abspath, contents)
 
-    unique_name = digest_paths(contents)+".tar.bz2"
-    tmpbz = "ppaml-tmp.tar.bz2"
-    tmpbz = tarball_list(contents, perf, tmpbz, perf)
+    c = codec_for(kind)
+    version = digest_version()
+    items = [(item, item[len(perf):]) for item in contents]
+
+    memos = memo.DigestMemo() if memoize else memo.NoMemo()
+    try:
+        signature = memos.signature(items, version)
+        if not verify:
+            known = memos.lookup_tree(signature)
+            if known and has_resource(known + c.suffix):
+                write("unchanged since registered: " + known + c.suffix)
+                return known + c.suffix, get_resource(known + c.suffix)
+
+        nodes = {}
+        if version == 2 and not verify:
+            nodes = memos.lookup_files(
+              [item for item in contents if not osp.islink(item)], version)
+
+        digest = new_digest(contents, version)
+        tmpbz = "ppaml-tmp" + c.suffix
+        stage = dstdir or staging_dir()
+        try:
+            hexdigest, tmpbz = \
+              digest_and_tarball(contents, stage, tmpbz, perf, c, digest, nodes)
+        except Exception:
+            if not dstdir:
+                shutil.rmtree(stage, ignore_errors=True)
+            raise
+
+        if verify and memos.lookup_tree(signature) not in (None, hexdigest):
+            write("stale digest memo for " + inpath)
+        if version == 2:
+            memos.remember_files(digest.file_nodes, version)
+        memos.remember_tree(signature, hexdigest, inpath)
+    finally:
+        memos.close()
 
-    final_path = osp.join(dstdir, unique_name)
-    shutil.move(tmpbz, final_path)
+    unique_name = hexdigest + c.suffix
+
+    final_path = osp.join(stage, unique_name)
+    os.rename(members.index_path(tmpbz), members.index_path(final_path))
+    os.rename(tmpbz, final_path)
 
     return unique_name, final_path
 
 
-def tarball_list(contents, destpath, RESULT, prefix=""):
+def tarball_list(contents, destpath, RESULT, prefix="", c=None):
     """
       Takes in list of paths, and tarballs the contents uniquely ordered
-      then returns the path to RESULT as a tar.bz2 archive
+      then returns the path to RESULT as an archive compressed with codec c
+      (bz2 by default)
+      and writes its member index next to it (see members.py)
 
       if prefix undefined, then defaults to not remove any of the path
       if prefix is set to None then osp.commonprefix is removed
@@ -280,16 +534,90 @@ def tarball_list(contents, destpath, RESULT, prefix=""):
 
     contents = simple_list(contents)
 
+    c = c or codec.get(codec.DEFAULT)
+
     path = osp.join(destpath, RESULT)
-    with tarfile.open(path, "w:bz2") as tar:
-        for item in contents:
-            if prefix: assert(item.startswith(prefix))
-            arcitem = item[len(prefix):]
-            tar.add(item, arcitem)
+    try:
+        with codec.writer(path, c) as tar:
+            for item in contents:
+                if prefix: assert(item.startswith(prefix))
+                arcitem = item[len(prefix):]
+                tar.add(item, arcitem, filter=canonical_tarinfo)
+        members.save_index(path, members.written_entries(tar))
+    except (ValueError, IOError) as e:
+        raise FormattedError("Cannot write '{}': {}", path, e)
 
     return path
 
 
+def digest_and_tarball(contents, destpath, RESULT, prefix="", c=None,
+                       digest=None, nodes={}):
+    """
+      does the work of digest_contents and tarball_list in a single pass,
+      reading every file once through fixed size buffers.
+      returns (digest, path to RESULT)
+
+      digest defaults to new_digest(contents); nodes maps paths to the
+      version 2 hashes of files known not to have changed since they were
+      hashed, which are archived without being hashed again.
+    """
+    c = c or codec.get(codec.DEFAULT)
+    digest = digest or new_digest(contents)
+
+    path = osp.join(destpath, RESULT)
+    try:
+        with codec.writer(path, c) as tar:
+            for item in simple_list(contents):
+                if prefix: assert(item.startswith(prefix))
+                arcitem = item[len(prefix):]
+                if is_sym_or_empty(item):
+                    tar.add(item, arcitem, filter=canonical_tarinfo)
+                    digest.add_special(item, arcitem)
+                    continue
+                if item in nodes:
+                    tar.add(item, arcitem, filter=canonical_tarinfo)
+                    digest.add_node(item, arcitem, os.lstat(item).st_mode,
+                                    nodes[item])
+                    continue
+                tarinfo = canonical_tarinfo(tar.gettarinfo(item, arcitem))
+                with open(item, 'rb') as f:
+                    reader = HashingReader(f, digest)
+                    digest.begin_file(item, arcitem)
+                    tar.addfile(tarinfo, reader)
+                    # a second name for an inode is archived as a link and
+                    # tar reads nothing, but the digest covers its contents
+                    for buf in iter(lambda: reader.read(BUFFER_SIZE), b''):
+                        pass
+                    digest.end_file()
+        members.save_index(path, members.written_entries(tar))
+    except (ValueError, IOError) as e:
+        raise FormattedError("Cannot write '{}': {}", path, e)
+    finally:
+        # the version 2 digest's thread pool, whether or not archiving
+        # failed; the hashes already submitted are still collected below
+        digest.close()
+
+    return digest.hexdigest(), path
+
+
+def canonical_tarinfo(tarinfo):
+    """
+      strips the host specific metadata from an archive member: owners,
+      timestamps and every mode bit but executable, so that the same tree
+      archives to the same bytes wherever it is registered
+    """
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ""
+    tarinfo.mtime = CANONICAL_MTIME
+    if tarinfo.issym():
+        tarinfo.mode = 0o777
+    elif tarinfo.isdir() or tarinfo.mode & stat.S_IXUSR:
+        tarinfo.mode = 0o755
+    else:
+        tarinfo.mode = 0o644
+    return tarinfo
+
+
 def dircommonprefix(li):
     cp = osp.commonprefix(map(osp.dirname, li))
     x, y = osp.split(cp)
@@ -360,6 +688,79 @@ def expand_path_list(paths, prefix='.', test=False):
 
 
 """"""
+BUFFER_SIZE = 1 << 20
+CANONICAL_MTIME = 0
+
+class PathDigest(object):
+    """
+      the version 1 identifier computed by digest_paths, fed incrementally
+      so that it can be computed while the same bytes are being archived.
+
+        begin_file(path, arcname), update(data)..., end_file()  real files
+        add_special(path, arcname)                        symlinks, empty
+
+      contents are digested in 4096 byte chunks whatever size update() is
+      handed, which keeps identifiers identical to earlier releases.  the
+      names of symlinks and empty files come last, in the order of paths.
+    """
+    CHUNK = 4096
+
+    def __init__(self, paths=()):
+        self.sha = hashlib.sha1()
+        self.pending = b''
+        self.names = []
+        self.order = dict((p, i) for i, p in enumerate(paths))
+
+    def begin_file(self, filename, arcname=None):
+        self.sha.update(hashlib.sha1(filename).hexdigest())
+
+    def update(self, data):
+        if self.pending:
+            data = self.pending + data
+        whole = len(data) - len(data) % self.CHUNK
+        for i in range(0, whole, self.CHUNK):
+            self.sha.update(hashlib.sha1(data[i:i + self.CHUNK]).hexdigest())
+        self.pending = data[whole:]
+
+    def end_file(self):
+        if self.pending:
+            self.sha.update(hashlib.sha1(self.pending).hexdigest())
+        self.pending = b''
+
+    def add_special(self, filename, arcname=None):
+        self.names.append(filename)
+
+    def hexdigest(self):
+        sha = self.sha.copy()
+        for filename in sorted(self.names, key=self.order.get):
+            sha.update(hashlib.sha1(osp.basename(filename)).hexdigest())
+        return sha.hexdigest()
+
+    def close(self):
+        pass
+
+
+class HashingReader(object):
+    """
+      file object wrapper handing every byte read to digest, so that
+      tarfile.addfile hashes the file as it archives it
+    """
+    def __init__(self, f, digest):
+        self.f = f
+        self.digest = digest
+        self.nbytes = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.digest.update(data)
+        self.nbytes += len(data)
+        return data
+
+
+def is_sym_or_empty(filename):
+    return osp.islink(filename) or os.lstat(filename).st_size == 0
+
+
 def digest_paths(paths):
     """
       takes in a list containing paths to files
@@ -374,34 +775,106 @@ def digest_paths(paths):
       have the same name. (this may be a strong assumption, but satisfies
       for now)
     """
-    SHAhash = hashlib.sha1()
+    digest = PathDigest(paths)
 
-    filetypes = lambda n: osp.islink(n) or os.lstat(n).st_size == 0
-    [real_paths, sym_or_empty] = split_filter(paths, filetypes)
+    [real_paths, sym_or_empty] = split_filter(paths, is_sym_or_empty)
 
     for filename in simple_list(real_paths):
-        buf = filename
-        SHAhash.update(hashlib.sha1(buf).hexdigest())
+        digest.begin_file(filename)
+        with open(filename, 'rb') as f:
+            while True:
+                buf = f.read(BUFFER_SIZE)
+                if not buf : break
+                digest.update(buf)
+        digest.end_file()
 
-        f = open(filename, 'rb')
+    # handle symlinks and empty files by digesting over filename instead
+    for filename in sym_or_empty:
+        digest.add_special(filename)
 
-        while True:
-            # Read files as little chunks to prevent large ram usage
-            buf = f.read(4096)
-            if not buf : break
-            SHAhash.update(hashlib.sha1(buf).hexdigest())
-        f.close()
+    return digest.hexdigest()
 
-    # handle symlinks and empty files by digesting over filename instead
-    for filename in [osp.basename(name) for name in sym_or_empty]:
-        buf = filename
-        SHAhash.update(hashlib.sha1(buf).hexdigest())
 
-    return SHAhash.hexdigest()
+def digest_version():
+    """
+      the digest version new artifacts are identified with (see digest.py);
+      version 2 when BLAKE2 is available unless [digest] version says 1
+    """
+    default = '2' if digests.available(2) else '1'
+    version = int(store_setting('digest', 'version', default))
+    if not digests.available(version):
+        raise FormattedError(
+          "Digest version {} is not available; install pyblake2", version)
+    return version
 
 
+def new_digest(contents, version=None):
+    """
+      returns an empty incremental digest over contents (see PathDigest)
+    """
+    version = version or digest_version()
+    if version == 1:
+        return PathDigest(contents)
+    return digests.TreeDigest(int(store_setting('digest', 'threads', 0)))
+
+
+def digest_contents(contents, prefix, version=None):
+    """
+      the identifier prepare_resource gives contents without archiving them;
+      version 2 reads and hashes files concurrently.
+    """
+    version = version or digest_version()
+    if version == 1:
+        return digest_paths(contents)
+    for item in contents:
+        assert(item.startswith(prefix))
+    return digests.digest_files(
+      [(item, item[len(prefix):]) for item in simple_list(contents)],
+      int(store_setting('digest', 'threads', 0)))
+
+
+"""
+  fields of the rusage process_watch reports; the kernel's maxrss is KiB
+"""
+RUSAGE_FIELDS = [
+    ('user_seconds', 'ru_utime'),
+    ('system_seconds', 'ru_stime'),
+    ('max_rss', 'ru_maxrss'),
+    ('major_faults', 'ru_majflt'),
+    ('minor_faults', 'ru_minflt'),
+    ('voluntary_switches', 'ru_nvcsw'),
+    ('involuntary_switches', 'ru_nivcsw'),
+]
+
+REAP_POLL = 0.05
+
+def reap(pid, timeout=None):
+    """
+      waits up to timeout seconds, or until it exits if timeout is None,
+      for the child pid
+      returns (return code, rusage), (None, None) if it is still running.
+      the return code is negative for a signal, as with Popen.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        try:
+            done, status, usage = os.wait4(
+              pid, 0 if deadline is None else os.WNOHANG)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if done:
+            if os.WIFSIGNALED(status):
+                return -os.WTERMSIG(status), usage
+            return os.WEXITSTATUS(status), usage
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None, None
+        time.sleep(min(REAP_POLL, remaining))
+
 def process_watch( base_dir, command, timeout=3.0, isfile=True,
-  **environment_variables
+  preexec_fn=None, rusage=None, **environment_variables
 ):
     """
       This yields an iterator over
@@ -411,7 +884,11 @@ def process_watch( base_dir, command, timeout=3.0, isfile=True,
 
       Takes in a base directory as a new working directory, and a command
       as a list of strings
-      Optional :: timeout provides a timestep for gathering use metrics
+      Optional :: timeout provides a timestep for gathering use metrics;
+                  None yields only at the start and at the exit
+               :: preexec_fn is run in the child before the command
+               :: rusage, a dict, is filled with the RUSAGE_FIELDS and wall
+                  seconds of the command and every descendant it waited for
                :: isfile is used to define whether this command is in the
                local directory tree
     """
@@ -440,7 +917,7 @@ def process_watch( base_dir, command, timeout=3.0, isfile=True,
 
     if command[0] is not None:
 
-        proc = subprocess.Popen(command, env=proc_env)
+        proc = subprocess.Popen(command, env=proc_env, preexec_fn=preexec_fn)
         proc_entry = psutil.Process(proc.pid)
 
         while True:
@@ -448,22 +925,20 @@ def process_watch( base_dir, command, timeout=3.0, isfile=True,
             # :: psutil.AccessDenied, psutil.NoSuchProcess
             yield proc_entry, rc, start_t, time.time()
 
-            try:
-                rc = proc_entry.wait(timeout=timeout) # seconds
-                if rc is None:
-                    continue
-                else:
-                    # The timeout didn't expire--the process exited while we
-                    # waited.  We're done.
-                    break
-            except psutil.TimeoutExpired:
-                # write("psutil.TimeoutExpired hit")
-                # Our timeout expired, but the process still exists.
-                # Keep going.
-                continue
+            # reaped with wait4, which is where the kernel hands over the
+            # resource usage of the whole tree
+            rc, usage = reap(proc.pid, timeout)
+            if rc is not None:
+                proc.returncode = rc
+                break
 
         os.chdir(pwd)
 
+        if rusage is not None:
+            rusage['wall_seconds'] = time.time() - start_t
+            for field, attribute in RUSAGE_FIELDS:
+                rusage[field] = getattr(usage, attribute)
+
         yield proc_entry, rc, start_t, time.time()
     else:
         yield None, None, None, None
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# bench-evaluate.py -- evaluator benchmarks       -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Benchmarks eval.sh once per run against one eval-batch.sh for all of
+    them, on the same unpacked evaluator, ground truth and results, e.g.
+
+      bench-evaluate.py ~/evaluators/cp5 ~/datasets/cp5/eval out1 out2 out3
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import filecmp
+import os
+import os.path as osp
+import shutil
+import tempfile
+import time
+
+import peval.evaluate as evaluate
+import peval.utility as utility
+
+
+def same_tree(left, right):
+    """
+      whether two directories hold the same files with the same contents
+    """
+    comparison = filecmp.dircmp(left, right)
+    if comparison.left_only or comparison.right_only or comparison.funny_files:
+        return False
+    _, mismatch, errors = filecmp.cmpfiles(
+      left, right, comparison.common_files, shallow=False)
+    if mismatch or errors:
+        return False
+    return all(same_tree(osp.join(left, d), osp.join(right, d))
+               for d in comparison.common_dirs)
+
+
+def per_run(arguments, scratch):
+    outputs = []
+    for index, result in enumerate(arguments.results):
+        output = osp.join(scratch, 'output-{}'.format(index))
+        rc, _ = evaluate.evaluate_run(result, arguments.ground_truth,
+                                      arguments.input, arguments.evaluator,
+                                      output)
+        if rc:
+            print("eval.sh exited with {} on {}".format(rc, result))
+        outputs.append(output)
+    return outputs
+
+
+def batched(arguments, scratch):
+    manifest, outputs = osp.join(scratch, 'manifest'), []
+    with open(manifest, 'w') as f:
+        for index, result in enumerate(arguments.results):
+            output = osp.join(scratch, 'output-{}'.format(index))
+            f.write("{}\t{}\n".format(result, output))
+            outputs.append(output)
+    rc = evaluate.evaluate_group_run(manifest, arguments.ground_truth,
+                                     arguments.input, arguments.evaluator)
+    if rc:
+        print("{} exited with {}".format(evaluate.BATCH_SCRIPT, rc))
+    return outputs
+
+
+def bench(arguments):
+    if not utility.file_from_tree(evaluate.BATCH_SCRIPT, arguments.evaluator,
+                                  False):
+        raise utility.FormattedError("'{}' has no {}", arguments.evaluator,
+                                     evaluate.BATCH_SCRIPT)
+    arguments.results = map(utility.resolve_path, arguments.results)
+
+    print("%-10s %6s %10s %12s" % ("protocol", "runs", "seconds", "runs/minute"))
+    outputs = {}
+    for label, invoke in [('eval.sh', per_run), ('eval-batch', batched)]:
+        scratch = tempfile.mkdtemp(prefix='peval-bench-evaluate.')
+        seconds = []
+        for _ in range(arguments.repeat):
+            shutil.rmtree(scratch)
+            os.mkdir(scratch)
+            start = time.time()
+            runs = invoke(arguments, scratch)
+            seconds.append(time.time() - start)
+        best = min(seconds)
+        print("%-10s %6d %10.2f %12.1f" % (
+          label, len(arguments.results), best,
+          60 * len(arguments.results) / best if best else 0))
+        outputs[label] = (scratch, runs)
+
+    try:
+        differ = [result for result, left, right in zip(
+                    arguments.results, outputs['eval.sh'][1],
+                    outputs['eval-batch'][1])
+                  if not (osp.isdir(left) and osp.isdir(right)
+                          and same_tree(left, right))]
+        for result in differ:
+            print("MISMATCH: the evaluations of %s differ" % result)
+    finally:
+        for scratch, _ in outputs.values():
+            shutil.rmtree(scratch)
+
+
+def generate_parser(parser):
+    parser.add_argument('evaluator',
+      help="unpacked evaluator, with an eval.sh and an eval-batch.sh")
+    parser.add_argument('ground_truth',
+      help="unpacked ground truth the results are evaluated against")
+    parser.add_argument('results', nargs='+',
+      help="unpacked run outputs to evaluate")
+    parser.add_argument('--input', default=None,
+      help="unpacked input dataset, for INPUT_DIR (default: ground_truth)")
+    parser.add_argument('--repeat', type=int, default=1,
+      help="times to evaluate every result with either protocol; the "
+           "fastest counts")
+    parser.set_defaults(func=bench)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = generate_parser(argparse.ArgumentParser())
+    arguments = parser.parse_args()
+    for path in ('evaluator', 'ground_truth', 'input'):
+        if getattr(arguments, path):
+            setattr(arguments, path,
+                    utility.resolve_path(getattr(arguments, path)))
+    arguments.input = arguments.input or arguments.ground_truth
+    arguments.func(arguments)
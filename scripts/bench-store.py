@@ -0,0 +1,357 @@
+#!/usr/bin/python
+# bench-store.py -- artifact store benchmarks     -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Benchmarks for the artifact store, run against real artifacts, e.g.
+
+      bench-store.py codecs ~/engines/figaro ~/datasets/cp5/full
+      bench-store.py prepare ~/engines/figaro
+      bench-store.py digest ~/datasets/cp5/full
+      bench-store.py chunks
+      bench-store.py commit --size 1024
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import os
+import os.path as osp
+import shutil
+import tempfile
+import time
+
+import peval.chunkstore as chunkstore
+import peval.codec as codec
+import peval.digest as digests
+import peval.layout as layout
+import peval.utility as utility
+
+
+MB = float(1 << 20)
+
+
+def tree_bytes(path):
+    if osp.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(f) for f in utility.path_walk(path)
+               if not osp.islink(f))
+
+
+def contents_of(path):
+    path = utility.resolve_path(path)
+    if osp.isdir(path):
+        return map(osp.abspath, utility.path_walk(path)), path
+    return [path], utility.resolve_path(osp.dirname(path))
+
+
+def archive(path, dest, c):
+    contents, prefix = contents_of(path)
+    return utility.tarball_list(contents, dest, "bench" + c.suffix, prefix, c)
+
+
+def bench_codecs(arguments):
+    names = arguments.codec or sorted(codec.CODECS)
+
+    print("%-24s %-6s %10s %10s %10s %8s  %s" % (
+      "artifact", "codec", "MiB", "pack MB/s", "unpk MB/s", "ratio", "tool"))
+
+    for path in arguments.paths:
+        raw = tree_bytes(path)
+        for name in names:
+            c = codec.get(name)
+            if not c.available:
+                print("%-24s %-6s unavailable" % (osp.basename(path), name))
+                continue
+
+            scratch = tempfile.mkdtemp(prefix='peval-bench.')
+            try:
+                start = time.time()
+                packed = archive(path, scratch, c)
+                pack_t = time.time() - start
+
+                start = time.time()
+                utility.untar_to_directory(packed, osp.join(scratch, 'out'))
+                unpack_t = time.time() - start
+
+                size = os.path.getsize(packed)
+            finally:
+                shutil.rmtree(scratch)
+
+            tool = c.compress_command()
+            print("%-24s %-6s %10.1f %10.1f %10.1f %8.2f  %s" % (
+              osp.basename(osp.normpath(path))[:24], name, raw / MB,
+              raw / MB / max(pack_t, 1e-9), raw / MB / max(unpack_t, 1e-9),
+              raw / max(size, 1), tool[0] if tool else "python"))
+
+
+def bytes_read():
+    """
+      bytes this process has read so far, page cache hits included
+    """
+    with open('/proc/self/io') as f:
+        for line in f:
+            key, value = line.split(':')
+            if key == 'rchar':
+                return int(value)
+    return 0
+
+
+def bench_prepare(arguments):
+    c = codec.get(arguments.codec)
+
+    print("%-24s %-12s %10s %12s %10s" % (
+      "artifact", "pipeline", "MiB", "MiB read", "seconds"))
+
+    for path in arguments.paths:
+        contents, prefix = contents_of(path)
+        raw = tree_bytes(path)
+
+        def two_pass(scratch):
+            digest = utility.digest_contents(contents, prefix)
+            utility.tarball_list(contents, scratch, "bench" + c.suffix,
+                                 prefix, c)
+            return digest
+
+        def single_pass(scratch):
+            digest, _ = utility.digest_and_tarball(
+              contents, scratch, "bench" + c.suffix, prefix, c)
+            return digest
+
+        digests = []
+        for label, pipeline in [("two-pass", two_pass),
+                                ("single-pass", single_pass)]:
+            scratch = tempfile.mkdtemp(prefix='peval-bench.')
+            try:
+                before, start = bytes_read(), time.time()
+                digests.append(pipeline(scratch))
+                elapsed, read = time.time() - start, bytes_read() - before
+            finally:
+                shutil.rmtree(scratch)
+            print("%-24s %-12s %10.1f %12.1f %10.2f" % (
+              osp.basename(osp.normpath(path))[:24], label, raw / MB,
+              read / MB, elapsed))
+
+        if digests[0] != digests[1]:
+            print("MISMATCH: %s != %s" % tuple(digests))
+
+
+def bench_digest(arguments):
+    print("%-24s %-8s %10s %10s %10s" % (
+      "artifact", "version", "MiB", "seconds", "MB/s"))
+
+    for path in arguments.paths:
+        contents, prefix = contents_of(path)
+        raw = tree_bytes(path)
+        for version in (1, 2):
+            if not digests.available(version):
+                print("%-24s %-8d unavailable" % (osp.basename(path), version))
+                continue
+            start = time.time()
+            utility.digest_contents(contents, prefix, version)
+            elapsed = time.time() - start
+            print("%-24s %-8d %10.1f %10.2f %10.1f" % (
+              osp.basename(osp.normpath(path))[:24], version, raw / MB,
+              elapsed, raw / MB / max(elapsed, 1e-9)))
+
+
+def read_through(path):
+    """
+      reads every member of an archive; returns the bytes read
+    """
+    total = 0
+    with codec.reader(path) as tar:
+        for member in tar:
+            if member.isreg():
+                f = tar.extractfile(member)
+                for buf in iter(lambda: f.read(1 << 20), b''):
+                    total += len(buf)
+    return total
+
+
+def rechunk(path, dest):
+    with codec.reader(path) as src:
+        with codec.writer(dest, codec.get('cdc')) as dst:
+            for member in src:
+                dst.addfile(member,
+                  src.extractfile(member) if member.isreg() else None)
+
+
+def bench_chunks(arguments):
+    if arguments.identifiers:
+        paths = [utility.get_resource(i) for i in arguments.identifiers]
+    else:
+        root = utility.location_resource()
+        names = layout.flat_archives(root) + list(layout.sharded_archives(root))
+        paths = [utility.get_resource(name) for name in names
+                 if not name.endswith('.tar.cdc')]
+
+    print("chunking with %s" % (
+      "numpy" if chunkstore.numpy is not None else "pure python"))
+    print("%-24s %10s %10s %10s %10s %10s" % (
+      "artifact", "MiB", "stored MiB", "unpk MB/s", "chunk MB/s", "cdc MB/s"))
+
+    scratch = tempfile.mkdtemp(prefix='peval-bench.')
+    archived = 0
+    try:
+        for path in paths:
+            start = time.time()
+            raw = read_through(path)
+            unpack_t = time.time() - start
+
+            manifest = osp.join(scratch, osp.basename(path).split('.')[0]
+                                + codec.get('cdc').suffix)
+            start = time.time()
+            rechunk(path, manifest)
+            write_t = time.time() - start
+
+            start = time.time()
+            read_through(manifest)
+            extract_t = time.time() - start
+
+            archived += os.path.getsize(path)
+            print("%-24s %10.1f %10.1f %10.1f %10.1f %10.1f" % (
+              osp.basename(path)[:24], raw / MB, os.path.getsize(path) / MB,
+              raw / MB / max(unpack_t, 1e-9), raw / MB / max(write_t, 1e-9),
+              raw / MB / max(extract_t, 1e-9)))
+
+        chunked = tree_bytes(scratch) + tree_bytes(chunkstore.ROOT)
+    finally:
+        shutil.rmtree(scratch)
+
+    print("store %.1f MiB, chunk store %.1f MiB (%.0f%% saved)" % (
+      archived / MB, chunked / MB, 100 * (1 - chunked / max(archived, 1))))
+
+
+def fill(path, size):
+    block = os.urandom(1 << 20)
+    with open(path, 'wb') as f:
+        for _ in range(size):
+            f.write(block)
+
+
+def bench_commit(arguments):
+    """
+      the copy from a sandbox that commit_resource used to do, against
+      publishing from the staging directory, under each fsync policy.
+      every commit gets a freshly written, not yet flushed archive.
+    """
+    print("%-8s %-22s %10s" % ("MiB", "commit", "seconds"))
+
+    root = utility.location_resource()
+    for size in arguments.size or [256]:
+        sandbox = tempfile.mkdtemp(prefix='peval-bench.')
+        stage = utility.staging_dir()
+        scratch = tempfile.mkdtemp(prefix='.bench.', dir=root)
+        try:
+            def copy(durable):
+                src, dst = osp.join(sandbox, 'out'), osp.join(scratch, 'copy')
+                fill(src, size)
+                start = time.time()
+                shutil.copyfile(src, dst)
+                if durable:
+                    utility.fsync_path(dst)
+                elapsed = time.time() - start
+                os.unlink(dst)
+                return elapsed
+
+            def publish(policy):
+                os.environ['PEVAL_STORE_FSYNC'] = policy
+                src, dst = osp.join(stage, 'out'), osp.join(scratch, 'link')
+                fill(src, size)
+                start = time.time()
+                utility.publish(src, dst)
+                utility.durable(scratch)
+                utility.sync_pending()
+                elapsed = time.time() - start
+                os.unlink(dst)
+                return elapsed
+
+            for label, commit, argument in [
+                ("copy from sandbox", copy, False),
+                ("copy + fsync", copy, True),
+                ("publish, fsync never", publish, 'never'),
+                ("publish, fsync batch", publish, 'batch'),
+                ("publish, fsync always", publish, 'always')]:
+                print("%-8d %-22s %10.3f" % (size, label, commit(argument)))
+        finally:
+            for directory in (sandbox, stage, scratch):
+                shutil.rmtree(directory)
+
+
+def generate_parser(parser):
+    subparsers = parser.add_subparsers(help="benchmark")
+
+    codecs = subparsers.add_parser('codecs',
+      help="compression throughput and ratio for each codec")
+    codecs.add_argument('paths', nargs='+',
+      help="artifact directories or files to pack")
+    codecs.add_argument('--codec', action='append',
+      help="limit to this codec, may be repeated")
+    codecs.set_defaults(func=bench_codecs)
+
+    prepare = subparsers.add_parser('prepare',
+      help="bytes read by the two-pass and single-pass prepare_resource")
+    prepare.add_argument('paths', nargs='+',
+      help="artifact directories or files to pack")
+    prepare.add_argument('--codec', default=codec.DEFAULT,
+      help="codec to archive with; cdc is slow, a few MB/s without numpy")
+    prepare.set_defaults(func=bench_prepare)
+
+    digest = subparsers.add_parser('digest',
+      help="hashing throughput of each digest version")
+    digest.add_argument('paths', nargs='+',
+      help="artifact directories or files to hash")
+    digest.set_defaults(func=bench_digest)
+
+    chunks = subparsers.add_parser('chunks',
+      help="space, chunking and extraction throughput of the chunk store "
+           "against the archives in the store")
+    chunks.add_argument('identifiers', nargs='*',
+      help="artifacts to compare, every archive in the store by default")
+    chunks.set_defaults(func=bench_chunks)
+
+    commit = subparsers.add_parser('commit',
+      help="latency of committing a large archive into the store")
+    commit.add_argument('--size', type=int, action='append',
+      help="MiB in the archive, may be repeated (default 256)")
+    commit.set_defaults(func=bench_commit)
+
+    return parser
+
+
+if __name__ == "__main__":
+    parser = generate_parser(argparse.ArgumentParser())
+    arguments = parser.parse_args()
+
+    # chunks written while benchmarking must not land in the real store
+    chunkstore.ROOT = tempfile.mkdtemp(prefix='peval-bench-chunks.')
+    try:
+        arguments.func(arguments)
+    finally:
+        shutil.rmtree(chunkstore.ROOT)
@@ -52,16 +52,17 @@ for ARUN in $RUN_IDS; do
     DIRNAME=${BASEDIR}/${TEAM}/${UUID};
     mkdir -p ${DIRNAME};
 
-    RESULTARCHIVE=${DATADIR}/${RESULT};
+    # archives live in fan-out directories, or at the top of older stores
+    RESULTARCHIVE=${DATADIR}/${RESULT:0:2}/${RESULT};
+    [ -f ${RESULTARCHIVE} ] || RESULTARCHIVE=${DATADIR}/${RESULT};
     if [ -f ${RESULTARCHIVE} ]; then
 
         cd ${DIRNAME};
-        tar -xjf ${RESULTARCHIVE};
+        tar -xf ${RESULTARCHIVE};
         cd - > /dev/null;
 
-        ###### THE MAX AND AVERAGE COLUMNS ARE STORED BACKWARDS #####
         ROW=`sqlite3 -separator ', ' ${DATABASE} "select id, dataset, duration, \
-             load_max, load_average, ram_max, ram_average from run \
+             load_average, load_max, ram_average, ram_max from run \
              where id='${ARUN}'"`;
         echo -n ${ROW} >> ${RESULTS_FILE};
 
@@ -71,9 +72,9 @@ for ARUN in $RUN_IDS; do
         # HACK: This totals up the number of states
         STATESDIR=`mktemp -d`/;
         RUN_OUTPUT=`sqlite3 ${DATABASE} "select output from run where id='${ARUN}'"`;
-        cp ${DATADIR}/${RUN_OUTPUT} ${STATESDIR}
+        # reads the one file out of the archive instead of unpacking it all
+        peval inspect --cat pcfgla.states ${RUN_OUTPUT} > ${STATESDIR}/pcfgla.states
         cd ${STATESDIR}
-        tar xjf ${RUN_OUTPUT}
         STATES=`cat pcfgla.states | cut -f2 | paste -sd+ | bc`
         NUM_NONTERMINALS=`wc -l pcfgla.states | cut -d' ' -f1`
         cd - > /dev/null;
@@ -53,17 +53,18 @@ for ARUN in $RUN_IDS; do
     DIRNAME=${BASEDIR}/${TEAM}/${UUID};
     mkdir -p ${DIRNAME};
 
-    RESULTARCHIVE=${DATADIR}/${RESULT};
+    # archives live in fan-out directories, or at the top of older stores
+    RESULTARCHIVE=${DATADIR}/${RESULT:0:2}/${RESULT};
+    [ -f ${RESULTARCHIVE} ] || RESULTARCHIVE=${DATADIR}/${RESULT};
     if [ -f ${RESULTARCHIVE} ]; then
 
 
     cd ${DIRNAME};
-    tar -xjf ${RESULTARCHIVE};
+    tar -xf ${RESULTARCHIVE};
     cd - > /dev/null;
 
-###### THE MAX AND AVERAGE COLUMNS ARE STORED BACKWARDS #####
     ROW=`sqlite3 -separator ', ' ${DATABASE} "select id, dataset, duration, \
-         load_max, load_average, ram_max, ram_average from run \
+         load_average, load_max, ram_average, ram_max from run \
          where id='${ARUN}'"`;
     echo -n ${ROW} >> ${RESULTS_FILE};
 
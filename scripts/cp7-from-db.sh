@@ -50,17 +50,18 @@ for RUN in $RUN_IDS; do
     DIRNAME=${BASEDIR}/${TEAM}/${RUN};
     mkdir -p ${DIRNAME};
 
-    RESULTARCHIVE=${DATADIR}/${RESULT};
+    # archives live in fan-out directories, or at the top of older stores
+    RESULTARCHIVE=${DATADIR}/${RESULT:0:2}/${RESULT};
+    [ -f ${RESULTARCHIVE} ] || RESULTARCHIVE=${DATADIR}/${RESULT};
     if [[ ! -f ${RESULTARCHIVE} ]]; then
 	echo "WARNING: No result for run ${RUN}: the run has not been evaluated.";
     else
 	cd ${DIRNAME};
-	tar -xjf ${RESULTARCHIVE};
+	tar -xf ${RESULTARCHIVE};
 	cd - > /dev/null;
 
-	###### THE MAX AND AVERAGE COLUMNS ARE STORED BACKWARDS #####
 	ROW=`sqlite3 -separator ', ' ${DATABASE} "select id, dataset, duration, \
-         load_max, load_average, ram_max, ram_average from run \
+         load_average, load_max, ram_average, ram_max from run \
          where id='${RUN}'"`;
 	echo -n "${ROW}, $TEAM, " >> ${RESULTS_FILE};
 
@@ -29,6 +29,8 @@
 
 import datetime
 import pony.orm as pny
+import peval.plan as plan
+import peval.store as store
 import peval.utility as utility
 import collections
 from peval.model import db, ChallengeProblem, Team, Dataset, Solution, Engine, ConfiguredSolution, Run, Evaluator, Evaluation
@@ -113,35 +115,30 @@ def print_everything():
     #print
     #pny.select((cp, pny.count(cp.datasets)) for cp in ChallengeProblem).show()
 
-    runs = pny.select(
-      (r.id, r.configured_solution.solution, r.configured_solution, r.dataset)
-      for r in Run
-    )
-
-    combos = pny.select(
-        (c.solution.engine, c.solution, c, d)
-        for c in ConfiguredSolution for d in Dataset
-        if c.solution.challenge_problem in d.challenge_problems
-      ).order_by(lambda _e, _s, c, _d: c.meta_updated)
-
-
-    [ran, unran] = utility.split_filter(
-      combos,
-      lambda (pps, cps, con, ds): (cps, con, ds) not in [(r[1], r[2], r[3]) for r in runs]
-      )
+    # the pending runs come from peval plan's anti-join, the completed
+    # ones grouped by the database, rather than every run being compared
+    # with every combination
+    connection = store.connect()
+    try:
+        unran = plan.pending_runs(connection)
+    finally:
+        connection.close()
 
     print_title("Run Command Lines")
-    for pps, cps, con, ds in unran:
-        print_run(pps, cps, con, ds)
+    for r in unran:
+        cps = Solution[r['solution']]
+        print_run(cps.engine, cps,
+                  ConfiguredSolution[r['config'], cps], Dataset[r['dataset']])
+
+    ran = pny.select(
+      (r.engine, r.configured_solution.solution, r.configured_solution,
+       r.dataset, pny.count(r))
+      for r in Run
+    )
 
     print_title("Completed Runs")
-    for pps, cps, con, ds in ran:
-        print_run(
-          pps, cps, con, ds,
-          " This ran " + str(
-            [(s[1], s[2], s[3]) for s in runs].count((cps, con, ds))
-          ) + " times."
-        )
+    for pps, cps, con, ds, times in ran:
+        print_run(pps, cps, con, ds, " This ran " + str(times) + " times.")
 
     print_completed_run_stats()
 
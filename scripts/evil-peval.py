@@ -43,7 +43,7 @@ def hash_by_team():
             if r.evaluation:
                 print "cp ", "~/.local/share/ppaml/"+r.evaluation.id, t.description+'/'
                 with open("CP1-2015/" + t.description + "/" + r.evaluation.id.split('.')[0]+".stats", "w+") as f:
-                    f.write("duration, load_max, load_average, ram_max, ram_average\n")
+                    f.write("duration, load_average, load_max, ram_average, ram_max\n")
                     f.write(str(r.duration)+", "+str(r.load_average)+", "+str(r.load_max)+", "+str(r.ram_average)+", "+str(r.ram_max))
 
 
@@ -57,7 +57,7 @@ def cp2_hashes():
                 print "mkdir -p", fname
                 print "cp ", utility.get_resource(r.evaluation.id), fname
                 with open(fname + r.evaluation.id.split('.')[0]+".stats", "w+") as f:
-                    f.write("duration, load_max, load_average, ram_max, ram_average\n")
+                    f.write("duration, load_average, load_max, ram_average, ram_max\n")
                     f.write(str(r.duration)+", "+str(r.load_average)+", "+str(r.load_max)+", "+str(r.ram_average)+", "+str(r.ram_max))
 
 
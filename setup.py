@@ -48,7 +48,8 @@ setup(
       'peval = peval.peval:main',
     ]
     },
-  scripts = ['scripts/driver-peval.py', 'scripts/evil-peval.py'],
+  scripts = ['scripts/driver-peval.py', 'scripts/evil-peval.py',
+             'scripts/bench-store.py'],
   package_data={'peval': ['db_init.sql']},
   data_files=[('share/%s/%s' % ('peval', x[0]), map(lambda y: x[0]+'/'+y, x[2])) for x in os.walk('example/')],
   long_description=read('README.md'),
@@ -58,6 +59,7 @@ setup(
     'datetime',
     'pony',
     'psutil',
+    'pyblake2; python_version < "3.6"',
     'pyxdg',
   ]
      )
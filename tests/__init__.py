@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# __init__.py -- tests of peval                   -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Tests of peval, run from the top of the repository with
+
+      python -m unittest discover
+
+    Importing peval.model creates index.db in the store, so the store is
+    moved to a scratch directory before any test imports peval.  Tests of
+    queries build an index.db of their own with new_index().
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import atexit
+import os
+import os.path as osp
+import pkgutil
+import shutil
+import sqlite3
+import tempfile
+
+
+SCRATCH = tempfile.mkdtemp(prefix='peval-test.')
+atexit.register(shutil.rmtree, SCRATCH, True)
+os.environ['XDG_DATA_HOME'] = SCRATCH
+
+
+def make_tree(root):
+    """
+      a tree with everything archives and digests treat differently: an
+      executable, a file of several blocks and a second name for it, an
+      empty file and a symlink
+    """
+    os.makedirs(osp.join(root, 'bin'))
+    os.makedirs(osp.join(root, 'data'))
+    with open(osp.join(root, 'bin', 'run.sh'), 'wb') as f:
+        f.write(b'#!/bin/sh\necho hello\n')
+    os.chmod(osp.join(root, 'bin', 'run.sh'), 0o755)
+    with open(osp.join(root, 'data', 'big'), 'wb') as f:
+        f.write(bytes(bytearray(i * 7 % 251 for i in range(3 * 1024 + 5))))
+    os.link(osp.join(root, 'data', 'big'), osp.join(root, 'data', 'copy'))
+    open(osp.join(root, 'data', 'empty'), 'wb').close()
+    os.symlink(osp.join('data', 'big'), osp.join(root, 'link'))
+
+
+"""
+  two teams, each with an engine, a solution and a configuration of it
+  for challenge problem 100, which evaluator EV evaluates, and a dataset
+  of that problem.  ids start at 100, clear of the rows of db_init.sql.
+"""
+FIXTURE = """
+INSERT OR IGNORE INTO team (id, institution, description)
+  VALUES (100, 'alpha university', 'alpha'), (101, 'beta labs', 'beta');
+INSERT OR IGNORE INTO challenge_problem
+  (id, description, revision_major, revision_minor, url)
+  VALUES (100, 'test problem', 1, 0, 'http://example.com/100');
+INSERT OR IGNORE INTO evaluator
+  (id, challenge_problem_id, challenge_problem_revision_major,
+   challenge_problem_revision_minor)
+  VALUES ('EV', 100, 1, 0);
+UPDATE challenge_problem SET evaluator = 'EV' WHERE id = 100;
+INSERT OR IGNORE INTO engine (id, full_path, team)
+  VALUES ('E1', '/engines/alpha', 100), ('E2', '/engines/beta', 101);
+INSERT OR IGNORE INTO solution
+  (id, engine, challenge_problem_id, challenge_problem_revision_major,
+   challenge_problem_revision_minor)
+  VALUES ('S1', 'E1', 100, 1, 0), ('S2', 'E2', 100, 1, 0);
+INSERT OR IGNORE INTO configured_solution (id, filename, solution)
+  VALUES ('C1', 'default.cfg', 'S1'), ('C2', 'default.cfg', 'S2');
+INSERT OR IGNORE INTO dataset
+  (in_digest, eval_digest, rel_inpath, rel_evalpath)
+  VALUES ('D1', 'G1', 'input', 'ground');
+INSERT OR IGNORE INTO ChallengeProblem_Dataset
+  (challengeproblem_id, challengeproblem_revision_major,
+   challengeproblem_revision_minor, dataset)
+  VALUES (100, 1, 0, 'D1');
+"""
+
+
+def new_index(path=':memory:'):
+    """
+      returns a connection to an index.db built as model builds it, from
+      db_init.sql and every one of model.UPGRADES, with the FIXTURE in it
+    """
+    from peval import model
+    connection = sqlite3.connect(path)
+    connection.executescript(pkgutil.get_data('peval', 'db_init.sql'))
+    for version in sorted(model.UPGRADES):
+        connection.executescript(
+          "BEGIN;\n" + model.UPGRADES[version] +
+          "\nPRAGMA user_version = %d;\nCOMMIT;" % version)
+    connection.executescript(FIXTURE)
+    return connection
+
+
+def add_run(connection, run_id, config, solution, engine, output='OUT',
+            started='2026-01-01 12:00:00'):
+    """
+      inserts a run of config of solution over dataset D1
+    """
+    connection.execute(
+      "INSERT INTO Run (id, engine, dataset, output, started, duration, "
+      "configured_solution_id, configured_solution_solution, load_average, "
+      "load_max, ram_average, ram_max) "
+      "VALUES (?, ?, 'D1', ?, ?, 1, ?, ?, 0, 0, 0, 0)",
+      (run_id, engine, output, started, config, solution))
+
+
+def store_index():
+    """
+      returns a connection to the scratch store's index.db, which model
+      built, with the FIXTURE in it
+    """
+    from peval import model
+    connection = sqlite3.connect(model.DB_LOC)
+    connection.executescript(FIXTURE)
+    return connection
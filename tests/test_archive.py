@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# test_archive.py -- tests of canonical archives  -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    An archive of a tree must not depend on the host it was made on:
+    owners, timestamps and mode bits other than executable are dropped.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import os.path as osp
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from . import SCRATCH, make_tree
+
+from peval import codec
+from peval import utility
+
+
+class CanonicalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=SCRATCH)
+        self.root = osp.join(self.directory, 'tree') + os.sep
+        make_tree(self.root)
+        self.contents = [osp.abspath(p) for p in utility.path_walk(self.root)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def archive(self, name):
+        path = utility.tarball_list(self.contents, self.directory, name,
+                                    self.root, codec.get('gz'))
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_metadata(self):
+        self.archive('tree.tar.gz')
+        with tarfile.open(osp.join(self.directory, 'tree.tar.gz')) as tar:
+            members = dict((m.name, m) for m in tar)
+        self.assertEqual(sorted(members), ['bin/run.sh', 'data/big',
+          'data/copy', 'data/empty', 'link'])
+        for member in members.values():
+            self.assertEqual((member.uid, member.gid), (0, 0))
+            self.assertEqual((member.uname, member.gname), ('', ''))
+            self.assertEqual(member.mtime, utility.CANONICAL_MTIME)
+        self.assertEqual(members['bin/run.sh'].mode, 0o755)
+        self.assertEqual(members['data/big'].mode, 0o644)
+        self.assertEqual(members['link'].mode, 0o777)
+        self.assertTrue(members['data/copy'].islnk())
+
+    def test_independent_of_host(self):
+        first = self.archive('first.tar.gz')
+        for name in ['bin/run.sh', 'data/big', 'data/empty']:
+            os.utime(osp.join(self.root, name), (1e9, 1e9))
+        os.chmod(osp.join(self.root, 'bin', 'run.sh'), 0o700)
+        os.chmod(osp.join(self.root, 'data', 'big'), 0o600)
+        self.assertEqual(first, self.archive('second.tar.gz'))
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# test_codec.py -- tests of archive codecs        -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    An archive written with a codec's tool must be readable through its
+    python fallback and the other way around, since the host reading an
+    archive may not have the tool of the host that wrote it.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import contextlib
+import io
+import os
+import os.path as osp
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from . import SCRATCH
+
+from peval import codec
+
+
+@contextlib.contextmanager
+def without_tools():
+    path = os.environ.get('PATH')
+    os.environ['PATH'] = ''
+    try:
+        yield
+    finally:
+        if path is None:
+            del os.environ['PATH']
+        else:
+            os.environ['PATH'] = path
+
+
+def fallback(c):
+    with without_tools():
+        return c.available
+
+
+class CodecTest(unittest.TestCase):
+
+    CONTENTS = bytes(bytearray(i % 253 for i in range(1 << 20)))
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=SCRATCH)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, c):
+        path = osp.join(self.directory, 'archive' + c.suffix)
+        with codec.writer(path, c) as tar:
+            member = tarfile.TarInfo('data')
+            member.size = len(self.CONTENTS)
+            tar.addfile(member, io.BytesIO(self.CONTENTS))
+        return path
+
+    def check(self, path):
+        with codec.reader(path) as tar:
+            member = next(iter(tar))
+            self.assertEqual(member.name, 'data')
+            self.assertEqual(tar.extractfile(member).read(), self.CONTENTS)
+
+    def test_fallback_round_trip(self):
+        for c in codec.CODECS.values():
+            if not fallback(c):
+                continue
+            with without_tools():
+                self.check(self.write(c))
+
+    def test_tool_to_fallback(self):
+        for c in codec.CODECS.values():
+            if not c.compress_command() or not fallback(c):
+                continue
+            path = self.write(c)
+            with without_tools():
+                self.check(path)
+
+    def test_fallback_to_tool(self):
+        for c in codec.CODECS.values():
+            if not c.decompress_command() or not fallback(c):
+                continue
+            with without_tools():
+                path = self.write(c)
+            self.check(path)
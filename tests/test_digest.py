@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# test_digest.py -- tests of artifact digests     -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Every way of computing a digest must give the same identifier for the
+    same tree: prepare_resource's single pass, digest_contents, which
+    archives nothing, and, for version 2, digest_archive over the archive
+    that was written.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import os.path as osp
+import shutil
+import tempfile
+import threading
+import unittest
+
+from . import SCRATCH, make_tree
+
+from peval import codec
+from peval import digest
+from peval import utility
+
+
+class DigestTest(unittest.TestCase):
+
+    def setUp(self):
+        # small blocks, so that files are split into several leaves
+        self.block = digest.BLOCK
+        digest.BLOCK = 1024
+        self.directory = tempfile.mkdtemp(dir=SCRATCH)
+        self.root = osp.join(self.directory, 'tree') + os.sep
+        make_tree(self.root)
+        self.contents = [osp.abspath(p) for p in utility.path_walk(self.root)]
+
+    def tearDown(self):
+        digest.BLOCK = self.block
+        shutil.rmtree(self.directory)
+
+    def archive(self, version):
+        """
+          returns (digest, archive) of the single pass
+        """
+        return utility.digest_and_tarball(
+          self.contents, self.directory, 'tree.tar', self.root,
+          codec.get('none'), utility.new_digest(self.contents, version))
+
+    def test_version_1(self):
+        hexdigest, _ = self.archive(1)
+        self.assertEqual(digest.version_of(hexdigest), 1)
+        self.assertEqual(hexdigest, utility.digest_paths(self.contents))
+        self.assertEqual(hexdigest,
+                         utility.digest_contents(self.contents, self.root, 1))
+
+    @unittest.skipUnless(digest.available(2), "needs BLAKE2")
+    def test_version_2(self):
+        hexdigest, path = self.archive(2)
+        self.assertEqual(digest.version_of(hexdigest), 2)
+        self.assertEqual(hexdigest,
+                         utility.digest_contents(self.contents, self.root, 2))
+        items = [(p, p[len(self.root):]) for p in self.contents]
+        for threads in [1, 4]:
+            self.assertEqual(hexdigest, digest.digest_files(items, threads))
+        with codec.reader(path) as tar:
+            self.assertEqual(hexdigest, digest.digest_archive(tar))
+
+    @unittest.skipUnless(digest.available(2), "needs BLAKE2")
+    def test_version_2_covers_contents(self):
+        before = utility.digest_contents(self.contents, self.root, 2)
+        with open(osp.join(self.root, 'data', 'big'), 'r+b') as f:
+            f.seek(2048)
+            f.write(b'!')
+        self.assertNotEqual(
+          before, utility.digest_contents(self.contents, self.root, 2))
+
+    @unittest.skipUnless(digest.available(2), "needs BLAKE2")
+    def test_failed_archive_stops_pool(self):
+        threads = threading.active_count()
+        os.unlink(osp.join(self.root, 'bin', 'run.sh'))
+        with self.assertRaises(OSError):
+            self.archive(2)
+        self.assertEqual(threading.active_count(), threads)
+        self.assertFalse(osp.exists(osp.join(self.directory, 'tree.tar')))
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# test_evaluate.py -- tests of pending evaluations  -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import (absolute_import, division, print_function)
+
+import unittest
+
+from . import add_run, new_index
+
+from peval import evaluate
+
+
+class PendingEvaluationsTest(unittest.TestCase):
+    """
+      runs 1 to 5 of team alpha and 6 and 7 of team beta, one a day from
+      2026-10-01, with outputs OUT1, OUT2, OUT0, OUT1, ...; run 3 was
+      evaluated and run 4 failed to be
+    """
+
+    def setUp(self):
+        self.connection = new_index()
+        for n in range(1, 8):
+            team = '1' if n <= 5 else '2'
+            add_run(self.connection, n, 'C' + team, 'S' + team, 'E' + team,
+                    'OUT%d' % (n % 3), '2026-10-%02d 12:00:00' % n)
+        self.connection.execute(
+          "INSERT INTO evaluation (id, evaluator, run, did_succeed) "
+          "VALUES ('EVAL3', 'EV', 3, 1), ('EVAL4', 'EV', 4, 0)")
+
+    def tearDown(self):
+        self.connection.close()
+
+    def pending(self, batch=evaluate.BATCH, **filters):
+        filters = evaluate.pending_filters(**filters)
+        return [[p.run_id for p in b] for b in
+                evaluate.pending_evaluations(self.connection, filters, batch)]
+
+    def test_runs_without_evaluation(self):
+        self.assertEqual(evaluate.count_pending(self.connection), 5)
+        self.assertEqual(self.pending(), [[1, 2, 5, 6, 7]])
+        self.assertEqual(self.pending(batch=2), [[1, 2], [5, 6], [7]])
+
+    def test_pending(self):
+        first = next(evaluate.pending_evaluations(self.connection))[0]
+        self.assertEqual(first, evaluate.Pending(
+          run_id=1, output='OUT1', eval_digest='G1', in_digest='D1',
+          evaluator='EV', cp_ids=(100, 1, 0), team=100, cached=None))
+
+    def test_cached(self):
+        # run 6 has the output of run 3; run 4's failed evaluation is
+        # nothing to reuse for runs 1 and 7
+        cached = dict((p.run_id, p.cached) for b in
+                      evaluate.pending_evaluations(self.connection) for p in b)
+        self.assertEqual(cached, {1: None, 2: None, 5: None, 6: 'EVAL3',
+                                  7: None})
+
+    def test_filters(self):
+        self.assertEqual(self.pending(team='beta'), [[6, 7]])
+        self.assertEqual(self.pending(team=100), [[1, 2, 5]])
+        self.assertEqual(self.pending(challenge_problem=999), [])
+        self.assertEqual(self.pending(since='2026-10-05'), [[5, 6, 7]])
+        self.assertEqual(evaluate.count_pending(
+          self.connection, evaluate.pending_filters(since='2026-10-05')), 3)
+
+    def test_evaluated_while_walking(self):
+        batches = evaluate.pending_evaluations(self.connection, batch=2)
+        self.assertEqual([p.run_id for p in next(batches)], [1, 2])
+        self.connection.execute(
+          "INSERT INTO evaluation (id, evaluator, run, did_succeed) "
+          "VALUES ('EVAL1', 'EV', 1, 1), ('EVAL5', 'EV', 5, 1)")
+        self.assertEqual([[p.run_id for p in b] for b in batches],
+                         [[6, 7]])
+
+    def test_run(self):
+        row = self.connection.execute(evaluate.RUN, [3]).fetchone()
+        self.assertEqual(evaluate.pending_row(row).output, 'OUT0')
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# test_garbage.py -- tests of peval store gc      -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import os.path as osp
+import unittest
+
+from . import SCRATCH, store_index
+
+from peval import garbage
+from peval import layout
+from peval import members
+from peval import utility
+
+
+NAME = 'ee' + '0' * 38 + '.tar.bz2'
+
+
+class FlatTest(unittest.TestCase):
+
+    def setUp(self):
+        store_index().close()
+        self.root = osp.normpath(utility.location_resource())
+        self.grace = garbage.GRACE
+        # everything written by the test counts as old enough to go
+        garbage.GRACE = -60
+
+    def tearDown(self):
+        garbage.GRACE = self.grace
+        for path in [osp.join(self.root, NAME),
+                     layout.artifact_path(self.root, NAME)]:
+            for p in [path, members.index_path(path)]:
+                if osp.exists(p):
+                    os.unlink(p)
+
+    def write(self, path, size):
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+
+    def found(self, swept):
+        return sorted((g.kind, osp.basename(g.path), g.size) for g in swept)
+
+    def test_dry_run_finds_flat_archives(self):
+        flat = osp.join(self.root, NAME)
+        self.write(flat, 10)
+        self.write(members.index_path(flat), 3)
+
+        dry = self.found(garbage.collect(threads=1, dry_run=True))
+        self.assertTrue(osp.exists(flat))
+        self.assertIn(('archive', NAME, 10), dry)
+        self.assertEqual(dry, self.found(garbage.collect(threads=1)))
+        self.assertFalse(osp.exists(flat))
+        self.assertFalse(osp.exists(layout.artifact_path(self.root, NAME)))
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# test_jobqueue.py -- tests of the job queue      -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import (absolute_import, division, print_function)
+
+import os.path as osp
+import shutil
+import tempfile
+import unittest
+
+from . import SCRATCH
+
+from peval import jobqueue
+
+
+COMMAND = ['run', 'C1', 'S1', 'E1', 'D1']
+
+
+class AddTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=SCRATCH)
+        self.queue = jobqueue.JobQueue(osp.join(self.directory, 'queue.db'))
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.directory)
+
+    def states(self):
+        return self.queue.connection.execute(
+          "SELECT state, attempts FROM job").fetchall()
+
+    def finished(self, rc):
+        self.assertTrue(self.queue.add(COMMAND, team=100))
+        job = self.queue.lease('w', node='n')
+        self.queue.finish(job.id, 'w', rc)
+
+    def test_pending_not_added_twice(self):
+        self.assertTrue(self.queue.add(COMMAND, team=100))
+        self.assertFalse(self.queue.add(COMMAND, team=100))
+        self.assertEqual(self.states(), [('pending', 0)])
+
+    def test_leased_not_added_twice(self):
+        self.assertTrue(self.queue.add(COMMAND, team=100))
+        self.queue.lease('w', node='n')
+        self.assertFalse(self.queue.add(COMMAND, team=100))
+        self.assertEqual(self.states(), [('leased', 1)])
+
+    def test_failed_queued_again(self):
+        self.finished(1)
+        self.assertEqual(self.states(), [('failed', 1)])
+        self.assertTrue(self.queue.add(COMMAND, team=100, priority=2))
+        self.assertEqual(self.states(), [('pending', 0)])
+        job = self.queue.lease('w', node='n')
+        self.assertEqual((job.command, job.priority), (COMMAND, 2))
+
+    def test_done_queued_again(self):
+        self.finished(0)
+        self.assertTrue(self.queue.add(COMMAND, team=100))
+        self.assertEqual(self.states(), [('pending', 0)])
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# test_layout.py -- tests of the store layout     -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import os.path as osp
+import shutil
+import tempfile
+import unittest
+
+from . import SCRATCH
+
+from peval import layout
+from peval import members
+
+
+FIRST = 'abc1' + '0' * 36 + '.tar.bz2'
+SECOND = 'abc2' + '0' * 36 + '.tar.bz2'
+
+
+class LayoutTest(unittest.TestCase):
+    """
+      a store from before the fan-out, with two archives at the top level
+      whose identifiers share the prefix 'abc'
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(dir=SCRATCH)
+        for name in [FIRST, SECOND]:
+            open(osp.join(self.root, name), 'w').close()
+        open(members.index_path(osp.join(self.root, FIRST)), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_resolve_moves_into_place(self):
+        self.assertEqual(layout.resolve(self.root, 'abc1'), [FIRST])
+        self.assertTrue(osp.isfile(layout.artifact_path(self.root, FIRST)))
+        self.assertTrue(osp.isfile(members.index_path(
+          layout.artifact_path(self.root, FIRST))))
+        self.assertFalse(osp.exists(osp.join(self.root, FIRST)))
+        self.assertEqual(layout.resolve(self.root, 'abc1'), [FIRST])
+
+    def test_migrated_one_of_two(self):
+        # as get_resource does for an exact identifier
+        layout.migrate_one(self.root, FIRST)
+        self.assertEqual(layout.resolve(self.root, 'abc'), [FIRST, SECOND])
+        self.assertEqual(layout.resolve(self.root, 'abc1'), [FIRST])
+        self.assertEqual(layout.resolve(self.root, 'abc2'), [SECOND])
+
+    def test_migrate(self):
+        self.assertEqual(layout.migrate(self.root), 2)
+        self.assertEqual(layout.flat_archives(self.root), [])
+        index = layout.PrefixIndex(self.root)
+        try:
+            self.assertTrue(index.migrated)
+        finally:
+            index.close()
+        self.assertEqual(layout.resolve(self.root, 'abc'), [FIRST, SECOND])
+        self.assertEqual(layout.resolve(self.root, 'abd'), [])
+
+    def test_migrate_one_twice(self):
+        path = layout.migrate_one(self.root, FIRST)
+        self.assertEqual(path, layout.artifact_path(self.root, FIRST))
+        self.assertEqual(layout.migrate_one(self.root, FIRST), None)
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# test_limits.py -- tests of run limits           -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import os.path as osp
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+
+from . import SCRATCH, store_index
+
+from peval import limits
+from peval import report
+from peval import run
+from peval import utility
+from peval.limits import Limits
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_sizes(self):
+        self.assertEqual(limits.parse_size('1000'), 1000)
+        self.assertEqual(limits.parse_size('512M'), 512 << 20)
+        self.assertEqual(limits.parse_size('4g'), 4 << 30)
+        self.assertEqual(limits.parse_size('1.5k'), 1536)
+        self.assertEqual(limits.parse_size(' 10MB '), 10 << 20)
+        self.assertRaises(ValueError, limits.parse_size, 'lots')
+
+    def test_seconds(self):
+        self.assertEqual(limits.parse_seconds('90'), 90)
+        self.assertEqual(limits.parse_seconds('90s'), 90)
+        self.assertEqual(limits.parse_seconds('30m'), 1800)
+        self.assertEqual(limits.parse_seconds('2h'), 7200)
+        self.assertEqual(limits.parse_seconds('0.5d'), 43200)
+
+    def test_limits(self):
+        parsed = Limits.parse(dict(memory='1g', cpu_seconds='',
+                                   wall_seconds='none', file_size=None,
+                                   output_size='20M'))
+        self.assertEqual(parsed, Limits(1 << 30, None, None, None, 20 << 20))
+        self.assertTrue(parsed)
+        self.assertFalse(limits.NONE)
+        self.assertEqual(parsed.update(Limits(None, 60.0, None, None, 1)),
+                         Limits(1 << 30, 60.0, None, None, 1))
+
+    def test_per_challenge_problem(self):
+        store_index().close()
+        os.environ['PEVAL_LIMITS_MEMORY'] = '1g'
+        os.environ['PEVAL_LIMITS_WALL_SECONDS'] = '1h'
+        os.environ['PEVAL_LIMITS_CP100_WALL_SECONDS'] = '2h'
+        try:
+            self.assertEqual(run.solution_limits('S1'),
+                             Limits(1 << 30, None, 7200.0, None, None))
+        finally:
+            for name in ['MEMORY', 'WALL_SECONDS', 'CP100_WALL_SECONDS']:
+                del os.environ['PEVAL_LIMITS_' + name]
+
+    def test_unknown_solution(self):
+        store_index().close()
+        with self.assertRaises(utility.FormattedError):
+            run.solution_limits('S9')
+
+
+class EnforcedTest(unittest.TestCase):
+
+    LIMITS = Limits(None, 10.0, None, 1000, None)
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp(dir=SCRATCH)
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def write(self, size):
+        with open(osp.join(self.output, 'out'), 'wb') as f:
+            f.write(b'x' * size)
+
+    def enforced(self, rc, cpu=0.0):
+        usage = dict(user_seconds=cpu, system_seconds=0.0)
+        return limits.enforced_limit(rc, self.LIMITS, usage, self.output)
+
+    def test_signals(self):
+        self.assertEqual(self.enforced(-signal.SIGXCPU), 'cpu_seconds')
+        self.assertEqual(self.enforced(128 + signal.SIGXCPU), 'cpu_seconds')
+        self.assertEqual(self.enforced(-signal.SIGXFSZ), 'file_size')
+        self.assertEqual(self.enforced(128 + signal.SIGXFSZ), 'file_size')
+
+    def test_success_hits_nothing(self):
+        self.write(2000)
+        self.assertEqual(self.enforced(0, cpu=20.0), None)
+
+    def test_failure_over_limit(self):
+        self.assertEqual(self.enforced(1, cpu=10.5), 'cpu_seconds')
+        self.write(1001)
+        self.assertEqual(self.enforced(1), 'file_size')
+
+    def test_failure_at_limit(self):
+        # the kernel allows exactly the limit
+        self.write(1000)
+        self.assertEqual(self.enforced(1, cpu=10.0), None)
+        self.assertEqual(self.enforced(-signal.SIGKILL, cpu=1.0), None)
+
+
+class SavedTest(unittest.TestCase):
+
+    def test_saved_with_run(self):
+        store_index().close()
+        now = time.time()
+        held = Limits(1 << 30, 10.0, None, 1000, None)
+        run_id = run.save_run('E1', 'S1', 'default.cfg', 'D1', 'OUT', None,
+                              (now - 2, now), (1.0, 0.5), (2048.0, 1024.0),
+                              dict(limits=held, limit_hit='cpu_seconds'))
+        _, _, _, saved = report.run_usage(run_id)
+        self.assertEqual(saved, dict(held._asdict(), hit='cpu_seconds'))
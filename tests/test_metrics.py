@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# test_metrics.py -- tests of evaluator metrics   -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import (absolute_import, division, print_function)
+
+import time
+import unittest
+
+from . import store_index
+
+from peval import metrics
+from peval import model as mod
+from peval import run
+
+
+class TypedTest(unittest.TestCase):
+
+    def test_numbers(self):
+        self.assertEqual(metrics.typed(3), 3.0)
+        self.assertEqual(metrics.typed(True), 1.0)
+        self.assertEqual(metrics.typed(' 0.25 '), 0.25)
+        self.assertIsInstance(metrics.typed(1 << 62), float)
+
+    def test_text(self):
+        self.assertEqual(metrics.typed(' pcfgla '), 'pcfgla')
+        self.assertEqual(metrics.typed([1, 2]), '[1, 2]')
+        self.assertEqual(metrics.typed(10 ** 400), str(10 ** 400))
+
+    def test_non_finite(self):
+        self.assertEqual(metrics.typed(float('nan')), 'nan')
+        self.assertEqual(metrics.typed(float('-inf')), '-inf')
+        self.assertEqual(metrics.typed('NaN'), 'NaN')
+        self.assertEqual(metrics.parse('metrics.json',
+                                       '{"f1": NaN, "a": {"b": Infinity}}'),
+                         {'f1': 'nan', 'a.b': 'inf'})
+        self.assertEqual(metrics.parse('metrics.csv', 'name,value\nf1,inf\n'),
+                         {'f1': 'inf'})
+
+
+class SavedTest(unittest.TestCase):
+
+    def test_non_finite_survives(self):
+        store_index().close()
+        now = time.time()
+        run_id = run.save_run('E1', 'S1', 'default.cfg', 'D1', 'OUT', None,
+                              (now - 2, now), (1.0, 0.5), (2048.0, 1024.0))
+        reported = metrics.parse_json(
+          '{"f1": 0.5, "loss": NaN, "best": -Infinity, "parser": "pcfgla"}')
+        with mod.pny.db_session:
+            metrics.replace_metrics(mod.Run[run_id], reported)
+        with mod.pny.db_session:
+            saved = dict((m.name, m.value if m.text is None else m.text)
+                         for m in mod.Run[run_id].metrics)
+        self.assertEqual(saved, dict(f1=0.5, loss='nan', best='-inf',
+                                     parser='pcfgla'))
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# test_model.py -- index.db creation and upgrades -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import (absolute_import, division, print_function)
+
+import sqlite3
+import unittest
+
+from . import SCRATCH
+
+from peval import model
+
+
+def version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+class StepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:', isolation_level=None)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_statements_keep_triggers_whole(self):
+        script = """
+          CREATE TABLE a (x INTEGER); -- trailing comment
+          CREATE TRIGGER t AFTER INSERT ON a BEGIN
+            UPDATE a SET x = 1; SELECT 2;
+          END;
+        """
+        found = list(model.statements(script))
+        self.assertEqual(len(found), 2)
+        self.assertIn('SELECT 2;', found[1])
+
+    def test_step_applies_once(self):
+        script = "CREATE TABLE a (x INTEGER);"
+        model.apply_step(self.connection, 3, script)
+        self.assertEqual(version(self.connection), 3)
+        # a second process finding the step done under the lock skips it,
+        # where running the script again would fail on the existing table
+        model.apply_step(self.connection, 3, script)
+        self.assertEqual(version(self.connection), 3)
+
+    def test_failed_step_rolls_back(self):
+        script = "CREATE TABLE a (x INTEGER);\nINSERT INTO missing VALUES (1);"
+        with self.assertRaises(sqlite3.OperationalError):
+            model.apply_step(self.connection, 3, script)
+        self.assertEqual(version(self.connection), 0)
+        tables = self.connection.execute(
+          "SELECT name FROM sqlite_master WHERE name = 'a'").fetchall()
+        self.assertEqual(tables, [])
+
+    def test_upgraded_store(self):
+        connection = sqlite3.connect(model.DB_LOC)
+        try:
+            self.assertEqual(version(connection), max(model.UPGRADES))
+        finally:
+            connection.close()
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# test_plan.py -- tests of pending runs           -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import (absolute_import, division, print_function)
+
+import unittest
+
+from . import add_run, new_index
+
+from peval import plan
+
+
+class PendingRunsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = new_index()
+
+    def tearDown(self):
+        self.connection.close()
+
+    def pending(self, **filters):
+        return [(r['config'], r['dataset'])
+                for r in plan.pending_runs(self.connection, **filters)]
+
+    def test_every_configuration_and_dataset(self):
+        runs = plan.pending_runs(self.connection)
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(runs[0], dict(engine='E1', solution='S1',
+          config='C1', dataset='D1', team=100, challenge_problem=100,
+          revision=1, filename='default.cfg'))
+        self.assertEqual(runs[1]['config'], 'C2')
+
+    def test_made_runs(self):
+        add_run(self.connection, 1, 'C1', 'S1', 'E1')
+        self.assertEqual(self.pending(), [('C2', 'D1')])
+        add_run(self.connection, 2, 'C2', 'S2', 'E2')
+        self.assertEqual(self.pending(), [])
+
+    def test_filters(self):
+        self.assertEqual(self.pending(team='beta'), [('C2', 'D1')])
+        self.assertEqual(self.pending(team=100), [('C1', 'D1')])
+        self.assertEqual(self.pending(team='nobody'), [])
+        self.assertEqual(len(self.pending(challenge_problem=100)), 2)
+        self.assertEqual(self.pending(challenge_problem=999), [])
+        self.assertEqual(self.pending(team='alpha', challenge_problem=100),
+                         [('C1', 'D1')])
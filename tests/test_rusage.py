@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# test_rusage.py -- tests of the rusage of runs   -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import (absolute_import, division, print_function)
+
+import time
+import unittest
+
+from . import store_index
+
+from peval import report
+from peval import run
+from peval import series
+
+
+def usage(seconds):
+    return dict(wall_seconds=seconds, user_seconds=seconds / 2,
+                system_seconds=0.25, max_rss=20480, major_faults=1,
+                minor_faults=1000, voluntary_switches=12,
+                involuntary_switches=3)
+
+
+class RusageTest(unittest.TestCase):
+
+    def setUp(self):
+        store_index().close()
+
+    def save(self, measures):
+        now = time.time()
+        return run.save_run('E1', 'S1', 'default.cfg', 'D1', 'OUT', None,
+                            (now - 2, now), (1.0, 0.5), (2048.0, 1024.0),
+                            measures)
+
+    def test_phases(self):
+        rusage = dict(pre_process={}, run=usage(2.0), post_process=usage(0.5))
+        samples, exact, phases, held = report.run_usage(
+          self.save(dict(rusage=rusage)))
+        # a phase without a script has no row
+        self.assertEqual(phases, dict(run=usage(2.0),
+                                      post_process=usage(0.5)))
+        self.assertEqual((samples, exact, held), ([], None, None))
+
+    def test_samples(self):
+        sample = series.Sample(0.5, 1.0, 4096, 2048, 2, 0, 0)
+        samples, _, phases, _ = report.run_usage(
+          self.save(dict(samples=[sample])))
+        self.assertEqual(samples, [sample])
+        self.assertEqual(phases, {})
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# test_series.py -- tests of resource time series -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import (absolute_import, division, print_function)
+
+import unittest
+
+from peval import series
+from peval.series import Sample
+
+
+SAMPLES = [
+    Sample(0.0, 0.0, 10240, 2048, 1, 0, 0),
+    Sample(0.25, 1.5, 512000, 204800, 4, 1 << 20, 4096),
+    Sample(0.75, 3.998, 512000, 102400, 9, 1 << 20, 1 << 40),
+    Sample(1.5, 0.002, 4096, 1024, 1, 5 << 30, 1 << 40),
+]
+
+
+class SeriesTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        blob = series.encode(SAMPLES)
+        self.assertEqual(series.decode(blob), SAMPLES)
+        self.assertEqual(series.decode(buffer(blob)), SAMPLES)
+
+    def test_round_trip_rounds_to_scale(self):
+        sample = Sample(1.23456, 0.98765, 1, 1, 1, 1, 1)
+        self.assertEqual(series.decode(series.encode([sample])),
+                         [sample._replace(time=1.235, load=0.988)])
+
+    def test_empty(self):
+        self.assertEqual(series.decode(series.encode([])), [])
+
+    def test_unknown_version(self):
+        blob = bytearray(series.encode(SAMPLES))
+        blob[0] = series.VERSION + 1
+        self.assertRaises(ValueError, series.decode, bytes(blob))
+
+    def test_percentile_weighs_time(self):
+        self.assertEqual(series.weights(SAMPLES), [0.25, 0.25, 0.5, 0.75])
+        # the last sample stands for 0.75 of 1.75 seconds, so rss stays at
+        # or below its 1024 for 40% of the time, though it is one sample
+        # of four
+        self.assertEqual(series.percentile(SAMPLES, 'rss', 0.4), 1024)
+        self.assertEqual(series.percentile(SAMPLES, 'rss', 0.5), 2048)
+        self.assertEqual(series.percentile(SAMPLES, 'rss', 1.0), 204800)
+        self.assertEqual(series.peak(SAMPLES, 'rss'), SAMPLES[1])
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# test_stats.py -- tests of run statistics        -*- coding: us-ascii -*-
+# Copyright (C) 2014  Galois, Inc.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#   1. Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#   2. Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in
+#      the documentation and/or other materials provided with the
+#      distribution.
+#   3. Neither Galois's name nor the names of other contributors may be
+#      used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY GALOIS AND OTHER CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL GALOIS OR OTHER
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import (absolute_import, division, print_function)
+
+import random
+import unittest
+
+from peval import stats
+
+
+class StatsTest(unittest.TestCase):
+
+    def test_median_and_mad(self):
+        self.assertEqual(stats.median([3, 1, 2]), 2)
+        self.assertEqual(stats.median([4, 1, 3, 2]), 2.5)
+        self.assertEqual(stats.mad([1, 2, 3, 4, 100]), 1)
+
+    def test_interval(self):
+        values = [10.0 + 0.1 * i for i in range(20)]
+        low, high = stats.bootstrap_interval(values)
+        self.assertTrue(low <= stats.median(values) <= high)
+        self.assertTrue(low > min(values) and high < max(values))
+        # a fixed seed, so the same values give the same interval
+        self.assertEqual(stats.bootstrap_interval(values), (low, high))
+
+    def test_interval_narrows(self):
+        rng = random.Random(1)
+        few = [rng.gauss(10, 1) for _ in range(5)]
+        many = [rng.gauss(10, 1) for _ in range(200)]
+        low, high = stats.bootstrap_interval(few)
+        narrow_low, narrow_high = stats.bootstrap_interval(many)
+        self.assertTrue(narrow_low < 10 < narrow_high)
+        self.assertLess(narrow_high - narrow_low, high - low)
+
+    def test_interval_widens_with_confidence(self):
+        values = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
+        low, high = stats.bootstrap_interval(values, 0.5)
+        wide_low, wide_high = stats.bootstrap_interval(values, 0.99)
+        self.assertTrue(wide_low <= low <= high <= wide_high)
+        self.assertLess(high - low, wide_high - wide_low)
+
+    def test_constant(self):
+        summary = stats.summarize([2.0] * 5)
+        self.assertEqual(summary, stats.Summary(5, 2.0, 0.0, 2.0, 2.0, []))
+
+    def test_outliers(self):
+        values = [1.0, 1.1, 0.9, 1.0, 1.05, 5.0]
+        self.assertEqual(stats.outliers(values), [5])
+        self.assertEqual(stats.summarize(values).outliers, [5])
+
+    def test_converged(self):
+        self.assertFalse(stats.converged([1.0, 1.0], 0.05))
+        self.assertTrue(stats.converged([1.0, 1.0, 1.0], 0.05))
+        self.assertFalse(stats.converged([1.0, 2.0, 4.0, 8.0], 0.05))